@@ -0,0 +1,171 @@
+import base64
+import html
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from string import Formatter
+from smtp_pool import SMTPPool
+
+# HTML email templates and sending.
+# Template compiles its source once (at import, so once per container) into a python
+# function that formats the fields and joins them with the static text in one go, so a
+# table of n rows costs n row renders and one join. Values are HTML-escaped unless
+# wrapped in Markup (e.g. rows rendered by another template); missing values render
+# as None. Fields use str.format syntax: {orderId}, {orderTotal:.2f}.
+#
+#   ROW = Template('<tr><td>{productId}</td><td>${productPrice:.2f}</td></tr>')
+#   PAGE = Template('<table>{rows}</table>')
+#   PAGE.render(rows=ROW.render_many(items))
+#
+# html_message builds the MIME text of an html email; Mailer sends it over a pooled
+# SMTP connection (see smtp_pool.py). With EMAIL_QUEUE_URL set, Mailer puts the email
+# on that SQS queue instead and returns right away; email_dispatcher.py drains the
+# queue at the rate the mail server accepts.
+#
+# mailer.py and smtp_pool.py are the one copy shared by FanOut and Resume Shortlisting,
+# deployed as a Lambda layer attached to every function that sends email:
+#   cd EmailLayer && zip -r email-layer.zip python
+# Scripts run locally with PYTHONPATH=EmailLayer/python. tests/test_mailer.py checks
+# the compiled templates against plain str.format and html.escape rendering.
+
+CONVERSIONS = {'r': 'repr', 's': 'str', 'a': 'ascii'}
+# header lines longer than this are folded by the email package
+MAX_HEADER_LENGTH = 78
+
+EMAIL_QUEUE_URL = os.environ.get('EMAIL_QUEUE_URL')
+# SQS message size limit; larger html is sent compressed
+MAX_QUEUE_MESSAGE_BYTES = 256 * 1024
+
+
+class Markup(str):
+    # html that is inserted as it is
+    pass
+
+
+class Template:
+    def __init__(self, source):
+        self.source = source
+        parsed = list(Formatter().parse(source))
+        if all(name is None for _, name, _, _ in parsed):
+            # static text only, rendered once
+            self.static = Markup(''.join(text for text, _, _, _ in parsed))
+            return
+        self.static = None
+
+        namespace = {'Markup': Markup, 'escape': html.escape}
+        pieces = []
+        for index, (text, name, spec, conversion) in enumerate(parsed):
+            if text:
+                namespace[f'text{index}'] = text
+                pieces.append(f'text{index}')
+            if name is not None:
+                value = f'get({name!r})'
+                if conversion:
+                    value = f'{CONVERSIONS[conversion]}({value})'
+                pieces.append(f'(value if (value := {value}).__class__ is Markup else escape(format(value, {spec!r}), False))')
+        code = f"def render(get):\n    return Markup(''.join(({', '.join(pieces)},)))\n"
+        exec(compile(code, '<template>', 'exec'), namespace)
+        self._render = namespace['render']
+
+    def render(self, values=None, **fields):
+        if self.static is not None:
+            return self.static
+        values = {**(values or {}), **fields} if fields else values or {}
+        return self._render(values.get)
+
+    def render_many(self, rows):
+        # the template rendered for every row, joined
+        if self.static is not None:
+            return Markup(self.static * len(rows))
+        render = self._render
+        return Markup(''.join([render(row.get) for row in rows]))
+
+
+def _boundary(html_content):
+    while True:
+        boundary = '=' * 15 + str(random.randrange(sys.maxsize)) + '=='
+        if boundary not in html_content:
+            return boundary
+
+
+def html_message(sender, recipient, subject, html_content):
+    # The MIME text of a multipart/mixed email with one html part. ASCII emails are put
+    # together directly, as the email package writes them; others go through it
+    headers = (f'From: {sender}', f'To: {recipient}', f'Subject: {subject}')
+    if html_content.isascii() and all(
+        header.isascii() and len(header) <= MAX_HEADER_LENGTH and '\n' not in header for header in headers
+    ):
+        boundary = _boundary(html_content)
+        return ''.join((
+            f'Content-Type: multipart/mixed; boundary="{boundary}"\nMIME-Version: 1.0\n',
+            '\n'.join(headers),
+            f'\n\n--{boundary}\nContent-Type: text/html; charset="us-ascii"\nMIME-Version: 1.0\n'
+            'Content-Transfer-Encoding: 7bit\n\n',
+            html_content,
+            f'\n--{boundary}--\n',
+        ))
+
+    message = MIMEMultipart()
+    message["From"] = sender
+    message["To"] = recipient
+    message["Subject"] = subject
+    message.attach(MIMEText(html_content, "html"))
+    return message.as_string()
+
+
+def email_job(sender, recipient, subject, html_content):
+    # queue message body of an email, see read_email_job
+    job = {'from': sender, 'to': recipient, 'subject': subject, 'html': html_content, 'queuedAt': time.time()}
+    body = json.dumps(job)
+    if len(body.encode()) > MAX_QUEUE_MESSAGE_BYTES:
+        del job['html']
+        job['htmlZ'] = base64.b64encode(zlib.compress(html_content.encode())).decode()
+        body = json.dumps(job)
+        if len(body.encode()) > MAX_QUEUE_MESSAGE_BYTES:
+            raise ValueError(f'Email to {recipient} is too large to queue')
+    return body
+
+
+def read_email_job(body):
+    job = json.loads(body)
+    if 'htmlZ' in job:
+        job['html'] = zlib.decompress(base64.b64decode(job.pop('htmlZ'))).decode()
+    for field in ('from', 'to', 'subject', 'html'):
+        if not job.get(field):
+            raise ValueError(f'Email job without {field}')
+    return job
+
+
+class EmailQueue:
+    def __init__(self, queue_url, client=None):
+        import boto3
+
+        self.queue_url = queue_url
+        self.client = client or boto3.client('sqs')
+
+    def put(self, sender, recipient, subject, html_content):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=email_job(sender, recipient, subject, html_content))
+
+
+class Mailer:
+    def __init__(self, sender, password, pool=None, queue_url=EMAIL_QUEUE_URL):
+        self.sender = sender
+        self.pool = pool or SMTPPool(sender, password)
+        self.queue = EmailQueue(queue_url) if queue_url else None
+
+    def send_html(self, recipient, subject, html_content):
+        # Returns 'queued' when the email went to the queue, 'sent' when it was sent
+        if self.queue:
+            self.queue.put(self.sender, recipient, subject, html_content)
+            return 'queued'
+        self.send_now(recipient, subject, html_content)
+        return 'sent'
+
+    def send_now(self, recipient, subject, html_content, sender=None):
+        sender = sender or self.sender
+        self.pool.send(sender, recipient, html_message(sender, recipient, subject, html_content))
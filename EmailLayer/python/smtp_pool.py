@@ -0,0 +1,180 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Pooled SMTP transport.
+# Opening a connection costs a TCP + TLS handshake and a login, hundreds of milliseconds
+# before the first message. The pool keeps authenticated connections open while the
+# container is warm and sends every message of a batch (and of the next invocations)
+# over them:
+#   - a connection idle for more than SMTP_NOOP_AFTER_SECONDS is checked with NOOP
+#     before use and replaced when the server closed it
+#   - a connection is replaced after SMTP_MAX_MESSAGES messages (servers limit the
+#     messages per session)
+#   - a send that fails because the connection dropped is retried once on a new one
+# smtplib connections are not thread safe, so every concurrent sender takes its own
+# connection; SMTP_POOL_SIZE bounds how many are open.
+
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '465'))
+# 'ssl' (SMTPS, port 465), 'starttls' (port 587) or 'plain' (local stand-in)
+SMTP_SECURITY = os.environ.get('SMTP_SECURITY', 'ssl')
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '10'))
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', os.environ.get('BATCH_CONCURRENCY', '8')))
+SMTP_MAX_MESSAGES = int(os.environ.get('SMTP_MAX_MESSAGES', '100'))
+SMTP_NOOP_AFTER_SECONDS = float(os.environ.get('SMTP_NOOP_AFTER_SECONDS', '5'))
+
+# errors after which the connection is dropped and the message sent on a new one
+DISCONNECTED = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SMTPPool:
+    def __init__(self, username=None, password=None, host=SMTP_HOST, port=SMTP_PORT, security=SMTP_SECURITY,
+                 size=SMTP_POOL_SIZE, timeout=SMTP_TIMEOUT, max_messages=SMTP_MAX_MESSAGES,
+                 noop_after=SMTP_NOOP_AFTER_SECONDS):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.security = security
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.noop_after = noop_after
+        # idle connections, the most recently used first
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.stats = {'connects': 0, 'reconnects': 0, 'noops': 0, 'sent': 0}
+        self.lock = threading.Lock()
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _connect(self):
+        if self.security == 'ssl':
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == 'starttls':
+                smtp.starttls()
+        try:
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._count('connects')
+        return PooledConnection(smtp)
+
+    def _healthy(self, connection):
+        if connection.messages >= self.max_messages:
+            return False
+        if time.monotonic() - connection.last_used < self.noop_after:
+            return True
+        self._count('noops')
+        try:
+            return connection.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _acquire(self):
+        # an idle connection that is still usable, else a new one
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self._healthy(connection):
+                return connection
+            self._count('reconnects')
+            connection.close()
+
+    @contextmanager
+    def connection(self):
+        # an authenticated smtplib connection, returned to the pool afterwards unless it failed
+        self.slots.acquire()
+        connection = None
+        try:
+            connection = self._acquire()
+            yield connection
+            connection.last_used = time.monotonic()
+            self.idle.put(connection)
+            connection = None
+        finally:
+            if connection is not None:
+                connection.close()
+            self.slots.release()
+
+    def send(self, from_addr, to_addrs, message):
+        # message: str or bytes of the whole email. Raises on failure
+        for attempt in range(2):
+            try:
+                with self.connection() as connection:
+                    connection.smtp.sendmail(from_addr, to_addrs, message)
+                    connection.messages += 1
+                self._count('sent')
+                return
+            except DISCONNECTED:
+                if attempt:
+                    raise
+                self._count('reconnects')
+
+    def send_many(self, messages):
+        # Sends [(from, to, message)] over one session. Returns [None or the exception] per
+        # message. When the connection drops, the rest continue on a new one.
+        results = []
+        pending = deque(messages)
+        while pending:
+            connection = None
+            try:
+                with self.connection() as connection:
+                    while pending and connection.messages < self.max_messages:
+                        from_addr, to_addrs, message = pending[0]
+                        try:
+                            connection.smtp.sendmail(from_addr, to_addrs, message)
+                            results.append(None)
+                            self._count('sent')
+                        except DISCONNECTED:
+                            raise
+                        except smtplib.SMTPException as e:
+                            # e.g. a refused recipient, the session goes on
+                            results.append(e)
+                        connection.messages += 1
+                        pending.popleft()
+            except DISCONNECTED as e:
+                if connection is None:
+                    raise
+                self._count('reconnects')
+                if connection.messages == 0:
+                    # not a stale connection, the message itself fails
+                    results.append(e)
+                    pending.popleft()
+        return results
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
@@ -0,0 +1,79 @@
+import html
+import os
+import sys
+from string import Formatter
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python'))
+
+from mailer import Markup, Template  # noqa: E402
+
+
+class ReferenceFormatter(Formatter):
+    # What Template compiles to, with plain str.format machinery: missing fields render
+    # as None, values are html.escape'd after formatting, Markup is inserted as it is
+    def get_value(self, key, args, kwargs):
+        return kwargs.get(key)
+
+    def format_field(self, value, format_spec):
+        if type(value) is Markup:
+            return value
+        return html.escape(format(value, format_spec), False)
+
+
+def reference(source, values):
+    return ReferenceFormatter().vformat(source, (), values)
+
+
+ITEM_ROW = """
+        <tr>
+            <td>{productId}</td>
+            <td>{productName}</td>
+            <td style="text-align:right;">${productPrice:.2f}</td>
+            <td style="text-align:right;">{quantity}</td>
+            <td style="text-align:right;">${totalPrice:.2f}</td>
+        </tr>
+        """
+
+CASES = [
+    (ITEM_ROW, {'productId': 'P-1', 'productName': 'Tea & <Biscuits>', 'productPrice': 2.5,
+                'quantity': 3, 'totalPrice': 7.5}),
+    ('<p>Hello {name}, order {orderId:>8} ships {when!r}</p>', {'name': '"Ann"', 'orderId': 42, 'when': "'today'"}),
+    ('{a}{b}{a}', {'a': '<', 'b': '>'}),
+    ('<td>{missing}</td><td>{present}</td>', {'present': 1}),
+    ('<table>{rows}</table>', {'rows': Markup('<tr><td>raw</td></tr>')}),
+    ('{{literal}} {value:,}', {'value': 1234567}),
+    ('{value!s:^9}|{value!a}', {'value': 'é<'}),
+    ('<html><body>No fields here</body></html>', {}),
+]
+
+
+@pytest.mark.parametrize('source, values', CASES)
+def test_render_matches_str_format(source, values):
+    rendered = Template(source).render(values)
+    assert rendered == reference(source, values)
+    assert isinstance(rendered, Markup)
+
+
+def test_render_fields_override_values():
+    source = '<b>{name}</b> {total:.2f}'
+    values = {'name': 'old', 'total': 1}
+    assert Template(source).render(values, name='<new>') == reference(source, {'name': '<new>', 'total': 1})
+
+
+def test_render_many_joins_rows():
+    rows = [
+        {'productId': f'P-{i}', 'productName': f'Item <{i}>', 'productPrice': i * 1.25, 'quantity': i,
+         'totalPrice': i * i * 1.25}
+        for i in range(5)
+    ]
+    assert Template(ITEM_ROW).render_many(rows) == ''.join(reference(ITEM_ROW, row) for row in rows)
+    assert Template('<hr>').render_many(rows) == '<hr>' * len(rows)
+
+
+def test_nested_templates_are_not_escaped_twice():
+    row = Template('<li>{name}</li>')
+    page = Template('<ul>{rows}</ul>')
+    rows = row.render_many([{'name': 'a&b'}, {'name': '<c>'}])
+    assert page.render(rows=rows) == '<ul><li>a&amp;b</li><li>&lt;c&gt;</li></ul>'
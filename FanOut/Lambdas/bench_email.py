@@ -0,0 +1,56 @@
+import argparse
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from local_smtp import LocalSMTPServer
+from smtp_pool import SMTPPool
+
+# Emails/sec of the pooled SMTP transport against the previous email_handler path
+# (connect, login and quit for every email), over the local SMTP stand-in.
+# The stand-in delays its greeting and the login to model the TLS handshake and
+# authentication of a real provider.
+#
+#   PYTHONPATH=../../EmailLayer/python python bench_email.py -n 200 --connect-delay 0.15 --auth-delay 0.1 --concurrency 1 8
+
+SENDER = 'orders@example.com'
+RECIPIENT = 'customer@example.com'
+
+
+def sample_message(i):
+    return f'From: {SENDER}\r\nTo: {RECIPIENT}\r\nSubject: Your Order Invoice - Order ID {100000 + i}\r\n\r\n' + 'x' * 4000
+
+
+def connect_per_message(server, message):
+    with smtplib.SMTP(server.host, server.port) as smtp:
+        smtp.login(SENDER, 'secret')
+        smtp.sendmail(SENDER, RECIPIENT, message)
+
+
+def run(name, send, messages, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, messages))
+    elapsed = time.perf_counter() - start
+    print(f'{name:<10} {concurrency:>11} {len(messages) / elapsed:>12,.1f}  ({elapsed:.2f}s)')
+    return len(messages) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark pooled SMTP sending.')
+    parser.add_argument('-n', '--emails', type=int, default=200, help='Emails per run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8], help='Concurrent senders to measure')
+    parser.add_argument('--connect-delay', type=float, default=0.15, help='Seconds before the server greeting')
+    parser.add_argument('--auth-delay', type=float, default=0.1, help='Seconds before the login is accepted')
+    parser.add_argument('--message-delay', type=float, default=0.005, help='Seconds to accept a message')
+    args = parser.parse_args()
+
+    messages = [sample_message(i) for i in range(args.emails)]
+    with LocalSMTPServer(connect_delay=args.connect_delay, auth_delay=args.auth_delay,
+                         message_delay=args.message_delay) as server:
+        print(f"{'transport':<10} {'concurrency':>11} {'emails/sec':>12}")
+        for concurrency in args.concurrency:
+            legacy = run('connect', lambda message: connect_per_message(server, message), messages, concurrency)
+            pool = SMTPPool(SENDER, 'secret', host=server.host, port=server.port, security='plain', size=concurrency)
+            pooled = run('pooled', lambda message: pool.send(SENDER, RECIPIENT, message), messages, concurrency)
+            pool.close()
+            print(f'speedup    {pooled / legacy:.1f}x, {pool.stats["connects"]} connections for {len(messages)} emails')
@@ -0,0 +1,106 @@
+import argparse
+import time
+from fpdf import FPDF
+from invoice_renderer import InvoiceRenderer
+
+# Microbenchmark: invoices/sec of the compiled InvoiceRenderer against the previous
+# invoice_handler path (a fresh FPDF document laid out cell by cell for every order,
+# copied into a BytesIO before the upload).
+#
+#   python bench_invoice.py -n 2000 --items 1 5 20 100
+
+
+class LegacyInvoicePDF(FPDF):
+    def header(self):
+        self.set_font("Arial", "B", 14)
+        self.cell(0, 10, "Invoice", ln=True, align="C")
+        self.ln(5)
+
+
+def legacy_path(order):
+    pdf = LegacyInvoicePDF()
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, f"Ship From: {order['shipFrom']}", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, f"Ship To: {order['shipTo']}", ln=True)
+
+    pdf.ln(5)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, f"Order ID: {order['orderId']}", ln=True)
+    pdf.cell(0, 8, f"Order Date: {order['orderDate']}", ln=True)
+
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, f"Order Total: ${order['orderTotal']:.2f}", ln=True)
+
+    pdf.ln(10)
+    pdf.set_font("Arial", "B", 11)
+    col_widths = [35, 65, 25, 20, 30]
+    headers = ["Product ID", "Product Name", "Unit Price", "Qty", "Total"]
+    for i, header in enumerate(headers):
+        pdf.cell(col_widths[i], 10, header, border=1)
+    pdf.ln()
+
+    pdf.set_font("Arial", "", 10)
+    for item in order['items']:
+        total_price = item['productPrice'] * item['quantity']
+        row = [
+            item['productId'],
+            item['productName'],
+            f"${item['productPrice']:.2f}",
+            str(item['quantity']),
+            f"${total_price:.2f}"
+        ]
+        for i, data in enumerate(row):
+            pdf.cell(col_widths[i], 8, data, border=1)
+        pdf.ln()
+
+    pdf.set_font("Arial", "B", 11)
+    pdf.cell(sum(col_widths[:-2]), 8, "", border=0)
+    pdf.cell(col_widths[-2], 8, "Total:", border=1)
+    pdf.cell(col_widths[-1], 8, f"${order['orderTotal']:.2f}", border=1)
+
+    return pdf.output(dest='S').encode('latin1')
+
+
+def sample_order(i, items):
+    lines = [{
+        'productId': f'P-{1000 + n}',
+        'productName': f'Product {n} (pack of {n % 6 + 1})',
+        'productPrice': 4.99 + n,
+        'quantity': n % 3 + 1,
+    } for n in range(items)]
+    return {
+        'orderId': str(100000 + i),
+        'orderDate': '2025-06-01',
+        'shipFrom': 'Warehouse 7, Pune',
+        'shipTo': 'A. Customer, 12 Park Street, Kolkata',
+        'orderTotal': sum(line['productPrice'] * line['quantity'] for line in lines),
+        'items': lines,
+    }
+
+
+def run(name, func, orders):
+    start = time.perf_counter()
+    for order in orders:
+        func(order)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<10} {len(orders) / elapsed:>10,.0f} invoices/sec  ({elapsed:.3f}s)')
+    return len(orders) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark invoice PDF rendering.')
+    parser.add_argument('-n', '--orders', type=int, default=2000, help='Number of invoices per item count')
+    parser.add_argument('--items', type=int, nargs='+', default=[1, 5, 20, 100], help='Order line counts to measure')
+    args = parser.parse_args()
+
+    renderer = InvoiceRenderer()
+    for items in args.items:
+        orders = [sample_order(i, items) for i in range(args.orders)]
+        print(f'{items} items per order')
+        legacy = run('legacy', legacy_path, orders)
+        compiled = run('compiled', renderer.render, orders)
+        print(f'speedup    {compiled / legacy:.1f}x')
@@ -0,0 +1,80 @@
+import argparse
+import threading
+import time
+from stock_shards import DynamoDBShardStore, LocalShardStore, ShardedStock
+
+# Decrements/sec of one hot product as its shard count grows.
+# By default runs against LocalShardStore, which caps every item at --writes-per-key
+# writes per second (DynamoDB allows about 1000 write units per second per partition
+# key); with --table it runs against a real inventory table.
+# A rebalancer thread evens the shards out while the buyers run.
+#
+#   python bench_stock_shards.py --shards 1 2 4 8 16 --workers 64 --duration 5
+#   python bench_stock_shards.py --table inventory-bench --shards 1 4 16
+
+PRODUCT_ID = 'BENCH-HOT-SKU'
+
+
+def run(shards, args):
+    if args.table:
+        store = DynamoDBShardStore(args.table)
+    else:
+        store = LocalShardStore(writes_per_key=args.writes_per_key)
+    stock = ShardedStock(store, {PRODUCT_ID: shards})
+    stock.set_stock(PRODUCT_ID, args.stock)
+
+    counts = {'ok': 0, 'short': 0, 'rebalanced': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def buyer():
+        ok = short = 0
+        while time.perf_counter() < deadline:
+            if stock.decrement(PRODUCT_ID, args.quantity):
+                ok += 1
+            else:
+                short += 1
+                time.sleep(0.01)
+        with lock:
+            counts['ok'] += ok
+            counts['short'] += short
+
+    def rebalancer():
+        while time.perf_counter() < deadline:
+            time.sleep(args.rebalance_every)
+            try:
+                if stock.rebalance(PRODUCT_ID):
+                    counts['rebalanced'] += 1
+            except RuntimeError:
+                pass
+
+    threads = [threading.Thread(target=buyer) for _ in range(args.workers)]
+    threads.append(threading.Thread(target=rebalancer))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    remaining = stock.get_stock([PRODUCT_ID])[PRODUCT_ID]
+    sold = counts['ok'] * args.quantity
+    assert remaining == args.stock - sold, f'stock mismatch: {remaining} left after selling {sold} of {args.stock}'
+    print(f"{shards:>6} {counts['ok'] / elapsed:>14,.0f} {counts['short']:>8} {counts['rebalanced']:>10} {remaining:>12,}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark sharded stock counters.')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='Shard counts to measure')
+    parser.add_argument('--workers', type=int, default=64, help='Concurrent buyers')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per shard count')
+    parser.add_argument('--stock', type=int, default=10_000_000, help='Initial stock of the product')
+    parser.add_argument('--quantity', type=int, default=1, help='Units per decrement')
+    parser.add_argument('--writes-per-key', type=float, default=1000.0, help='Write limit per item of the local store')
+    parser.add_argument('--rebalance-every', type=float, default=1.0, help='Seconds between rebalancer runs')
+    parser.add_argument('--table', help='DynamoDB inventory table to run against instead of the local store')
+    args = parser.parse_args()
+
+    print(f"{'shards':>6} {'decrements/s':>14} {'short':>8} {'rebalances':>10} {'remaining':>12}")
+    for shards in args.shards:
+        run(shards, args)
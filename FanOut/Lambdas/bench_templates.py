@@ -0,0 +1,125 @@
+import argparse
+import os
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+os.environ.setdefault('FROM_EMAIL_ADDRESS', 'orders@example.com')
+from email_handler import render_order_email  # noqa: E402
+from mailer import html_message  # noqa: E402
+
+# Emails/sec of building the order email (html + MIME message) with the compiled
+# templates against the previous email_handler path (f-strings with the item rows
+# appended with +=), for growing item tables.
+#
+#   PYTHONPATH=../../EmailLayer/python python bench_templates.py -n 2000 --items 1 10 100 1000
+
+SENDER = 'orders@example.com'
+
+
+def legacy_path(order):
+    items_html = ""
+    for item in order.get("items", []):
+        total_price = item["productPrice"] * item["quantity"]
+        items_html += f"""
+        <tr>
+            <td>{item['productId']}</td>
+            <td>{item['productName']}</td>
+            <td style="text-align:right;">${item['productPrice']:.2f}</td>
+            <td style="text-align:right;">{item['quantity']}</td>
+            <td style="text-align:right;">${total_price:.2f}</td>
+        </tr>
+        """
+
+    html_content = f"""
+    <html>
+    <body>
+        <h2>Order Invoice</h2>
+        <table style="width: 100%; margin-bottom: 20px;">
+            <tr>
+                <td style="vertical-align: top; width: 50%;">
+                    <strong>Ship From:</strong><br>{order.get('shipFrom')}<br><br>
+                    <strong>Ship To:</strong><br>{order.get('shipTo')}
+                </td>
+                <td style="vertical-align: top; width: 50%; text-align: right;">
+                    <strong>Order Date:</strong> {order.get('orderDate')}<br>
+                    <strong>Order ID:</strong> {order.get('orderId')}<br>
+                    <strong style="font-size: 18px;">Order Total: ${order.get('orderTotal'):.2f}</strong>
+                </td>
+            </tr>
+        </table>
+
+        <table border="1" cellspacing="0" cellpadding="8" style="border-collapse: collapse; width: 100%;">
+            <thead>
+                <tr style="background-color: #f2f2f2;">
+                    <th>Product ID</th>
+                    <th>Product Name</th>
+                    <th style="text-align:right;">Unit Price</th>
+                    <th style="text-align:right;">Quantity</th>
+                    <th style="text-align:right;">Total</th>
+                </tr>
+            </thead>
+            <tbody>
+                {items_html}
+            </tbody>
+        </table>
+
+        <p>Thank you for your order!</p>
+        <p>Best regards,<br>FarApp Team</p>
+        <p>Team FSB</p>
+    </body>
+    </html>
+    """
+
+    message = MIMEMultipart()
+    message["From"] = SENDER
+    message["To"] = order.get("poc_email")
+    message["Subject"] = f"Your Order Invoice - Order ID {order.get('orderId')}"
+    message.attach(MIMEText(html_content, "html"))
+    return message.as_string()
+
+
+def template_path(order):
+    subject = f"Your Order Invoice - Order ID {order.get('orderId')}"
+    return html_message(SENDER, order.get("poc_email"), subject, render_order_email(order))
+
+
+def sample_order(i, items):
+    lines = [{
+        'productId': f'P-{1000 + n}',
+        'productName': f'Product {n}',
+        'productPrice': 4.99 + n,
+        'quantity': n % 3 + 1,
+    } for n in range(items)]
+    return {
+        'orderId': str(100000 + i),
+        'orderDate': '2025-06-01',
+        'poc_email': 'customer@example.com',
+        'shipFrom': 'Warehouse 7, Pune',
+        'shipTo': '12 Park Street, Kolkata',
+        'orderTotal': sum(line['productPrice'] * line['quantity'] for line in lines),
+        'items': lines,
+    }
+
+
+def run(name, func, orders):
+    start = time.perf_counter()
+    for order in orders:
+        func(order)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<10} {len(orders) / elapsed:>10,.0f} emails/sec  ({elapsed:.3f}s)')
+    return len(orders) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark order email rendering.')
+    parser.add_argument('-n', '--emails', type=int, default=2000, help='Emails per item count')
+    parser.add_argument('--items', type=int, nargs='+', default=[1, 10, 100, 1000], help='Order line counts to measure')
+    args = parser.parse_args()
+
+    for items in args.items:
+        orders = [sample_order(i, items) for i in range(max(1, args.emails // max(1, items // 10)))]
+        print(f'{items} items per order')
+        legacy = run('legacy', legacy_path, orders)
+        compiled = run('template', template_path, orders)
+        print(f'speedup    {compiled / legacy:.1f}x')
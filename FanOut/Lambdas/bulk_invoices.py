@@ -0,0 +1,280 @@
+import argparse
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from invoice_renderer import INVOICE_PREFIX, InvoiceRenderer, invoice_key, order_checksum
+
+# Bulk invoice job for month-end re-invoicing and backfills.
+# Reads orders from an NDJSON manifest (a local file, s3://bucket/key, '-' for stdin;
+# .gz is decompressed), renders the PDFs in a process pool (FPDF is CPU bound) and
+# uploads them with a bounded number of concurrent S3 uploads. Invoices are stored
+# under the same keys and with the same order checksum as invoice_handler.py writes.
+#
+#   python bulk_invoices.py s3://orders-export/2025-05.ndjson.gz --bucket invoices-bucket --skip-existing checksum
+#   python bulk_invoices.py orders.ndjson --output-dir /tmp/invoices --processes 8
+#
+# --skip-existing key       skips orders whose invoice key exists
+# --skip-existing checksum  skips them only when the invoice was rendered from the same order
+#
+# Runs outside Lambda (a build box, ECS / Batch task): Lambda has no /dev/shm for
+# multiprocessing.Pool.
+
+UPLOAD_CONCURRENCY = 16
+CHUNK_SIZE = 16
+CHECKSUM_METADATA = 'order-sha256'
+
+renderer = None
+
+
+def init_worker():
+    # every worker process compiles the layout once
+    global renderer
+    renderer = InvoiceRenderer()
+
+
+def render_order(order):
+    # (order id, key, checksum, pdf bytes or None, error or None)
+    key = None
+    try:
+        key = invoice_key(order)
+        return order['orderId'], key, order_checksum(order), renderer.render(order), None
+    except Exception as e:
+        return order.get('orderId'), key, None, None, f'{type(e).__name__}: {e}'
+
+
+def read_manifest(source, on_invalid=None):
+    # orders of the NDJSON manifest, one per non-empty line; lines that are not a JSON
+    # object with an orderId are skipped and passed to on_invalid(line number, error)
+    if source == '-':
+        stream = sys.stdin.buffer
+    elif source.startswith('s3://'):
+        import boto3
+
+        bucket, _, key = source[len('s3://'):].partition('/')
+        stream = boto3.client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    else:
+        stream = open(source, 'rb')
+    if source.endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=stream)
+    for number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            order = json.loads(line)
+        except ValueError as e:
+            error = f'invalid JSON: {e}'
+        else:
+            if isinstance(order, dict) and order.get('orderId') not in (None, ''):
+                yield order
+                continue
+            error = 'not an order object with an orderId'
+        print(f'Skipping line {number} of {source}: {error}')
+        if on_invalid:
+            on_invalid(number, error)
+
+
+class S3Destination:
+    def __init__(self, bucket, client=None):
+        import boto3
+
+        self.bucket = bucket
+        self.client = client or boto3.client('s3')
+
+    def existing(self, prefix):
+        # keys under prefix, one listing for the whole job
+        keys = set()
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.update(obj['Key'] for obj in page.get('Contents', []))
+        return keys
+
+    def checksum(self, key):
+        response = self.client.head_object(Bucket=self.bucket, Key=key)
+        return response.get('Metadata', {}).get(CHECKSUM_METADATA)
+
+    def put(self, key, body, checksum):
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=body,
+            ContentType='application/pdf', Metadata={CHECKSUM_METADATA: checksum}
+        )
+
+
+class DirectoryDestination:
+    # Writes the invoices below a local directory, the checksum next to each PDF
+    def __init__(self, directory):
+        self.directory = directory
+
+    def existing(self, prefix):
+        keys = set()
+        root = os.path.join(self.directory, prefix)
+        for path, _, files in os.walk(root):
+            for name in files:
+                if name.endswith('.pdf'):
+                    keys.add(os.path.relpath(os.path.join(path, name), self.directory).replace(os.sep, '/'))
+        return keys
+
+    def checksum(self, key):
+        try:
+            with open(os.path.join(self.directory, key + '.sha256')) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, body, checksum):
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(body)
+        with open(path + '.sha256', 'w') as f:
+            f.write(checksum)
+
+
+class BulkInvoiceJob:
+    def __init__(self, destination, processes=None, upload_concurrency=UPLOAD_CONCURRENCY,
+                 skip_existing=None, chunk_size=CHUNK_SIZE):
+        self.destination = destination
+        self.processes = processes or os.cpu_count()
+        self.upload_concurrency = upload_concurrency
+        self.skip_existing = skip_existing
+        self.chunk_size = chunk_size
+        self.stats = {'orders': 0, 'skipped': 0, 'rendered': 0, 'uploaded': 0, 'failed': 0, 'bytes': 0}
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def _fail(self, order_id, error):
+        print(f'Invoice for order {order_id} failed: {error}')
+        with self.lock:
+            self.stats['failed'] += 1
+            self.failures.append({'orderId': order_id, 'error': error})
+
+    def invalid_line(self, number, error):
+        # a manifest line that is no order ends up in the failures like a failed invoice
+        with self.lock:
+            self.stats['failed'] += 1
+            self.failures.append({'orderId': None, 'line': number, 'error': error})
+
+    def _pending(self, orders, existing, executor):
+        # the orders still to render; checksums of existing invoices are compared concurrently
+        for order in orders:
+            self._count('orders')
+            key = invoice_key(order)
+            if key not in existing:
+                yield order
+            elif self.skip_existing == 'key':
+                self._count('skipped')
+            else:
+                yield executor.submit(self._changed, order, key)
+
+    def _changed(self, order, key):
+        try:
+            unchanged = self.destination.checksum(key) == order_checksum(order)
+        except Exception as e:
+            print(f'Could not read checksum of {key}: {e}')
+            unchanged = False
+        if unchanged:
+            self._count('skipped')
+            return None
+        return order
+
+    def _upload(self, key, body, checksum, order_id, slots):
+        try:
+            self.destination.put(key, body, checksum)
+            self._count('uploaded')
+            self._count('bytes', len(body))
+        except Exception as e:
+            self._fail(order_id, f'upload of {key}: {type(e).__name__}: {e}')
+        finally:
+            slots.release()
+
+    def run(self, orders):
+        start = time.perf_counter()
+        existing = set()
+        if self.skip_existing:
+            existing = self.destination.existing(INVOICE_PREFIX)
+            print(f'{len(existing)} invoices exist already')
+
+        # rendered PDFs wait for an upload slot: at most twice the upload concurrency is
+        # queued on the uploader
+        slots = threading.BoundedSemaphore(self.upload_concurrency * 2)
+        with ThreadPoolExecutor(max_workers=self.upload_concurrency) as uploader, \
+                multiprocessing.Pool(self.processes, initializer=init_worker) as pool:
+            pending = self._resolve(self._pending(orders, existing, uploader))
+            for order_id, key, checksum, body, error in pool.imap_unordered(render_order, pending, self.chunk_size):
+                if error:
+                    self._fail(order_id, error)
+                    continue
+                self._count('rendered')
+                slots.acquire()
+                uploader.submit(self._upload, key, body, checksum, order_id, slots)
+
+        self.stats['seconds'] = round(time.perf_counter() - start, 3)
+        return self.stats
+
+    def _resolve(self, pending, window=256):
+        # keeps the order of the manifest, resolving checksum lookups a window ahead
+        queue = deque()
+        for item in pending:
+            queue.append(item)
+            if len(queue) >= window:
+                order = self._result(queue.popleft())
+                if order is not None:
+                    yield order
+        for item in queue:
+            order = self._result(item)
+            if order is not None:
+                yield order
+
+    def _result(self, item):
+        return item if isinstance(item, dict) else item.result()
+
+
+def report(stats):
+    seconds = stats['seconds'] or 1e-9
+    print(
+        f"{stats['orders']} orders: {stats['uploaded']} invoices written, {stats['skipped']} skipped, "
+        f"{stats['failed']} failed in {stats['seconds']:.1f}s"
+    )
+    print(
+        f"{stats['rendered'] / seconds:,.0f} invoices/sec rendered, {stats['uploaded'] / seconds:,.0f} invoices/sec written, "
+        f"{stats['bytes'] / seconds / 1e6:.1f} MB/s"
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render and upload invoices for a manifest of orders.')
+    parser.add_argument('manifest', help='NDJSON file of orders: a path, s3://bucket/key or - for stdin')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--bucket', default=os.environ.get('INVOICE_BUCKET_NAME'), help='Invoice bucket')
+    target.add_argument('--output-dir', help='Write the invoices to a local directory instead of S3')
+    parser.add_argument('--processes', type=int, default=None, help='Render processes (default: CPU count)')
+    parser.add_argument('--upload-concurrency', type=int, default=UPLOAD_CONCURRENCY, help='Concurrent uploads')
+    parser.add_argument('--skip-existing', choices=['key', 'checksum'], help='Skip orders whose invoice exists')
+    parser.add_argument('--failures', help='Write the failed orders as NDJSON to this file')
+    args = parser.parse_args()
+
+    if args.output_dir:
+        destination = DirectoryDestination(args.output_dir)
+    elif not args.bucket:
+        parser.error('--bucket (or INVOICE_BUCKET_NAME) or --output-dir is required')
+    else:
+        destination = S3Destination(args.bucket)
+
+    job = BulkInvoiceJob(destination, args.processes, args.upload_concurrency, args.skip_existing)
+    report(job.run(read_manifest(args.manifest, job.invalid_line)))
+    if args.failures and job.failures:
+        with open(args.failures, 'w') as f:
+            for failure in job.failures:
+                f.write(json.dumps(failure) + '\n')
+    sys.exit(1 if job.failures else 0)
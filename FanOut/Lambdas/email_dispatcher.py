@@ -0,0 +1,233 @@
+import json
+import os
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parseaddr
+import boto3
+from mailer import Mailer, read_email_job
+from smtp_pool import SMTP_POOL_SIZE
+
+# Email dispatcher: drains the email queue that the handlers fill through
+# Mailer.send_html (EMAIL_QUEUE_URL), so they don't wait for the mail server.
+# SQS -> Lambda, with ReportBatchItemFailures enabled on the event source mapping.
+# There is one dispatcher and one queue for every project sending through the same mail
+# server: the Resume Shortlisting handlers set EMAIL_QUEUE_URL to this queue as well,
+# so a single token bucket holds the sending rate.
+#   - every job is sent with the credentials of its 'from' address: FROM_EMAIL_ADDRESS with
+#     APP_PASSWORD (or EMAIL_PASSWORD), plus the accounts of EMAIL_ACCOUNTS, a JSON object
+#     {address: app password}. Jobs from any other address are dead-lettered
+#   - sends at most EMAIL_RATE_PER_SECOND emails (token bucket per container; give the
+#     function a reserved concurrency of 1 to make it the overall rate), over pooled
+#     SMTP connections
+#   - a server that throttles (421 / 45x) pauses the bucket for EMAIL_THROTTLE_PAUSE_SECONDS
+#   - temporary failures are retried: the message is reported as failed and becomes
+#     visible again after a backoff that grows with every receive
+#   - permanent failures (5xx, invalid jobs) and messages received EMAIL_MAX_ATTEMPTS
+#     times go to the dead-letter queue EMAIL_DLQ_URL with the error
+#   - messages left when the invocation runs out of time were never tried; they are
+#     sent to the queue again as new messages, so waiting does not use up the receives
+#     the redrive policy counts. Attempts are counted in the 'attempts' message
+#     attribute plus ApproximateReceiveCount. Keep the batch size within what the rate
+#     allows in the function timeout, and maxReceiveCount above EMAIL_MAX_ATTEMPTS
+
+EMAIL_RATE_PER_SECOND = float(os.environ.get('EMAIL_RATE_PER_SECOND', '5'))
+EMAIL_BURST = int(os.environ.get('EMAIL_BURST', '10'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_QUEUE_URL = os.environ.get('EMAIL_QUEUE_URL')
+EMAIL_DLQ_URL = os.environ.get('EMAIL_DLQ_URL')
+EMAIL_THROTTLE_PAUSE_SECONDS = float(os.environ.get('EMAIL_THROTTLE_PAUSE_SECONDS', '30'))
+# one send per pooled connection
+SEND_CONCURRENCY = SMTP_POOL_SIZE
+# retry backoff: visibility timeout of a failed message, doubled per receive
+RETRY_BASE_SECONDS = 30
+MAX_VISIBILITY_SECONDS = 900
+# time kept back at the end of the invocation
+TIME_MARGIN_MS = 5000
+
+# replies meaning the server wants us to slow down
+THROTTLE_CODES = (421, 450, 451, 452, 454)
+
+from_email_address = os.environ.get("FROM_EMAIL_ADDRESS")
+app_password = os.environ.get("APP_PASSWORD", os.environ.get("EMAIL_PASSWORD"))
+
+# {address: app password} of the accounts jobs may be sent from
+accounts = {address.lower(): password for address, password in json.loads(os.environ.get('EMAIL_ACCOUNTS') or '{}').items()}
+if from_email_address:
+    accounts.setdefault(from_email_address.lower(), app_password)
+
+sqs = boto3.client('sqs')
+# one mailer (and SMTP pool) per account, created on first use; they send directly,
+# never back to the queue
+mailers = {}
+mailers_lock = threading.Lock()
+
+
+def mailer_for(sender):
+    # Raises ValueError for a sender that is not one of the accounts
+    address = parseaddr(sender or '')[1].lower()
+    with mailers_lock:
+        if address not in mailers:
+            if address not in accounts:
+                raise ValueError(f'{sender!r} is not an account of the email dispatcher')
+            mailers[address] = Mailer(address, accounts[address], queue_url=None)
+        return mailers[address]
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        # Waits for a token. Returns False instead when it would come after deadline
+        # (a time.monotonic() value)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+bucket = TokenBucket(EMAIL_RATE_PER_SECOND, EMAIL_BURST)
+
+
+def smtp_code(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return max(code for code, _ in error.recipients.values())
+    return getattr(error, 'smtp_code', None)
+
+
+def is_permanent(error):
+    if isinstance(error, (ValueError, KeyError)):
+        # the job itself is invalid
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        # our credentials, not the email: retried
+        return False
+    code = smtp_code(error)
+    return code is not None and 500 <= code < 600
+
+
+def lambda_handler(event, context):
+    records = event.get('Records') or []
+    deadline = None
+    if context is not None:
+        deadline = time.monotonic() + (context.get_remaining_time_in_millis() - TIME_MARGIN_MS) / 1000
+
+    def run(record):
+        return record, dispatch(record, deadline)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(SEND_CONCURRENCY, len(records)))) as executor:
+        outcomes = list(executor.map(run, records))
+
+    counts = {}
+    for _, outcome in outcomes:
+        counts[outcome] = counts.get(outcome, 0) + 1
+    print(f"Dispatched {len(records)} email(s): {counts}")
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': record['messageId']} for record, outcome in outcomes if outcome in ('retry', 'deferred')
+        ]
+    }
+
+
+def dispatch(record, deadline=None):
+    # 'sent', 'dead' (moved to the dead-letter queue), 'retry', 'requeued' or
+    # 'deferred' (out of time and could not be requeued)
+    attempts = previous_attempts(record) + int(record.get('attributes', {}).get('ApproximateReceiveCount', '1'))
+    try:
+        job = read_email_job(record['body'])
+        mailer = mailer_for(job['from'])
+    except Exception as e:
+        return dead_letter(record, e, attempts)
+
+    if not bucket.acquire(deadline):
+        # this receive was not an attempt
+        return requeue(record, attempts - 1)
+    try:
+        mailer.send_now(job['to'], job['subject'], job['html'], sender=job['from'])
+    except Exception as e:
+        print(f"Sending email to {job['to']} failed (attempt {attempts}): {e}")
+        if smtp_code(e) in THROTTLE_CODES:
+            bucket.pause(EMAIL_THROTTLE_PAUSE_SECONDS)
+        if is_permanent(e) or attempts >= EMAIL_MAX_ATTEMPTS:
+            return dead_letter(record, e, attempts)
+        retry_later(record, attempts)
+        return 'retry'
+    print(f"Email sent to {job['to']}, {time.time() - job.get('queuedAt', time.time()):.1f}s after it was queued")
+    return 'sent'
+
+
+def previous_attempts(record):
+    # attempts made before the message was requeued
+    attribute = record.get('messageAttributes', {}).get('attempts') or {}
+    return int(attribute.get('stringValue') or 0)
+
+
+def requeue(record, attempts):
+    # Sends the message again as a new one, the original is deleted as processed
+    if not EMAIL_QUEUE_URL:
+        return 'deferred'
+    try:
+        sqs.send_message(
+            QueueUrl=EMAIL_QUEUE_URL,
+            MessageBody=record['body'],
+            MessageAttributes={'attempts': {'DataType': 'Number', 'StringValue': str(attempts)}}
+        )
+    except Exception as e:
+        print(f"Could not requeue {record['messageId']}: {e}")
+        return 'deferred'
+    return 'requeued'
+
+
+def retry_later(record, attempts):
+    if not EMAIL_QUEUE_URL:
+        return
+    try:
+        sqs.change_message_visibility(
+            QueueUrl=EMAIL_QUEUE_URL,
+            ReceiptHandle=record['receiptHandle'],
+            VisibilityTimeout=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAX_VISIBILITY_SECONDS)
+        )
+    except Exception as e:
+        print(f"Could not delay retry of {record['messageId']}: {e}")
+
+
+def dead_letter(record, error, attempts):
+    # Without EMAIL_DLQ_URL the message is reported as failed and the queue's redrive
+    # policy moves it
+    if not EMAIL_DLQ_URL:
+        print(f"Email {record['messageId']} failed for good: {error}")
+        return 'retry'
+    try:
+        sqs.send_message(
+            QueueUrl=EMAIL_DLQ_URL,
+            MessageBody=record['body'],
+            MessageAttributes={
+                'error': {'DataType': 'String', 'StringValue': f'{type(error).__name__}: {error}'[:1024]},
+                'attempts': {'DataType': 'Number', 'StringValue': str(attempts)},
+            }
+        )
+    except Exception as e:
+        print(f"Could not move email {record['messageId']} to the dead-letter queue: {e}")
+        return 'retry'
+    print(f"Email {record['messageId']} moved to the dead-letter queue: {error}")
+    return 'dead'
@@ -1,65 +1,39 @@
-import smtplib
 import os
-import json
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from record_batch import process_batch
+from mailer import Mailer, Template
 
 # Assuming these are global or passed-in elsewhere
 from_email_address = os.environ.get("FROM_EMAIL_ADDRESS")
 app_password = os.environ.get("APP_PASSWORD")
 
-def lambda_handler(event, context):
-    records = event['Records'][0]
-    if not records:
-        return {"statusCode": 400, "body": "No records found in the event"}
-    order = json.loads(records['Sns']['Message'])
-    print('order',order)
-    if not order:
-        return {"statusCode": 400, "body": "No order data provided"}
-
-    try:
-        send_order_email(order)
-        return {"statusCode": 200, "body": "Order email sent successfully"}
-    except Exception as e:
-        return {"statusCode": 500, "body": f"Error sending email: {str(e)}"}
+# authenticated SMTP connections, reused by every email while the container is warm
+mailer = Mailer(from_email_address, app_password)
 
-def send_order_email(order):
-    sender_email = from_email_address
-    receiver_email = order.get("poc_email")
-    password = app_password
-
-
-    subject = f"Your Order Invoice - Order ID {order.get('orderId')}"
-
-    # Build items table rows
-    items_html = ""
-    for item in order.get("items", []):
-        total_price = item["productPrice"] * item["quantity"]
-        items_html += f"""
+ITEM_ROW = Template("""
         <tr>
-            <td>{item['productId']}</td>
-            <td>{item['productName']}</td>
-            <td style="text-align:right;">${item['productPrice']:.2f}</td>
-            <td style="text-align:right;">{item['quantity']}</td>
-            <td style="text-align:right;">${total_price:.2f}</td>
+            <td>{productId}</td>
+            <td>{productName}</td>
+            <td style="text-align:right;">${productPrice:.2f}</td>
+            <td style="text-align:right;">{quantity}</td>
+            <td style="text-align:right;">${totalPrice:.2f}</td>
         </tr>
-        """
+        """)
 
-    # HTML Email Body
-    html_content = f"""
+# HTML Email Body
+ORDER_EMAIL = Template("""
     <html>
     <body>
         <h2>Order Invoice</h2>
         <table style="width: 100%; margin-bottom: 20px;">
             <tr>
                 <td style="vertical-align: top; width: 50%;">
-                    <strong>Ship From:</strong><br>{order.get('shipFrom')}<br><br>
-                    <strong>Ship To:</strong><br>{order.get('shipTo')}
+                    <strong>Ship From:</strong><br>{shipFrom}<br><br>
+                    <strong>Ship To:</strong><br>{shipTo}
                 </td>
                 <td style="vertical-align: top; width: 50%; text-align: right;">
-                    <strong>Order Date:</strong> {order.get('orderDate')}<br>
-                    <strong>Order ID:</strong> {order.get('orderId')}<br>
-                    <strong style="font-size: 18px;">Order Total: ${order.get('orderTotal'):.2f}</strong>
+                    <strong>Order Date:</strong> {orderDate}<br>
+                    <strong>Order ID:</strong> {orderId}<br>
+                    <strong style="font-size: 18px;">Order Total: ${orderTotal:.2f}</strong>
                 </td>
             </tr>
         </table>
@@ -84,21 +58,32 @@ def send_order_email(order):
         <p>Team FSB</p>
     </body>
     </html>
-    """
+    """)
 
-    # Compose email message
-    message = MIMEMultipart()
-    message["From"] = sender_email
-    message["To"] = receiver_email
-    message["Subject"] = subject
-    message.attach(MIMEText(html_content, "html"))
+def lambda_handler(event, context):
+    if not event.get('Records'):
+        return {"statusCode": 400, "body": "No records found in the event"}
+
+    # one email per order of the SNS / SQS batch, failed sends are reported per record
+    return process_batch(event, send_order_email)
+
+def send_order_email(order):
+    receiver_email = order.get("poc_email")
+    subject = f"Your Order Invoice - Order ID {order.get('orderId')}"
+    html_content = render_order_email(order)
 
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, password)
-            server.sendmail(sender_email, receiver_email, message.as_string())
-        print(f"Email sent successfully to {receiver_email}")
-        return {"statusCode": 200, "body": "Email sent successfully!"}
+        status = mailer.send_html(receiver_email, subject, html_content)
+        print(f"Email {status} successfully to {receiver_email}")
+        return {"statusCode": 200, "body": f"Email {status} successfully!"}
     except Exception as e:
         print(f"Failed to send email: {e}")
-        return {"statusCode": 500, "body": f"Error: {str(e)}"}
+        # raised so the order is reported as a failed record and retried
+        raise
+
+def render_order_email(order):
+    items = [
+        {**item, 'totalPrice': item["productPrice"] * item["quantity"]}
+        for item in order.get("items", [])
+    ]
+    return ORDER_EMAIL.render(order, items_html=ITEM_ROW.render_many(items))
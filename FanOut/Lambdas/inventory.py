@@ -0,0 +1,294 @@
+import os
+import time
+import uuid
+import boto3
+from decimal import Decimal
+from stock_shards import DynamoDBShardStore, ShardedStock
+
+# Inventory decrements for orders.
+# All lines of an order are applied in one DynamoDB transaction together with an
+# 'order#<orderId>' marker item, so an order is decremented completely or not at all,
+# and a redelivered order finds its marker and is not applied twice.
+# Orders with more lines than fit in one transaction are split; every part is atomic
+# and the parts already applied are rolled back when a later part fails, including parts
+# applied by an earlier delivery of the order (their markers hold the lines written).
+# Every delivery writes its markers with its own attemptId and a lease: a concurrent
+# delivery that finds leased markers fails with OrderInProgress (and is retried), one that
+# finds expired markers takes them over with a conditional write first, and a rollback
+# only deletes markers still owned by the delivery rolling back. A rollback that fails
+# part way flags the remaining markers rollbackPending; the retried delivery finishes it.
+# Markers carry an 'expiresAt' TTL attribute (enable TTL on it for the table); keep
+# ORDER_MARKER_TTL_DAYS above the longest time an order can be redelivered (the queue's
+# retention period, at most 14 days).
+#
+# Hot products can be sharded: their stock is spread over the items '<productId>#<n>'
+# (n = 0..shards-1) instead of one 'productId' item, so concurrent orders decrement
+# different partition keys (see stock_shards.py). A line larger than any one shard holds
+# is split over several shards in the same transaction.
+
+INVENTORY_TABLE_NAME = os.environ.get('INVENTORY_TABLE_NAME')
+# DynamoDB transactions accept at most 100 actions, one is the order marker
+MAX_TRANSACTION_ITEMS = 100
+LINES_PER_TRANSACTION = MAX_TRANSACTION_ITEMS - 1
+MAX_TRANSACTION_ATTEMPTS = int(os.environ.get('MAX_TRANSACTION_ATTEMPTS', '4'))
+ORDER_MARKER_TTL_DAYS = int(os.environ.get('ORDER_MARKER_TTL_DAYS', '14'))
+# how long a delivery owns the markers it writes; keep it above the function timeout
+ORDER_LEASE_SECONDS = int(os.environ.get('ORDER_LEASE_SECONDS', '900'))
+# DynamoDB BatchGetItem accepts at most 100 keys per call
+BATCH_GET_LIMIT = 100
+
+
+class OrderInProgress(Exception):
+    # another delivery of the order is applying it; the message is retried later
+    def __init__(self, marker):
+        super().__init__(f'{marker} is held by another delivery of the order')
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f"Insufficient stock for {', '.join(product_ids)}")
+        self.product_ids = product_ids
+
+
+def merge_lines(items):
+    # {productId: total quantity}, duplicate lines of the same product are added up
+    quantities = {}
+    for item in items:
+        quantity = int(item['quantity'])
+        if quantity <= 0:
+            raise ValueError(f"Invalid quantity {item['quantity']} for product {item['productId']}")
+        product_id = str(item['productId'])
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+class InventoryEngine:
+    def __init__(self, table_name=INVENTORY_TABLE_NAME, hot_sku_shards=None, client=None):
+        self.table_name = table_name
+        # the resource's client (de)serializes python types
+        self.client = client or boto3.resource('dynamodb').meta.client
+        self.stock = ShardedStock(DynamoDBShardStore(table_name, self.client), hot_sku_shards)
+
+    def apply_order(self, order_id, items):
+        # Decrements the stock of every line of the order.
+        # Returns False when the order was already applied, raises InsufficientStock, and
+        # OrderInProgress while another delivery of the order holds its markers
+        lines = sorted(merge_lines(items).items())
+        chunks = [lines[start:start + LINES_PER_TRANSACTION] for start in range(0, len(lines), LINES_PER_TRANSACTION)]
+
+        markers = [self._marker_key(order_id, index, len(chunks)) for index in range(len(chunks))]
+        attempt_id = uuid.uuid4().hex
+        existing = self._get_markers(markers)
+        if len(existing) == len(markers) and not any(marker['rollbackPending'] for marker in existing.values()):
+            return False
+
+        # parts applied by an earlier delivery are taken over, and rolled back too if this one fails
+        applied = self._claim_markers(existing, attempt_id)
+        if any(marker['rollbackPending'] for marker in existing.values()):
+            # an earlier rollback failed part way: finish it, then apply the order anew
+            self._rollback(applied, attempt_id)
+            applied = []
+            existing = {}
+
+        for marker, chunk in zip(markers, chunks):
+            if marker in existing:
+                continue
+            try:
+                keys = self._apply_chunk(marker, chunk, attempt_id)
+                if keys is None:
+                    # written meanwhile by a concurrent delivery
+                    raise OrderInProgress(marker)
+                applied.append((marker, keys))
+            except Exception:
+                # keep the order all or nothing
+                self._rollback(applied, attempt_id)
+                raise
+        return True
+
+    def _marker_key(self, order_id, index, count):
+        if count == 1:
+            return f'order#{order_id}'
+        return f'order#{order_id}#{index}'
+
+    def _get_markers(self, markers):
+        # {marker: {'keys': [(item key, quantity)], 'attemptId', 'leaseUntil', 'rollbackPending'}}
+        # of the markers that exist
+        found = {}
+        for start in range(0, len(markers), BATCH_GET_LIMIT):
+            request = {
+                self.table_name: {
+                    'Keys': [{'productId': marker} for marker in markers[start:start + BATCH_GET_LIMIT]],
+                    'ConsistentRead': True
+                }
+            }
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    found[item['productId']] = {
+                        'keys': [(key, int(quantity)) for key, quantity in item.get('lines', {}).items()],
+                        'attemptId': item.get('attemptId'),
+                        'leaseUntil': int(item.get('leaseUntil', 0)),
+                        'rollbackPending': bool(item.get('rollbackPending'))
+                    }
+                request = response.get('UnprocessedKeys')
+        return found
+
+    def _claim_markers(self, existing, attempt_id):
+        # Takes over the markers of earlier deliveries whose lease ran out, so only one
+        # delivery at a time applies or rolls back the parts of an order.
+        # Returns [(marker, keys)], raises OrderInProgress
+        now = int(time.time())
+        for marker, state in existing.items():
+            if state['leaseUntil'] > now:
+                raise OrderInProgress(marker)
+        claimed = []
+        for marker, state in sorted(existing.items()):
+            try:
+                self.client.update_item(
+                    TableName=self.table_name,
+                    Key={'productId': marker},
+                    UpdateExpression='SET attemptId = :attempt, leaseUntil = :until',
+                    ConditionExpression='attribute_not_exists(attemptId) OR attemptId = :previous',
+                    ExpressionAttributeValues={
+                        ':attempt': attempt_id,
+                        ':until': now + ORDER_LEASE_SECONDS,
+                        ':previous': state['attemptId'] or ''
+                    }
+                )
+            except self.client.exceptions.ConditionalCheckFailedException:
+                # claimed by a concurrent delivery; the markers claimed so far are taken
+                # over again once their lease runs out
+                raise OrderInProgress(marker)
+            claimed.append((marker, state['keys']))
+        return claimed
+
+    def _apply_chunk(self, marker, lines, attempt_id):
+        # Returns [(item key, quantity)] written, None if the marker already exists.
+        # A line of a sharded product may be split over several shards, within the
+        # actions the transaction has left
+        refresh = set()
+        for attempt in range(MAX_TRANSACTION_ATTEMPTS + 1):
+            keys = []
+            owners = []
+            short = []
+            spare = LINES_PER_TRANSACTION - len(lines)
+            for product_id, quantity in lines:
+                parts = self.stock.allocate(product_id, quantity, product_id in refresh, max_parts=spare + 1)
+                if parts is None:
+                    short.append(product_id)
+                    continue
+                spare -= len(parts) - 1
+                keys.extend(parts)
+                owners.extend(product_id for _ in parts)
+            if short:
+                raise InsufficientStock(short)
+
+            actions = [{
+                'Put': {
+                    'TableName': self.table_name,
+                    'Item': {
+                        'productId': marker,
+                        'lines': {key: quantity for key, quantity in keys},
+                        'attemptId': attempt_id,
+                        'leaseUntil': int(time.time()) + ORDER_LEASE_SECONDS,
+                        'expiresAt': int(time.time()) + ORDER_MARKER_TTL_DAYS * 86400
+                    },
+                    'ConditionExpression': 'attribute_not_exists(productId)'
+                }
+            }]
+            for key, quantity in keys:
+                actions.append({
+                    'Update': {
+                        'TableName': self.table_name,
+                        'Key': {'productId': key},
+                        'UpdateExpression': 'SET currentStock = currentStock - :qty',
+                        'ConditionExpression': 'currentStock >= :qty',
+                        'ExpressionAttributeValues': {':qty': Decimal(quantity)}
+                    }
+                })
+
+            try:
+                self.client.transact_write_items(TransactItems=actions)
+                for key, quantity in keys:
+                    self.stock.observe_decrement(key, quantity)
+                return keys
+            except self.client.exceptions.TransactionCanceledException as e:
+                reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+                if reasons and reasons[0] == 'ConditionalCheckFailed':
+                    return None
+
+                short = []
+                for (key, quantity), product_id, code in zip(keys, owners, reasons[1:]):
+                    if code != 'ConditionalCheckFailed':
+                        continue
+                    if len(self.stock.shard_keys(product_id)) == 1:
+                        short.append(product_id)
+                    else:
+                        # allocated again from the shards as they are now
+                        self.stock.observe_short(key, quantity)
+                        refresh.add(product_id)
+                if short:
+                    raise InsufficientStock(short)
+                if not any(code == 'ConditionalCheckFailed' for code in reasons[1:]):
+                    # conflicting transaction on the same items, retried as is
+                    print(f"Transaction for {marker} cancelled: {reasons}")
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+        raise RuntimeError(f'Transaction for {marker} failed after {attempt + 1} attempts')
+
+    def _rollback(self, applied, attempt_id):
+        # Rolls back the parts this delivery owns, last first. When a compensating
+        # transaction fails, the parts not rolled back are flagged rollbackPending and their
+        # lease released, so the next delivery of the order finishes the rollback
+        for index, (marker, keys) in enumerate(reversed(applied)):
+            try:
+                self._rollback_chunk(marker, keys, attempt_id)
+            except Exception:
+                for pending, _ in applied[:len(applied) - index]:
+                    self._mark_rollback_pending(pending, attempt_id)
+                raise
+
+    def _rollback_chunk(self, marker, keys, attempt_id):
+        actions = [{
+            'Delete': {
+                'TableName': self.table_name,
+                'Key': {'productId': marker},
+                'ConditionExpression': 'attemptId = :attempt',
+                'ExpressionAttributeValues': {':attempt': attempt_id}
+            }
+        }]
+        for key, quantity in keys:
+            actions.append({
+                'Update': {
+                    'TableName': self.table_name,
+                    'Key': {'productId': key},
+                    'UpdateExpression': 'SET currentStock = currentStock + :qty',
+                    'ExpressionAttributeValues': {':qty': Decimal(quantity)}
+                }
+            })
+        try:
+            self.client.transact_write_items(TransactItems=actions)
+        except self.client.exceptions.TransactionCanceledException as e:
+            reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if reasons and reasons[0] == 'ConditionalCheckFailed':
+                # taken over by another delivery (our lease ran out), it's theirs to roll back
+                print(f"Not rolling back {marker}: owned by another delivery")
+                return
+            print(f"Error rolling back {marker}: {reasons}")
+            raise
+        except Exception as e:
+            print(f"Error rolling back {marker}: {e}")
+            raise
+
+    def _mark_rollback_pending(self, marker, attempt_id):
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={'productId': marker},
+                UpdateExpression='SET rollbackPending = :pending, leaseUntil = :released',
+                ConditionExpression='attemptId = :attempt',
+                ExpressionAttributeValues={':pending': True, ':released': 0, ':attempt': attempt_id}
+            )
+        except Exception as e:
+            # the marker keeps its lease: once it runs out the next delivery takes the
+            # parts over and completes the order instead
+            print(f"Error recording the pending rollback of {marker}: {e}")
@@ -1,44 +1,29 @@
-import json
 import os
-import boto3
-from decimal import Decimal
+from record_batch import process_batch
+from inventory import InventoryEngine, InsufficientStock
 
 dynamodb_table = os.environ['INVENTORY_TABLE_NAME']
-table = boto3.resource('dynamodb').Table(dynamodb_table)
+engine = InventoryEngine(dynamodb_table)
 
 def lambda_handler(event, context):
-    try:
-        # Parse SNS message
-        record = event['Records'][0]
-        message = json.loads(record['Sns']['Message'])
-
-        print("Received message:", message)
-
-        items = message['items']
-        for item in items:
-            product_id = item['productId']
-            quantity = item['quantity']
-
-            # Update inventory: Decrement currentStock
-            update_inventory(product_id, quantity)
-
-        print("Inventory updated successfully.")
+    # every order of the SNS / SQS batch, failed orders are reported per record
+    return process_batch(event, process_order)
 
-    except Exception as e:
-        print("Error updating inventory:", e)
+def process_order(message):
+    print("Received message:", message)
+    order_id = message['orderId']
 
-def update_inventory(product_id, quantity):
+    # all lines in one transaction, idempotent by orderId
     try:
-        response = table.update_item(
-            Key={'productId': product_id},
-            UpdateExpression="SET currentStock = currentStock - :qty",
-            ConditionExpression="currentStock >= :qty",
-            ExpressionAttributeValues={
-                ':qty': Decimal(quantity)
-            },
-            ReturnValues="UPDATED_NEW"
-        )
-        print(f"Updated {product_id}: New stock = {response['Attributes']['currentStock']}")
-    except Exception as e:
-            print(f"Error updating inventory for product {product_id}: {e}")
-            raise
\ No newline at end of file
+        applied = engine.apply_order(order_id, message['items'])
+    except InsufficientStock as e:
+        # retrying won't change the outcome, the order is reported and not retried
+        print(f"Order {order_id} not applied: {e}")
+        return {'orderId': order_id, 'status': 'insufficient_stock', 'productIds': e.product_ids}
+
+    if not applied:
+        print(f"Order {order_id} was already applied, skipping")
+        return {'orderId': order_id, 'status': 'duplicate'}
+
+    print("Inventory updated successfully.")
+    return {'orderId': order_id, 'status': 'applied'}
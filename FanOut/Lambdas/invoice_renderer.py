@@ -0,0 +1,169 @@
+import copy
+import hashlib
+import json
+import re
+from fpdf import FPDF
+
+# Invoice PDF renderer with the static layout compiled once per container.
+# The title, fonts, info block positions and the items table header are laid out once
+# into prototype documents; every invoice starts from a copy of the prototype and only
+# stamps the order's text, its rows and the total. Item rows are not laid out cell by
+# cell: one row is drawn once with marker texts and every item row is that page content
+# with the markers replaced, moved down into place. Orders that don't fit on one page
+# continue on pages starting with a prebuilt copy of the table header.
+# Stamping works on the page buffers and internals of PyFPDF 1.7.2 (pages, _escape, k,
+# the font state), hence the exact pin in requirements.txt; fpdf2 changes all of them.
+
+FONT = 'Arial'
+PAGE_BOTTOM_MARGIN = 15
+ROW_HEIGHT = 8
+
+COLUMN_WIDTHS = [35, 65, 25, 20, 30]
+COLUMN_HEADERS = ['Product ID', 'Product Name', 'Unit Price', 'Qty', 'Total']
+
+# info block above the table: (text, font style, font size, cell height, space before)
+INFO_LINES = [
+    ('Ship From: {shipFrom}', 'B', 12, 10, 0),
+    ('Ship To: {shipTo}', '', 11, 8, 0),
+    ('Order ID: {orderId}', '', 11, 8, 5),
+    ('Order Date: {orderDate}', '', 11, 8, 0),
+    ('Order Total: ${orderTotal:.2f}', 'B', 12, 10, 0),
+]
+TABLE_SPACE_BEFORE = 10
+INVOICE_PREFIX = 'invoices/'
+
+
+def invoice_key(order):
+    return f"{INVOICE_PREFIX}{order['orderId']}_invoice.pdf"
+
+
+def order_checksum(order):
+    # sha256 of the order as rendered, stored with the invoice so an unchanged order
+    # can be recognised without rendering it again (the PDF itself embeds its creation time)
+    canonical = json.dumps(order, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class InvoicePDF(FPDF):
+    def header(self):
+        self.set_font(FONT, 'B', 14)
+        self.cell(0, 10, 'Invoice', ln=True, align='C')
+        self.ln(5)
+
+
+class InvoiceRenderer:
+    def __init__(self):
+        # first page: title, info block positions and the table header
+        first = self._new_pdf()
+        first.add_page()
+        # register both fonts up front, in the same order as on continuation pages
+        first.set_font(FONT, '', 10)
+        self.info_slots = []
+        y = first.get_y()
+        for text, style, size, height, space_before in INFO_LINES:
+            y += space_before
+            self.info_slots.append((text, style, size, height, y))
+            y += height
+        first.set_y(y + TABLE_SPACE_BEFORE)
+        self._table_header(first)
+        self.first_page = first
+
+        # continuation pages: the table header right below the title, kept as the
+        # page content it adds and the font state it leaves behind
+        other = self._new_pdf()
+        other.add_page()
+        other.set_font(FONT, '', 10)
+        other.add_page()
+        before = len(other.pages[other.page])
+        self.continuation_y = other.get_y()
+        self._table_header(other)
+        self.continuation_header = other.pages[other.page][before:]
+        self.continuation_state = {name: copy.copy(getattr(other, name)) for name in self._font_state}
+
+        # item row: its page content split at the marker texts, drawn at row_template_y
+        other.set_font(FONT, '', 10)
+        self.row_template_y = other.get_y()
+        markers = [f'@@{column}@@' for column in range(len(COLUMN_WIDTHS))]
+        before = len(other.pages[other.page])
+        for width, marker in zip(COLUMN_WIDTHS, markers):
+            other.cell(width, ROW_HEIGHT, marker, border=1)
+        self.row_parts = re.split('|'.join(markers), other.pages[other.page][before:])
+        self.scale = other.k
+        self.escape = other._escape
+
+    _font_state = ('font_family', 'font_style', 'font_size_pt', 'font_size', 'current_font', 'underline', 'x', 'y')
+
+    def _new_pdf(self):
+        pdf = InvoicePDF()
+        pdf.set_auto_page_break(False, margin=PAGE_BOTTOM_MARGIN)
+        return pdf
+
+    def _table_header(self, pdf):
+        pdf.set_font(FONT, 'B', 11)
+        for width, header in zip(COLUMN_WIDTHS, COLUMN_HEADERS):
+            pdf.cell(width, 10, header, border=1)
+        pdf.ln()
+
+    def _copy_first_page(self):
+        # shallow copy of the prototype, with its own copies of the containers output() changes
+        pdf = copy.copy(self.first_page)
+        pdf.pages = dict(self.first_page.pages)
+        pdf.fonts = {key: dict(font) for key, font in self.first_page.fonts.items()}
+        pdf.offsets = {}
+        pdf.page_links = {}
+        pdf.links = {}
+        pdf.orientation_changes = dict(self.first_page.orientation_changes)
+        return pdf
+
+    def _continue_on_new_page(self, pdf):
+        pdf.add_page()
+        pdf.pages[pdf.page] += self.continuation_header
+        for name, value in self.continuation_state.items():
+            setattr(pdf, name, value)
+
+    def _stamp_row(self, texts, y):
+        # the template row with the texts filled in, shifted from row_template_y down to y
+        parts = self.row_parts
+        content = [parts[0]]
+        for text, part in zip(texts, parts[1:]):
+            content.append(self.escape(text))
+            content.append(part)
+        return f'q 1 0 0 1 0 {(self.row_template_y - y) * self.scale:.2f} cm\n{"".join(content)}Q\n'
+
+    def render(self, order):
+        # Returns the invoice PDF as bytes
+        pdf = self._copy_first_page()
+        row_y = pdf.get_y()
+
+        for text, style, size, height, y in self.info_slots:
+            pdf.set_font(FONT, style, size)
+            pdf.set_xy(pdf.l_margin, y)
+            pdf.cell(0, height, text.format(**order))
+
+        pdf.set_font(FONT, '', 10)
+        limit = pdf.h - PAGE_BOTTOM_MARGIN
+        rows = []
+        for item in order['items']:
+            if row_y + ROW_HEIGHT > limit:
+                pdf.pages[pdf.page] += ''.join(rows)
+                rows = []
+                self._continue_on_new_page(pdf)
+                pdf.set_font(FONT, '', 10)
+                row_y = pdf.get_y()
+            price = item['productPrice']
+            quantity = item['quantity']
+            row = (str(item['productId']), str(item['productName']), f'${price:.2f}', str(quantity), f'${price * quantity:.2f}')
+            rows.append(self._stamp_row(row, row_y))
+            row_y += ROW_HEIGHT
+        pdf.pages[pdf.page] += ''.join(rows)
+        pdf.set_xy(pdf.l_margin, row_y)
+
+        # total row
+        if pdf.get_y() + ROW_HEIGHT > limit:
+            self._continue_on_new_page(pdf)
+        pdf.set_font(FONT, 'B', 11)
+        pdf.cell(sum(COLUMN_WIDTHS[:-2]), ROW_HEIGHT, '', border=0)
+        pdf.cell(COLUMN_WIDTHS[-2], ROW_HEIGHT, 'Total:', border=1)
+        pdf.cell(COLUMN_WIDTHS[-1], ROW_HEIGHT, f"${order['orderTotal']:.2f}", border=1)
+
+        return pdf.output(dest='S').encode('latin1')
@@ -0,0 +1,114 @@
+import socket
+import socketserver
+import threading
+import time
+
+# Local SMTP stand-in for trying the email handlers and benchmarks without a mail provider.
+# Accepts any login and keeps the delivered messages in memory. The delays make a
+# session cost what a real one does:
+#   connect_delay  before the greeting (TCP + TLS handshake)
+#   auth_delay     before accepting the login
+#   message_delay  before accepting a message
+# idle_timeout closes sessions that stay quiet longer, as providers do.
+#
+#   with LocalSMTPServer(connect_delay=0.2, auth_delay=0.1) as server:
+#       pool = SMTPPool('user', 'secret', host=server.host, port=server.port, security='plain')
+
+
+class _Session(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server.owner
+        if server.idle_timeout:
+            self.connection.settimeout(server.idle_timeout)
+        time.sleep(server.connect_delay)
+        with server.lock:
+            server.stats['sessions'] += 1
+        self.reply('220 localhost ESMTP stand-in')
+
+        mail_from, recipients = None, []
+        try:
+            for raw in self.rfile:
+                line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+                command = line[:4].upper()
+                if command == 'EHLO':
+                    self.wfile.write(b'250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+                elif command == 'HELO':
+                    self.reply('250 localhost')
+                elif command == 'AUTH':
+                    if line.split()[1].upper() == 'LOGIN':
+                        for prompt in ('VXNlcm5hbWU6', 'UGFzc3dvcmQ6'):
+                            self.reply(f'334 {prompt}')
+                            self.rfile.readline()
+                    elif len(line.split()) == 2:
+                        self.reply('334 ')
+                        self.rfile.readline()
+                    time.sleep(server.auth_delay)
+                    self.reply('235 Authentication successful')
+                elif command == 'MAIL':
+                    mail_from, recipients = line.partition(':')[2].strip(), []
+                    self.reply('250 OK')
+                elif command == 'RCPT':
+                    recipients.append(line.partition(':')[2].strip())
+                    self.reply('250 OK')
+                elif command == 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    lines = []
+                    for data in self.rfile:
+                        if data in (b'.\r\n', b'.\n'):
+                            break
+                        lines.append(data[1:] if data.startswith(b'..') else data)
+                    time.sleep(server.message_delay)
+                    with server.lock:
+                        server.messages.append((mail_from, recipients, b''.join(lines)))
+                    mail_from, recipients = None, []
+                    self.reply('250 OK queued')
+                elif command in ('RSET', 'NOOP'):
+                    if command == 'RSET':
+                        mail_from, recipients = None, []
+                    self.reply('250 OK')
+                elif command == 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                else:
+                    self.reply('502 Command not implemented')
+        except (socket.timeout, ConnectionError):
+            pass
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalSMTPServer:
+    def __init__(self, host='127.0.0.1', port=0, connect_delay=0.0, auth_delay=0.0, message_delay=0.0,
+                 idle_timeout=None):
+        self.connect_delay = connect_delay
+        self.auth_delay = auth_delay
+        self.message_delay = message_delay
+        self.idle_timeout = idle_timeout
+        self.messages = []
+        self.stats = {'sessions': 0}
+        self.lock = threading.Lock()
+        self.server = _Server((host, port), _Session)
+        self.server.owner = self
+        self.host, self.port = self.server.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,65 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared record handling for the FanOut consumers.
+# Every record of the event is processed, a few at a time, and failures are reported
+# per record. Accepted event shapes:
+#   SNS -> Lambda                      Records[].Sns.Message
+#   SNS -> SQS -> Lambda               Records[].body, the SNS notification envelope
+#   SNS -> SQS (raw delivery) -> Lambda Records[].body, the order itself
+# With SQS, failed messages are returned as batchItemFailures (enable
+# ReportBatchItemFailures on the event source mapping) so only they are retried.
+# SNS has no partial failure response, so the invocation raises and SNS retries it.
+
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+
+
+class BatchProcessingError(Exception):
+    def __init__(self, failures):
+        super().__init__(f"{len(failures)} record(s) failed: {', '.join(failures)}")
+        self.failures = failures
+
+
+def parse_record(record):
+    # Returns (record id, message dict)
+    if 'Sns' in record:
+        return record['Sns'].get('MessageId'), json.loads(record['Sns']['Message'])
+
+    body = json.loads(record['body'])
+    if isinstance(body, dict) and body.get('Type') == 'Notification' and 'Message' in body:
+        body = json.loads(body['Message'])
+    return record['messageId'], body
+
+
+def process_batch(event, process, concurrency=BATCH_CONCURRENCY):
+    # process(message) -> result, raises on failure.
+    # Returns {'results': [...], 'batchItemFailures': [...]}
+    records = event.get('Records') or []
+    is_sqs = any(record.get('eventSource') == 'aws:sqs' for record in records)
+
+    def run(index_record):
+        index, record = index_record
+        record_id = record.get('messageId') or record.get('Sns', {}).get('MessageId') or str(index)
+        try:
+            record_id, message = parse_record(record)
+            if not message:
+                raise ValueError('empty message')
+            return record_id, True, process(message)
+        except Exception as e:
+            print(f"Error processing record {record_id}: {e}")
+            return record_id, False, str(e)
+
+    workers = max(1, min(concurrency, len(records)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = list(executor.map(run, enumerate(records)))
+
+    failures = [record_id for record_id, ok, _ in outcomes if not ok]
+    print(f"Processed {len(records)} record(s), {len(failures)} failed")
+    if failures and not is_sqs:
+        raise BatchProcessingError(failures)
+
+    return {
+        'results': [result for _, ok, result in outcomes if ok],
+        'batchItemFailures': [{'itemIdentifier': record_id} for record_id in failures]
+    }
@@ -0,0 +1,50 @@
+import json
+import os
+from stock_shards import DynamoDBShardStore, ShardedStock, HOT_SKU_SHARDS
+
+# Stock of products with sharded counters added up.
+#   API Gateway  GET ?productIds=P-1001,P-1002   -> {"stock": {"P-1001": 42, ...}}
+#   EventBridge schedule (e.g. rate(1 minute))   -> rebalances the shards of HOT_SKU_SHARDS
+#                                                   and moves the stock of a newly listed
+#                                                   product from its item into the shards;
+#                                                   invoke it once right after listing one
+
+dynamodb_table = os.environ['INVENTORY_TABLE_NAME']
+stock = ShardedStock(DynamoDBShardStore(dynamodb_table))
+
+MAX_PRODUCTS = 100
+
+def lambda_handler(event, context):
+    if event.get('source') == 'aws.events':
+        return rebalance_all()
+
+    query_string = event.get('queryStringParameters') or {}
+    product_ids = [p.strip() for p in (query_string.get('productIds') or '').split(',') if p.strip()]
+    if not product_ids:
+        return response(400, 'Missing productIds parameter')
+    if len(product_ids) > MAX_PRODUCTS:
+        return response(400, f'At most {MAX_PRODUCTS} productIds per request')
+
+    try:
+        return response(200, {'stock': stock.get_stock(product_ids)})
+    except Exception as e:
+        print('Error reading stock', e)
+        return response(500, 'error')
+
+def rebalance_all():
+    rebalanced = []
+    for product_id in HOT_SKU_SHARDS:
+        try:
+            if stock.rebalance(product_id):
+                rebalanced.append(product_id)
+        except Exception as e:
+            print(f"Error rebalancing {product_id}: {e}")
+    print(f"Rebalanced {len(rebalanced)} of {len(HOT_SKU_SHARDS)} products", rebalanced)
+    return {'rebalanced': rebalanced}
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(body)
+    }
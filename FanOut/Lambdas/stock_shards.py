@@ -0,0 +1,314 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+# Sharded stock counters for hot products.
+# The stock of a product listed in HOT_SKU_SHARDS is split over N items
+# '<productId>#0' .. '<productId>#N-1', each with its own currentStock, so a flash sale
+# spreads its decrements over N partition keys instead of one.
+#   - decrements take a quantity from one shard that had enough stock when last seen;
+#     when no shard has enough on its own, the shards are read and the quantity is split
+#     over the fullest ones (in one transaction)
+#   - get_stock adds the shards up (read API)
+#   - rebalance evens the shards out again (scheduled, see stock_handler.py)
+#   - stock left on the unsharded '<productId>' item, from before the product was
+#     listed, is moved into the shards by rebalance, or by the first decrement that
+#     finds the shards short
+#
+#   HOT_SKU_SHARDS='{"P-1001": 8}'
+
+HOT_SKU_SHARDS = json.loads(os.environ.get('HOT_SKU_SHARDS') or '{}')
+# a product is rebalanced when its emptiest shard holds less than this share of the average
+REBALANCE_THRESHOLD = float(os.environ.get('REBALANCE_THRESHOLD', '0.25'))
+# how long a seen shard stock is trusted when picking a shard
+STOCK_CACHE_SECONDS = float(os.environ.get('STOCK_CACHE_SECONDS', '30'))
+# DynamoDB BatchGetItem accepts at most 100 keys, a transaction 100 actions
+BATCH_GET_LIMIT = 100
+MAX_TRANSACTION_ITEMS = 100
+
+
+def shard_key(product_id, shard):
+    return f'{product_id}#{shard}'
+
+
+def split_evenly(total, shards):
+    # [stock per shard], the remainder goes to the first shards
+    return [total // shards + (1 if shard < total % shards else 0) for shard in range(shards)]
+
+
+class DynamoDBShardStore:
+    def __init__(self, table_name, client=None):
+        import boto3
+
+        self.table_name = table_name
+        # the resource's client (de)serializes python types
+        self.client = client or boto3.resource('dynamodb').meta.client
+
+    def decrement(self, key, quantity):
+        # new stock of the item, None when it holds less than quantity
+        try:
+            response = self.client.update_item(
+                TableName=self.table_name,
+                Key={'productId': key},
+                UpdateExpression='SET currentStock = currentStock - :qty',
+                ConditionExpression='currentStock >= :qty',
+                ExpressionAttributeValues={':qty': Decimal(quantity)},
+                ReturnValues='UPDATED_NEW'
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return None
+        return int(response['Attributes']['currentStock'])
+
+    def decrement_many(self, parts):
+        # Takes every (key, quantity) in one transaction. False when an item holds less
+        try:
+            self.client.transact_write_items(TransactItems=[{
+                'Update': {
+                    'TableName': self.table_name,
+                    'Key': {'productId': key},
+                    'UpdateExpression': 'SET currentStock = currentStock - :qty',
+                    'ConditionExpression': 'currentStock >= :qty',
+                    'ExpressionAttributeValues': {':qty': Decimal(quantity)}
+                }
+            } for key, quantity in parts])
+        except self.client.exceptions.TransactionCanceledException:
+            return False
+        return True
+
+    def get_many(self, keys):
+        stock = {}
+        keys = list(keys)
+        for start in range(0, len(keys), BATCH_GET_LIMIT):
+            request = {
+                self.table_name: {
+                    'Keys': [{'productId': key} for key in keys[start:start + BATCH_GET_LIMIT]],
+                    'ProjectionExpression': 'productId, currentStock'
+                }
+            }
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    stock[item['productId']] = int(item.get('currentStock', 0))
+                request = response.get('UnprocessedKeys')
+        return stock
+
+    def replace(self, expected, updated):
+        # Sets the shards to the updated values if they still hold the expected ones,
+        # in one transaction. Returns False when a shard changed in between.
+        actions = []
+        for key, value in updated.items():
+            if key in expected:
+                condition = 'currentStock = :seen'
+                values = {':seen': Decimal(expected[key]), ':new': Decimal(value)}
+            else:
+                condition = 'attribute_not_exists(productId)'
+                values = {':new': Decimal(value)}
+            actions.append({
+                'Update': {
+                    'TableName': self.table_name,
+                    'Key': {'productId': key},
+                    'UpdateExpression': 'SET currentStock = :new',
+                    'ConditionExpression': condition,
+                    'ExpressionAttributeValues': values
+                }
+            })
+        try:
+            self.client.transact_write_items(TransactItems=actions)
+        except self.client.exceptions.TransactionCanceledException:
+            return False
+        return True
+
+
+class LocalShardStore:
+    # In-memory stand-in for the inventory table. writes_per_key limits how many writes
+    # a single item accepts per second, like the throughput of one DynamoDB partition key.
+    def __init__(self, stock=None, writes_per_key=None):
+        self.stock = dict(stock or {})
+        self.writes_per_key = writes_per_key
+        self.lock = threading.Lock()
+        self.key_locks = defaultdict(threading.Lock)
+        self.next_write = defaultdict(float)
+
+    def _throttle(self, key):
+        if not self.writes_per_key:
+            return
+        with self.key_locks[key]:
+            now = time.perf_counter()
+            slot = max(now, self.next_write[key])
+            self.next_write[key] = slot + 1.0 / self.writes_per_key
+        if slot > now:
+            time.sleep(slot - now)
+
+    def decrement(self, key, quantity):
+        self._throttle(key)
+        with self.lock:
+            if self.stock.get(key, 0) < quantity:
+                return None
+            self.stock[key] -= quantity
+            return self.stock[key]
+
+    def decrement_many(self, parts):
+        for key, _ in parts:
+            self._throttle(key)
+        with self.lock:
+            if any(self.stock.get(key, 0) < quantity for key, quantity in parts):
+                return False
+            for key, quantity in parts:
+                self.stock[key] -= quantity
+            return True
+
+    def get_many(self, keys):
+        with self.lock:
+            return {key: self.stock[key] for key in keys if key in self.stock}
+
+    def replace(self, expected, updated):
+        with self.lock:
+            if any(self.stock.get(key) != expected.get(key) for key in updated):
+                return False
+            self.stock.update(updated)
+            return True
+
+
+class ShardedStock:
+    def __init__(self, store, shards=None):
+        self.store = store
+        self.shards = HOT_SKU_SHARDS if shards is None else shards
+        # shard key -> (stock when last seen, when), kept while the container is warm
+        self.seen = {}
+
+    def shard_keys(self, product_id):
+        shards = self.shards.get(product_id, 1)
+        if shards <= 1:
+            return [product_id]
+        return [shard_key(product_id, shard) for shard in range(shards)]
+
+    def allocate(self, product_id, quantity, refresh=False, max_parts=None):
+        # [(item key, quantity)] to take quantity from: a random shard that had enough
+        # stock when last seen (unknown shards count as available), or with refresh, the
+        # shards as read now, split over the fullest ones (at most max_parts) when none
+        # has enough on its own. None when they hold less than quantity.
+        keys = self.shard_keys(product_id)
+        if len(keys) == 1:
+            return [(product_id, quantity)]
+        if not refresh:
+            available = [key for key in keys if self._seen_stock(key, quantity) >= quantity]
+            if available:
+                return [(random.choice(available), quantity)]
+
+        stock = self.store.get_many(keys + [product_id])
+        if stock.get(product_id, 0) > 0:
+            # stock of the unsharded item, from before the product was sharded
+            self.rebalance(product_id)
+            stock = self.store.get_many(keys)
+        stock = {key: stock.get(key, 0) for key in keys}
+        for key, value in stock.items():
+            self.observe(key, value)
+
+        available = [key for key in keys if stock[key] >= quantity]
+        if available:
+            return [(random.choice(available), quantity)]
+        parts = []
+        remaining = quantity
+        for key in sorted(keys, key=stock.get, reverse=True)[:max_parts]:
+            take = min(remaining, stock[key])
+            if take <= 0:
+                break
+            parts.append((key, take))
+            remaining -= take
+            if not remaining:
+                return parts
+        return None
+
+    def _seen_stock(self, key, default):
+        stock, seen_at = self.seen.get(key, (default, None))
+        if seen_at is None or time.monotonic() - seen_at > STOCK_CACHE_SECONDS:
+            return default
+        return stock
+
+    def observe(self, key, stock):
+        self.seen[key] = (stock, time.monotonic())
+
+    def observe_decrement(self, key, quantity):
+        if key in self.seen:
+            self.observe(key, max(0, self.seen[key][0] - quantity))
+
+    def observe_short(self, key, quantity):
+        # the shard holds less than quantity
+        self.observe(key, min(self._seen_stock(key, quantity - 1), quantity - 1))
+
+    def decrement(self, product_id, quantity):
+        # Takes quantity from the shards of the product, see allocate.
+        # Returns [(shard key, quantity)], None when the product holds less than quantity
+        refresh = False
+        for _ in range(len(self.shard_keys(product_id)) + 1):
+            parts = self.allocate(product_id, quantity, refresh)
+            if parts is None:
+                return None
+            if len(parts) == 1:
+                key = parts[0][0]
+                stock = self.store.decrement(key, quantity)
+                if stock is not None:
+                    self.observe(key, stock)
+                    return parts
+                if len(self.shard_keys(product_id)) == 1:
+                    return None
+                self.observe_short(key, quantity)
+            elif self.store.decrement_many(parts):
+                for key, taken in parts:
+                    self.observe_decrement(key, taken)
+                return parts
+            # the shards changed since they were seen
+            refresh = True
+        return None
+
+    def get_stock(self, product_ids):
+        # {productId: total stock over its shards}, including stock still on the unsharded
+        # item until it is moved into the shards
+        keys = {}
+        for product_id in product_ids:
+            shard_keys = self.shard_keys(product_id)
+            keys[product_id] = shard_keys if product_id in shard_keys else shard_keys + [product_id]
+        stock = self.store.get_many(key for shard_keys in keys.values() for key in shard_keys)
+        for key, value in stock.items():
+            self.observe(key, value)
+        return {product_id: sum(stock.get(key, 0) for key in shard_keys) for product_id, shard_keys in keys.items()}
+
+    def set_stock(self, product_id, total):
+        # (Re)distributes the total stock of a product over its shards, e.g. on restock.
+        # Raises RuntimeError if the shards keep changing meanwhile.
+        return self._redistribute(product_id, lambda current: total, force=True)
+
+    def rebalance(self, product_id):
+        # Evens out the shards of a product, keeping its total. Returns True if it moved stock
+        return self._redistribute(product_id, sum, force=False)
+
+    def _redistribute(self, product_id, total_of, force, attempts=5):
+        keys = self.shard_keys(product_id)
+        if len(keys) >= MAX_TRANSACTION_ITEMS:
+            raise ValueError(f'{product_id} has more than {MAX_TRANSACTION_ITEMS - 1} shards')
+        # the unsharded item, its stock is moved into the shards
+        legacy = [product_id] if keys != [product_id] else []
+        for _ in range(attempts):
+            current = self.store.get_many(keys + legacy)
+            values = [current.get(key, 0) for key in keys]
+            unsharded = sum(current.get(key, 0) for key in legacy)
+            if not force and not unsharded and not self._needs_rebalance(values):
+                return False
+            target = dict(zip(keys, split_evenly(total_of(values + [unsharded]), len(keys))))
+            if unsharded:
+                target[product_id] = 0
+            if self.store.replace(current, target):
+                for key, stock in target.items():
+                    self.observe(key, stock)
+                return True
+        raise RuntimeError(f'Shards of {product_id} kept changing, not redistributed')
+
+    def _needs_rebalance(self, values):
+        total = sum(values)
+        if total < len(values):
+            return False
+        return min(values) < REBALANCE_THRESHOLD * total / len(values)
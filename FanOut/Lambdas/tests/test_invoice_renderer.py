@@ -0,0 +1,99 @@
+import os
+import re
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from invoice_renderer import COLUMN_HEADERS, PAGE_BOTTOM_MARGIN, InvoiceRenderer  # noqa: E402
+
+# The renderer stamps rows into the page buffers of PyFPDF 1.7.2; these tests read the
+# rendered PDF back (page count, the text drawn on every page and where) so an fpdf
+# upgrade that changes those internals fails here instead of producing broken invoices.
+
+TEXT = re.compile(r'BT ([\d.]+) ([\d.]+) Td \(((?:\\.|[^\\)])*)\) Tj ET')
+MOVE = re.compile(r'q 1 0 0 1 0 (-?[\d.]+) cm')
+
+
+def read_pdf(data):
+    # (page count, [[(text, y in points from the bottom of the page)] per page])
+    count = int(re.search(rb'/Type /Pages\n/Kids \[.*?\]\n/Count (\d+)', data, re.S).group(1))
+    streams = re.findall(rb'stream\n(.*?)\nendstream', data, re.S)
+    pages = []
+    for stream in streams[:count]:
+        shift = 0.0
+        texts = []
+        for line in zlib.decompress(stream).decode('latin1').split('\n'):
+            move = MOVE.match(line)
+            if move:
+                shift = float(move.group(1))
+            elif line == 'Q':
+                shift = 0.0
+            for _, y, text in TEXT.findall(line):
+                texts.append((re.sub(r'\\(.)', r'\1', text), float(y) + shift))
+        pages.append(texts)
+    return count, pages
+
+
+def make_order(items):
+    return {
+        'orderId': 'ORD-1',
+        'orderDate': '2025-05-31',
+        'shipFrom': 'Warehouse (East)',
+        'shipTo': 'Ann \\ Co',
+        'orderTotal': sum(i * 1.25 * (i % 3 + 1) for i in range(items)),
+        'items': [
+            {'productId': f'P-{i}', 'productName': f'Item ({i})', 'productPrice': i * 1.25, 'quantity': i % 3 + 1}
+            for i in range(items)
+        ],
+    }
+
+
+def row_texts(item):
+    price, quantity = item['productPrice'], item['quantity']
+    return [item['productId'], item['productName'], f'${price:.2f}', str(quantity), f'${price * quantity:.2f}']
+
+
+@pytest.fixture(scope='module')
+def renderer():
+    return InvoiceRenderer()
+
+
+def test_single_page_invoice(renderer):
+    order = make_order(3)
+    count, pages = read_pdf(renderer.render(order))
+    assert count == 1
+    texts = [text for text, _ in pages[0]]
+    for line in ('Invoice', 'Ship From: Warehouse (East)', 'Ship To: Ann \\ Co', 'Order ID: ORD-1',
+                 'Order Date: 2025-05-31', f"Order Total: ${order['orderTotal']:.2f}"):
+        assert line in texts
+    expected = COLUMN_HEADERS + [text for item in order['items'] for text in row_texts(item)]
+    expected += ['Total:', f"${order['orderTotal']:.2f}"]
+    table = texts[texts.index(COLUMN_HEADERS[0]):]
+    assert [text for text in table if not text.startswith(('Ship ', 'Order '))] == expected
+
+
+@pytest.mark.parametrize('items, page_count', [(30, 2), (100, 4)])
+def test_rows_continue_on_new_pages(renderer, items, page_count):
+    order = make_order(items)
+    count, pages = read_pdf(renderer.render(order))
+    assert count == page_count
+    rows = []
+    for number, page in enumerate(pages):
+        texts = [text for text, _ in page]
+        assert texts[0] == 'Invoice'
+        assert texts[texts.index(COLUMN_HEADERS[0]):][:len(COLUMN_HEADERS)] == COLUMN_HEADERS
+        if number:
+            assert not any(text.startswith('Ship From') for text in texts)
+        # every text is drawn above the bottom margin, each row below the previous one
+        bottom = PAGE_BOTTOM_MARGIN * 72 / 25.4
+        assert all(y > bottom for _, y in page)
+        ids = [(text, y) for text, y in page if text.startswith('P-')]
+        assert [y for _, y in ids] == sorted((y for _, y in ids), reverse=True)
+        assert len({y for _, y in ids}) == len(ids)
+        table = texts[texts.index(COLUMN_HEADERS[0]) + len(COLUMN_HEADERS):]
+        rows.extend(text for text in table if not text.startswith(('Ship ', 'Order ')))
+    expected = [text for item in order['items'] for text in row_texts(item)]
+    assert rows == expected + ['Total:', f"${order['orderTotal']:.2f}"]
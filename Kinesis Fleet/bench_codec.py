@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import io
+import time
+from decimal import Decimal, Context, Inexact, Rounded, localcontext
+from position_codec import encode_item
+
+# Microbenchmark: records/sec of the typed position codec against the previous
+# stream_handler path (recursive float -> Decimal conversion and float scan of the
+# item and of the update values, per-float logging, strict decimal context,
+# then boto3's TypeSerializer as used by the resource API).
+#
+#   python bench_codec.py -n 200000
+
+try:
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+except ImportError:
+    serializer = None
+
+
+def convert_floats_to_decimal(obj):
+    if isinstance(obj, dict):
+        return {k: convert_floats_to_decimal(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_floats_to_decimal(i) for i in obj]
+    elif isinstance(obj, float):
+        print(f"Converting float to Decimal: {obj}")
+        return Decimal(str(obj))
+    else:
+        return obj
+
+
+def assert_no_floats(obj):
+    if isinstance(obj, dict):
+        for v in obj.values():
+            assert_no_floats(v)
+    elif isinstance(obj, list):
+        for i in obj:
+            assert_no_floats(i)
+    elif isinstance(obj, float):
+        raise TypeError(f"Float value found in payload at leaf: {obj}")
+
+
+def sample_item(i):
+    return {
+        'PK': str(773983 + i % 500),
+        'trainId': str(773983 + i % 500),
+        'trainName': 'Rajdhani Express',
+        'trainSource': 'New Delhi',
+        'trainDestination': 'Mumbai Central',
+        'journeyDate': '2025-09-10',
+        'departureTime': '16:55',
+        'arrivalTime': '08:35',
+        'latitude': 28.6428915 + i * 1e-6,
+        'longitude': 77.2190894 + i * 1e-6,
+        'address': {'railway': 'Tilak Bridge', 'state_district': 'New Delhi', 'state': 'Delhi', 'country': 'India'},
+        'lastSequenceNumber': str(49590338271490256608559692538361571095921575989136588898 + i),
+        'lastUpdatedTime': 1757500000 + i,
+        'approximateArrivalTimestamp': 1757500000 + i,
+    }
+
+
+def legacy_path(item):
+    payload = dict(item)
+    payload['latitude'] = str(payload['latitude'])
+    payload['longitude'] = str(payload['longitude'])
+    payload = convert_floats_to_decimal(payload)
+    assert_no_floats(payload)
+
+    expr_vals = {
+        ':val1': payload['lastSequenceNumber'],
+        ':val2': payload['approximateArrivalTimestamp'],
+        ':val3': payload['address'],
+        ':val4': payload['lastUpdatedTime'],
+        ':val5': payload['latitude'],
+        ':val6': payload['longitude']
+    }
+    expr_vals = convert_floats_to_decimal(expr_vals)
+    assert_no_floats(expr_vals)
+
+    if serializer:
+        return {k: serializer.serialize(v) for k, v in payload.items()}
+    return payload
+
+
+def codec_path(item):
+    return encode_item(item)
+
+
+def run(name, func, items):
+    # log output goes to a buffer, as it would go to CloudWatch rather than a terminal
+    strict = Context(traps=[Inexact, Rounded])
+    with contextlib.redirect_stdout(io.StringIO()), localcontext(strict):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+    print(f'{name:<8} {len(items) / elapsed:>12,.0f} records/sec  ({elapsed:.3f}s)')
+    return len(items) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark train position encoding.')
+    parser.add_argument('-n', '--records', type=int, default=100_000, help='Number of records to encode')
+    args = parser.parse_args()
+
+    items = [sample_item(i) for i in range(args.records)]
+    if not serializer:
+        print('boto3 not installed, legacy path measured without TypeSerializer')
+
+    legacy = run('legacy', legacy_path, items)
+    codec = run('codec', codec_path, items)
+    print(f'speedup  {codec / legacy:.1f}x')
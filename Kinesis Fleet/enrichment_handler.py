@@ -0,0 +1,116 @@
+import json
+import os
+import time
+import boto3
+from botocore.exceptions import ClientError
+from geocode_cache import create_cache, fetch_address
+from position_codec import sequence_key
+
+# Consumes address enrichment jobs queued by stream_handler (SQS event source with
+# ReportBatchItemFailures) and writes the address back to the train item.
+# Geocoder calls are rate limited, jobs that cannot be geocoded are retried by SQS
+# and end up in the queue's dead-letter queue after maxReceiveCount.
+
+dynamodb = boto3.resource('dynamodb')
+table_name = os.environ['DYNAMODB_TABLE_NAME']
+dynamodb_table = dynamodb.Table(table_name)
+
+# maximum geocoder calls per second from one container
+GEOCODE_RATE_PER_SEC = float(os.environ.get('GEOCODE_RATE_PER_SEC', '1'))
+
+geocode_cache = create_cache()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+rate_limiter = TokenBucket(GEOCODE_RATE_PER_SEC)
+
+
+def rate_limited_fetch(lat, lon):
+    rate_limiter.acquire()
+    return fetch_address(lat, lon)
+
+
+def lambda_handler(event, context):
+    records = event.get('Records', [])
+
+    # only the newest job per train matters, older ones are acknowledged as is
+    latest = {}
+    message_ids = {}
+    failures = []
+    for record in records:
+        try:
+            job = json.loads(record['body'])
+            trainId = job['trainId']
+            int(job['sequenceNumber'])
+            float(job['latitude']), float(job['longitude'])
+            job['sequenceKey'] = job.get('sequenceKey') or sequence_key(job['sequenceNumber'])
+        except Exception as e:
+            # retried on its own and dead-lettered, the rest of the batch goes on
+            print('Malformed enrichment job', record['messageId'], e)
+            failures.append(record['messageId'])
+            continue
+        message_ids.setdefault(trainId, []).append(record['messageId'])
+        current = latest.get(trainId)
+        if current is None or job['sequenceKey'] > current['sequenceKey']:
+            latest[trainId] = job
+
+    jobs = list(latest.values())
+    points = [(job['latitude'], job['longitude']) for job in jobs]
+    addresses = geocode_cache.lookup_many(points, rate_limited_fetch)
+    print('geocode cache', geocode_cache.metrics())
+
+    enriched = 0
+    for job, address in zip(jobs, addresses):
+        if not address:
+            print('Unable to fetch address for train', job['trainId'])
+            failures.extend(message_ids[job['trainId']])
+            continue
+        try:
+            write_address(job, address)
+            enriched += 1
+        except Exception as e:
+            print('Error writing address for train', job['trainId'], e)
+            failures.extend(message_ids[job['trainId']])
+
+    print(f'Enriched {enriched} of {len(jobs)} trains')
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+
+
+def write_address(job, address):
+    # never replace an address that belongs to a newer position; compared on the
+    # ping_key stream_handler sent with the job (sequence_key for older jobs)
+    try:
+        dynamodb_table.update_item(
+            Key={'PK': job['trainId']},
+            UpdateExpression='set address = :address, addressSequenceNumber = :seq, addressSequenceKey = :key',
+            ConditionExpression=(
+                'attribute_exists(PK) AND (attribute_not_exists(addressSequenceKey) '
+                'OR addressSequenceKey < :key)'
+            ),
+            ExpressionAttributeValues={
+                ':address': address,
+                ':seq': job['sequenceNumber'],
+                ':key': job['sequenceKey']
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        print('Newer address already stored for train', job['trainId'])
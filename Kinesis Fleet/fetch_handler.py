@@ -1,36 +1,82 @@
 import json
+import math
 import os
+import time
+import hashlib
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+import track_store
+from geocode_cache import cell_size, cells_covering, REGION_CELL_PRECISION
+from instrumentation import Metrics
 
 cors_headers = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match',
+    'Access-Control-Expose-Headers': 'ETag'
 }
 
 dynamodb_table_name = os.environ['DYNAMODB_TABLE_NAME']
 
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table(dynamodb_table_name)
+track_table = dynamodb.Table(track_store.TRACK_TABLE_NAME) if track_store.TRACK_TABLE_NAME else None
 
+# default /track window when no 'from' is given
+TRACK_DEFAULT_WINDOW_SECONDS = 3600
 
+# GSI on the positions table: partition key regionCell, projecting BULK_FIELDS
+REGION_INDEX_NAME = os.environ.get('REGION_INDEX_NAME', 'regionCell-index')
+# DynamoDB BatchGetItem accepts at most 100 keys per call
+BATCH_GET_LIMIT = 100
+# trains per bulk response; bbox and region responses beyond it are truncated
+MAX_BULK_TRAINS = int(os.environ.get('MAX_BULK_TRAINS', '2000'))
+# region cells a bbox may cover, one index query each
+MAX_BBOX_CELLS = int(os.environ.get('MAX_BBOX_CELLS', '100'))
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', '8'))
+
+# columns of the bulk response
+BULK_FIELDS = ['trainName', 'latitude', 'longitude', 'address', 'lastUpdatedTime']
+# attributes read for the bulk response, the sequence numbers make up the version tag
+BULK_ATTRIBUTES = ['PK'] + BULK_FIELDS + ['lastSequenceNumber', 'addressSequenceNumber']
+BULK_PROJECTION = ', '.join(f'#a{i}' for i in range(len(BULK_ATTRIBUTES)))
+BULK_ATTRIBUTE_NAMES = {f'#a{i}': name for i, name in enumerate(BULK_ATTRIBUTES)}
+
+# low-level client is thread safe, the resource's client also (de)serializes python types
+db_client = dynamodb.meta.client
+executor = ThreadPoolExecutor(max_workers=BULK_CONCURRENCY)
+
+metrics = Metrics('fetch_handler')
+
+
+@metrics.handler
 def lambda_handler(event, context):
-    print('event', event)
     # get trainId request params
-    query_string = event['queryStringParameters']
+    query_string = event.get('queryStringParameters') or {}
+    path = (event.get('resource') or event.get('path') or event.get('rawPath') or '').rstrip('/')
+    metrics.log('fetch_handler: request', {'path': path, 'query': query_string})
+
+    if path.endswith('/bulk'):
+        metrics.property('route', 'bulk')
+        return get_bulk_status(event, query_string)
+
     if not query_string:
         return response(400, 'Missing query string parameters')
 
-    print('queryparams',query_string)
     trainId = query_string.get('trainId')
     if not trainId:
         return response(400, 'Missing trainId or trainName parameter')
 
+    if path.endswith('/track'):
+        metrics.property('route', 'track')
+        return get_track(trainId, query_string)
+
     # get item from dynamodb
+    metrics.property('route', 'status')
     try:
-        db_response = table.get_item(Key={'PK': trainId})
-        print('response',db_response)
+        with metrics.timer('Query'):
+            db_response = table.get_item(Key={'PK': trainId})
         item = db_response['Item']
 
 
@@ -38,9 +84,175 @@ def lambda_handler(event, context):
             return response(200, item)
     except Exception as e:
         print('response error',e)
+        metrics.count('NotFound')
         return response(200, {'message':'Status Not found'})
 
 
+def get_track(trainId, query_string):
+    # /track?trainId=..&from=<epoch s>&to=<epoch s>[&journeyDate=YYYY-MM-DD]
+    if track_table is None:
+        return response(404, 'Track history is not enabled')
+
+    try:
+        end = float(query_string.get('to') or time.time())
+        start = float(query_string.get('from') or end - TRACK_DEFAULT_WINDOW_SECONDS)
+    except ValueError:
+        return response(400, "'from' and 'to' must be epoch seconds")
+    if start > end:
+        return response(400, "'from' must not be after 'to'")
+
+    start_ms, end_ms = int(start * 1000), int(end * 1000)
+    journeyDate = query_string.get('journeyDate') or track_store.journey_date_for({}, end_ms)
+
+    try:
+        with metrics.timer('Query'):
+            points = track_store.query_track(track_table, trainId, journeyDate, start_ms, end_ms)
+        metrics.count('TrackPoints', len(points))
+    except Exception as e:
+        print('track query error', e)
+        return response(500, {'message': 'Unable to fetch track'})
+
+    return response(200, {
+        'trainId': trainId,
+        'journeyDate': journeyDate,
+        'count': len(points),
+        'polyline': track_store.encode_polyline(points),
+        'points': [[timestamp, lat, lon] for timestamp, lat, lon in points]
+    })
+
+
+def get_bulk_status(event, query_string):
+    # /bulk?trainIds=1,2,3 | ?bbox=minLon,minLat,maxLon,maxLat | ?region=<regionCell>
+    # the same keys are accepted in a JSON POST body, trainIds as a list
+    params = dict(query_string)
+    if event.get('body'):
+        try:
+            params.update(json.loads(event['body']))
+        except (ValueError, TypeError):
+            return response(400, 'Invalid JSON body')
+
+    try:
+        if params.get('trainIds'):
+            train_ids = params['trainIds']
+            if isinstance(train_ids, str):
+                train_ids = train_ids.split(',')
+            train_ids = list(dict.fromkeys(str(t).strip() for t in train_ids if str(t).strip()))
+            if len(train_ids) > MAX_BULK_TRAINS:
+                return response(400, f'At most {MAX_BULK_TRAINS} trainIds per request')
+            with metrics.timer('Query'):
+                items = batch_get_trains(train_ids)
+        elif params.get('bbox'):
+            bbox = params['bbox']
+            if isinstance(bbox, str):
+                bbox = bbox.split(',')
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox)
+            if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+                return response(400, 'bbox must be minLon,minLat,maxLon,maxLat')
+            if bbox_cell_count(min_lon, min_lat, max_lon, max_lat) > MAX_BBOX_CELLS:
+                return response(400, f'bbox covers more than {MAX_BBOX_CELLS} regions, zoom in')
+            cells = cells_covering(min_lon, min_lat, max_lon, max_lat, REGION_CELL_PRECISION)
+            with metrics.timer('Query'):
+                regions = query_regions(cells)
+            items = [item for item in regions if in_bbox(item, min_lon, min_lat, max_lon, max_lat)]
+        elif params.get('region'):
+            with metrics.timer('Query'):
+                items = query_regions([str(params['region'])])
+        else:
+            return response(400, 'One of trainIds, bbox or region is required')
+    except ValueError:
+        return response(400, 'Invalid trainIds, bbox or region')
+    except Exception as e:
+        print('bulk status error', e)
+        return response(500, {'message': 'Unable to fetch status'})
+
+    items.sort(key=lambda item: item['PK'])
+    truncated = len(items) > MAX_BULK_TRAINS
+    if truncated:
+        metrics.count('BulkTruncated')
+        items = items[:MAX_BULK_TRAINS]
+    metrics.count('BulkTrains', len(items))
+    versions = [train_version(item) for item in items]
+    tags = '|'.join(f"{item['PK']}:{version}" for item, version in zip(items, versions))
+    etag = '"' + hashlib.sha1(tags.encode()).hexdigest() + '"'
+
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+        metrics.count('NotModified')
+        return {'statusCode': 304, 'body': '', 'headers': {**cors_headers, 'ETag': etag}}
+
+    # columnar payload: one list per field, rows line up by index
+    columns = {'trainId': [item['PK'] for item in items]}
+    for field in BULK_FIELDS:
+        columns[field] = [item.get(field) for item in items]
+    columns['version'] = versions
+
+    result = response(200, {'count': len(items), 'truncated': truncated, 'columns': columns})
+    result['headers'] = {**cors_headers, 'ETag': etag}
+    return result
+
+
+def bbox_cell_count(min_lon, min_lat, max_lon, max_lat):
+    # upper bound of the region cells covering the bbox, without enumerating them
+    lat_step, lon_step = cell_size(REGION_CELL_PRECISION)
+    return (math.ceil((max_lat - min_lat) / lat_step) + 1) * (math.ceil((max_lon - min_lon) / lon_step) + 1)
+
+
+def in_bbox(item, min_lon, min_lat, max_lon, max_lat):
+    # trains without a position yet are left out
+    if item.get('latitude') is None or item.get('longitude') is None:
+        return False
+    return min_lat <= float(item['latitude']) <= max_lat and min_lon <= float(item['longitude']) <= max_lon
+
+
+def train_version(item):
+    # changes whenever the position or the address of the train changes
+    return f"{item.get('lastSequenceNumber', '')}.{item.get('addressSequenceNumber', '')}"
+
+
+def batch_get_trains(train_ids):
+    chunks = [train_ids[start:start + BATCH_GET_LIMIT] for start in range(0, len(train_ids), BATCH_GET_LIMIT)]
+    return [item for items in executor.map(_batch_get_chunk, chunks) for item in items]
+
+
+def _batch_get_chunk(train_ids):
+    items = []
+    request = {
+        dynamodb_table_name: {
+            'Keys': [{'PK': trainId} for trainId in train_ids],
+            'ProjectionExpression': BULK_PROJECTION,
+            'ExpressionAttributeNames': BULK_ATTRIBUTE_NAMES
+        }
+    }
+    while request:
+        db_response = db_client.batch_get_item(RequestItems=request)
+        items.extend(db_response['Responses'].get(dynamodb_table_name, []))
+        request = db_response.get('UnprocessedKeys')
+    return items
+
+
+def query_regions(cells):
+    return [item for items in executor.map(_query_region, cells) for item in items]
+
+
+def _query_region(cell):
+    # stops once the cell alone holds more trains than a response returns
+    items = []
+    kwargs = {
+        'TableName': dynamodb_table_name,
+        'IndexName': REGION_INDEX_NAME,
+        'KeyConditionExpression': 'regionCell = :cell',
+        'ExpressionAttributeValues': {':cell': cell},
+        'ProjectionExpression': BULK_PROJECTION,
+        'ExpressionAttributeNames': BULK_ATTRIBUTE_NAMES
+    }
+    while True:
+        db_response = db_client.query(**kwargs)
+        items.extend(db_response['Items'])
+        if 'LastEvaluatedKey' not in db_response or len(items) > MAX_BULK_TRAINS:
+            return items
+        kwargs['ExclusiveStartKey'] = db_response['LastEvaluatedKey']
+
+
 def response(statusCode, body):
     return {
         'statusCode': statusCode,
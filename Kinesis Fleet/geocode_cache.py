@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import time
+import urllib.request
+from collections import OrderedDict
+
+# Reverse-geocode cache keyed by geohash cell.
+# Pings inside the same cell share one address, so consecutive pings of a train and the
+# same track segments on later days are served without calling the geocoding API.
+#   1. in-memory LRU, lives as long as the warm Lambda container
+#   2. persistent store, a DynamoDB table (PK 'cell') or a local in-memory stand-in
+
+# precision 6 is roughly a 1.2 km x 0.6 km cell, 7 is roughly 150 m x 150 m
+GEOCODE_CACHE_PRECISION = int(os.environ.get('GEOCODE_CACHE_PRECISION', '6'))
+GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', '10000'))
+GEOCODE_CACHE_TABLE_NAME = os.environ.get('GEOCODE_CACHE_TABLE_NAME')
+# optional TTL (in days) for persisted addresses, 0 disables expiry
+GEOCODE_CACHE_TTL_DAYS = int(os.environ.get('GEOCODE_CACHE_TTL_DAYS', '0'))
+
+# coarse cell stored on every train item ('regionCell') for region / bounding box lookups,
+# precision 3 is roughly 156 km x 156 km
+REGION_CELL_PRECISION = int(os.environ.get('REGION_CELL_PRECISION', '3'))
+
+rev_geo_code_api_url = os.environ.get('REV_GEO_CODE_API_URL')
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# DynamoDB BatchGetItem accepts at most 100 keys per call
+BATCH_GET_LIMIT = 100
+
+
+def geohash(lat, lon, precision=GEOCODE_CACHE_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    lat, lon = float(lat), float(lon)
+
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    # (lat, lon) size in degrees of a geohash cell
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def cells_covering(min_lon, min_lat, max_lon, max_lat, precision=REGION_CELL_PRECISION):
+    # All geohash cells of the given precision intersecting the bounding box
+    lat_step, lon_step = cell_size(precision)
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(geohash(lat, lon, precision))
+            if lon >= max_lon:
+                break
+            lon = min(lon + lon_step, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + lat_step, max_lat)
+    return cells
+
+
+class LRUCache:
+    def __init__(self, max_size=GEOCODE_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DynamoDBGeocodeStore:
+    def __init__(self, table_name, ttl_days=GEOCODE_CACHE_TTL_DAYS):
+        import boto3
+
+        self.table_name = table_name
+        self.ttl_days = ttl_days
+        self.dynamodb = boto3.resource('dynamodb')
+        self.table = self.dynamodb.Table(table_name)
+
+    def get_many(self, cells):
+        cells = list(cells)
+        found = {}
+        for start in range(0, len(cells), BATCH_GET_LIMIT):
+            request = {
+                self.table_name: {
+                    'Keys': [{'cell': cell} for cell in cells[start:start + BATCH_GET_LIMIT]],
+                    'ProjectionExpression': 'cell, address'
+                }
+            }
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    found[item['cell']] = item['address']
+                request = response.get('UnprocessedKeys')
+        return found
+
+    def put_many(self, addresses):
+        with self.table.batch_writer(overwrite_by_pkeys=['cell']) as batch:
+            for cell, address in addresses.items():
+                item = {'cell': cell, 'address': address}
+                if self.ttl_days:
+                    item['expiresAt'] = int(time.time()) + self.ttl_days * 86400
+                batch.put_item(Item=item)
+
+
+class LocalGeocodeStore:
+    # Stand-in for the DynamoDB table when running locally or in tests,
+    # optionally persisted to a JSON file
+    def __init__(self, path=None):
+        self.path = path
+        self.items = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.items = json.load(f)
+
+    def get_many(self, cells):
+        return {cell: self.items[cell] for cell in cells if cell in self.items}
+
+    def put_many(self, addresses):
+        self.items.update(addresses)
+        if self.path:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.items, f)
+
+
+class GeocodeCache:
+    def __init__(self, store, precision=GEOCODE_CACHE_PRECISION, max_size=GEOCODE_CACHE_SIZE):
+        self.store = store
+        self.precision = precision
+        self.memory = LRUCache(max_size)
+        self.stats = {'memory_hits': 0, 'store_hits': 0, 'misses': 0, 'errors': 0}
+
+    def lookup(self, lat, lon, fetch):
+        return self.lookup_many([(lat, lon)], fetch)[0]
+
+    def lookup_many(self, points, fetch=None):
+        # points: list of (lat, lon); fetch(lat, lon) -> address or None
+        # Returns the address (or None) for every point, in order.
+        # Without fetch only the cache layers are consulted.
+        cells = [geohash(lat, lon, self.precision) for lat, lon in points]
+        addresses = {}
+
+        missing = []
+        for cell in dict.fromkeys(cells):
+            address = self.memory.get(cell)
+            if address is not None:
+                self.stats['memory_hits'] += 1
+                addresses[cell] = address
+            else:
+                missing.append(cell)
+
+        if missing:
+            try:
+                stored = self.store.get_many(missing)
+            except Exception as e:
+                print('geocode cache: store read failed', e)
+                stored = {}
+            self.stats['store_hits'] += len(stored)
+            for cell, address in stored.items():
+                self.memory.put(cell, address)
+                addresses[cell] = address
+
+        if fetch is None:
+            self.stats['misses'] += sum(1 for cell in dict.fromkeys(cells) if cell not in addresses)
+            return [addresses.get(cell) for cell in cells]
+
+        fetched = {}
+        for (lat, lon), cell in zip(points, cells):
+            if cell in addresses or cell in fetched:
+                continue
+            self.stats['misses'] += 1
+            address = fetch(lat, lon)
+            if address is None:
+                self.stats['errors'] += 1
+                # don't retry the same cell again in this batch
+                fetched[cell] = None
+                continue
+            fetched[cell] = address
+            addresses[cell] = address
+            self.memory.put(cell, address)
+
+        new_addresses = {cell: address for cell, address in fetched.items() if address is not None}
+        if new_addresses:
+            try:
+                self.store.put_many(new_addresses)
+            except Exception as e:
+                print('geocode cache: store write failed', e)
+
+        return [addresses.get(cell) for cell in cells]
+
+    def metrics(self):
+        lookups = self.stats['memory_hits'] + self.stats['store_hits'] + self.stats['misses']
+        hits = self.stats['memory_hits'] + self.stats['store_hits']
+        return {
+            **self.stats,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'memory_entries': len(self.memory)
+        }
+
+
+def fetch_address(lat, lon):
+    fq_url = f'{rev_geo_code_api_url}&lat={lat}&lon={lon}'
+
+    req = urllib.request.Request(fq_url, headers={'Content-Type':'application/json'},method='GET')
+    try:
+        with urllib.request.urlopen(req) as response:
+            result = json.loads(response.read().decode())
+            return result['address']
+    except Exception as e:
+        print('api exception',e)
+        return None
+
+
+def create_cache():
+    if GEOCODE_CACHE_TABLE_NAME:
+        store = DynamoDBGeocodeStore(GEOCODE_CACHE_TABLE_NAME)
+    else:
+        store = LocalGeocodeStore(os.environ.get('GEOCODE_CACHE_FILE'))
+    return GeocodeCache(store)
+
+
+def extract_points(geojson_path):
+    with open(geojson_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    points = []
+    for feature in data.get('features', []):
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') == 'Point':
+            coordinates = [geometry['coordinates']]
+        elif geometry.get('type') == 'LineString':
+            coordinates = geometry['coordinates']
+        elif geometry.get('type') == 'MultiLineString':
+            coordinates = [c for line in geometry['coordinates'] for c in line]
+        else:
+            continue
+        # GeoJSON format is [longitude, latitude]
+        points.extend((lat, lon) for lon, lat, *_ in coordinates)
+    return points
+
+
+def prewarm(cache, geojson_paths, fetch, delay=1.0):
+    # Bulk-geocodes every distinct cell of the given route files into the cache.
+    # delay throttles calls to the geocoding API.
+    pending = {}
+    for path in geojson_paths:
+        for lat, lon in extract_points(path):
+            pending.setdefault(geohash(lat, lon, cache.precision), (lat, lon))
+
+    already_cached = cache.store.get_many(list(pending))
+    todo = [point for cell, point in pending.items() if cell not in already_cached]
+    print(f'prewarm: {len(pending)} cells, {len(already_cached)} already cached, {len(todo)} to fetch')
+
+    for index, (lat, lon) in enumerate(todo, 1):
+        cache.lookup(lat, lon, fetch)
+        if index % 50 == 0:
+            print(f'prewarm: {index}/{len(todo)}', cache.metrics())
+        if delay:
+            time.sleep(delay)
+
+    print('prewarm complete', cache.metrics())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-warm the reverse-geocode cache from route GeoJSON files.')
+    parser.add_argument('files', nargs='+', help='Route GeoJSON files')
+    parser.add_argument('--delay', type=float, default=1.0, help='Seconds to wait between geocoding calls')
+    args = parser.parse_args()
+
+    prewarm(create_cache(), args.files, fetch_address, args.delay)
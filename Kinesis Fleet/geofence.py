@@ -0,0 +1,128 @@
+import json
+import math
+import os
+from geocode_cache import cells_covering, geohash
+
+# Station geofences and arrival / departure detection.
+# Every station Point of the GEOFENCE_FILES (default ROUTE_FILES) becomes a circular fence,
+# GEOFENCE_RADIUS_M or the feature's 'radius' property. Fences are indexed by geohash cell,
+# so a position is only tested against the few fences of its own cell.
+# The fence a train is inside is kept on its item ('stationId'); comparing it with the
+# fence of the new position gives the transitions. A train leaves a fence only once it is
+# GEOFENCE_EXIT_FACTOR x radius away, so GPS jitter at the edge does not flap.
+
+GEOFENCE_FILES = os.environ.get('GEOFENCE_FILES') or os.environ.get('ROUTE_FILES')
+GEOFENCE_RADIUS_M = float(os.environ.get('GEOFENCE_RADIUS_M', '500'))
+GEOFENCE_EXIT_FACTOR = float(os.environ.get('GEOFENCE_EXIT_FACTOR', '1.2'))
+# precision 5 is roughly 4.9 km x 4.9 km
+GEOFENCE_INDEX_PRECISION = 5
+
+EARTH_RADIUS_M = 6371008.8
+
+# item fields written by GeofenceIndex.transition
+GEOFENCE_FIELDS = ['stationId', 'stationName']
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class GeofenceIndex:
+    def __init__(self, precision=GEOFENCE_INDEX_PRECISION, exit_factor=GEOFENCE_EXIT_FACTOR):
+        self.precision = precision
+        self.exit_factor = exit_factor
+        # stationId -> (name, lat, lon, radius_m)
+        self.fences = {}
+        # geohash cell -> [stationId]
+        self.cells = {}
+
+    def add(self, name, lat, lon, radius_m=GEOFENCE_RADIUS_M):
+        # the same station listed by several route files is one fence
+        station_id = geohash(lat, lon, 8)
+        if station_id in self.fences:
+            return station_id
+        self.fences[station_id] = (name, lat, lon, radius_m)
+
+        # index the fence in every cell its exit circle touches
+        reach = radius_m * self.exit_factor
+        dlat = math.degrees(reach / EARTH_RADIUS_M)
+        dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+        for cell in cells_covering(lon - dlon, lat - dlat, lon + dlon, lat + dlat, self.precision):
+            self.cells.setdefault(cell, []).append(station_id)
+        return station_id
+
+    def load(self, geojson_path):
+        with open(geojson_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for feature in data.get('features', []):
+            geometry = feature.get('geometry') or {}
+            properties = feature.get('properties') or {}
+            if geometry.get('type') == 'Point' and properties.get('name'):
+                lon, lat, *_ = geometry['coordinates']
+                self.add(properties['name'], lat, lon, float(properties.get('radius', GEOFENCE_RADIUS_M)))
+
+    def locate(self, lat, lon, current=None):
+        # stationId of the fence containing the position, None outside every fence.
+        # current is the fence the train was in, it is kept until the exit radius is crossed.
+        lat, lon = float(lat), float(lon)
+        if current in self.fences:
+            _, fence_lat, fence_lon, radius = self.fences[current]
+            if haversine_m(lat, lon, fence_lat, fence_lon) <= radius * self.exit_factor:
+                return current
+
+        closest, closest_distance = None, None
+        for station_id in self.cells.get(geohash(lat, lon, self.precision), ()):
+            _, fence_lat, fence_lon, radius = self.fences[station_id]
+            distance = haversine_m(lat, lon, fence_lat, fence_lon)
+            if distance <= radius and (closest is None or distance < closest_distance):
+                closest, closest_distance = station_id, distance
+        return closest
+
+    def transition(self, trainId, previous, ping):
+        # (geofence fields for the item, [events]) for one train.
+        # previous: the train's stored item, ping: decoded Kinesis record
+        payload = ping['payload']
+        current = (previous or {}).get('stationId')
+        station_id = self.locate(payload['latitude'], payload['longitude'], current)
+
+        fields = dict.fromkeys(GEOFENCE_FIELDS)
+        if station_id:
+            fields['stationId'] = station_id
+            fields['stationName'] = self.fences[station_id][0]
+
+        events = []
+        if station_id != current:
+            if current in self.fences:
+                events.append(self._event('departure', trainId, current, ping))
+            if station_id:
+                events.append(self._event('arrival', trainId, station_id, ping))
+        return fields, events
+
+    def _event(self, kind, trainId, station_id, ping):
+        payload = ping['payload']
+        return {
+            # stable across retries of the same record, consumers deduplicate on it
+            'eventId': f'{trainId}#{ping["sequenceNumber"]}#{kind}',
+            'type': kind,
+            'trainId': trainId,
+            'trainName': payload.get('trainName'),
+            'journeyDate': payload.get('journeyDate'),
+            'stationId': station_id,
+            'stationName': self.fences[station_id][0],
+            'latitude': str(payload['latitude']),
+            'longitude': str(payload['longitude']),
+            'timestamp': int(ping['approximateArrivalTimestamp']),
+            'sequenceNumber': str(ping['sequenceNumber']),
+        }
+
+
+def create_index():
+    if not GEOFENCE_FILES:
+        return None
+    index = GeofenceIndex()
+    for path in GEOFENCE_FILES.split(','):
+        if path.strip():
+            index.load(path.strip())
+    return index
@@ -69,6 +69,7 @@ def simulate_train_movement(args):
 
         obj['latitude'] = lat
         obj['longitude'] = lon
+        obj['timestamp'] = int(time.time() * 1000)  # device time in epoch ms
         send_location(obj)
         delay = random.randint(5,7)
         print(f"Waiting {delay} seconds before next location...")
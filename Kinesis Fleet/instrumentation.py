@@ -0,0 +1,123 @@
+import functools
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+
+# Lightweight metrics for the Lambda handlers.
+# Stage timers and counters are collected during an invocation and written as one
+# CloudWatch Embedded Metric Format (EMF) line when it ends; CloudWatch turns the line
+# into metrics, locally it is plain JSON on stdout. Verbose payload logging is sampled.
+#
+#   metrics = Metrics('stream_handler')
+#
+#   @metrics.handler
+#   def lambda_handler(event, context):
+#       with metrics.timer('Decode'):
+#           ...
+#       metrics.count('Duplicates', 3)
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'KinesisFleet')
+# share of invocations whose payloads are logged, 0 disables payload logging
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+METRICS_DISABLED = os.environ.get('METRICS_DISABLED', '').lower() in ('1', 'true', 'yes')
+
+
+class Metrics:
+    def __init__(self, function_name, namespace=METRICS_NAMESPACE, log_sample_rate=LOG_SAMPLE_RATE):
+        self.namespace = namespace
+        self.dimensions = {'Function': function_name}
+        self.log_sample_rate = log_sample_rate
+        self.sampled = False
+        self.reset()
+
+    def reset(self):
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        # one sampling decision per invocation, so a sampled invocation is logged completely
+        self.sampled = random.random() < self.log_sample_rate
+
+    def put(self, name, value, unit='None'):
+        # gauges, the last value wins
+        self.values[name] = value
+        self.units[name] = unit
+
+    def count(self, name, value=1):
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = 'Count'
+
+    @contextmanager
+    def timer(self, stage):
+        # adds the elapsed time to <stage>Ms, a stage may run several times per invocation
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            name = f'{stage}Ms'
+            elapsed = (time.perf_counter() - start) * 1000
+            self.values[name] = round(self.values.get(name, 0) + elapsed, 3)
+            self.units[name] = 'Milliseconds'
+
+    def property(self, key, value):
+        # searchable context on the log line, not a metric
+        self.properties[key] = value
+
+    def log(self, message, payload=None):
+        # verbose logging, only for sampled invocations
+        if not self.sampled:
+            return
+        if payload is None:
+            print(message)
+        else:
+            print(message, json.dumps(payload, default=str))
+
+    def document(self):
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in self.units.items()]
+                }]
+            },
+            **self.dimensions,
+            **self.properties,
+            **self.values
+        }
+
+    def flush(self):
+        # writes the EMF line and starts a new invocation; returns the document
+        document = self.document()
+        if not METRICS_DISABLED and self.values:
+            print(json.dumps(document, default=str))
+        self.reset()
+        return document
+
+    def handler(self, func):
+        # times the whole invocation and flushes the metrics when it returns or raises
+        @functools.wraps(func)
+        def wrapper(event, context):
+            start = time.perf_counter()
+            try:
+                return func(event, context)
+            except Exception:
+                self.count('Errors')
+                raise
+            finally:
+                self.put('HandlerLatencyMs', round((time.perf_counter() - start) * 1000, 3), 'Milliseconds')
+                if context is not None and hasattr(context, 'aws_request_id'):
+                    self.property('requestId', context.aws_request_id)
+                self.flush()
+        return wrapper
+
+
+def iterator_age_ms(records, now=None):
+    # age of the oldest Kinesis record of the batch, what IteratorAge reports for the shard
+    now = time.time() if now is None else now
+    arrivals = [float(record['kinesis']['approximateArrivalTimestamp']) for record in records if 'kinesis' in record]
+    if not arrivals:
+        return 0
+    return max(0, int((now - min(arrivals)) * 1000))
@@ -1,45 +1,146 @@
+import argparse
 import json
+import math
 from xml.etree import ElementTree as ET
 
-# Read your KML file
-filename = "input.kml" # ===> Update this
-with open(filename, "r", encoding="utf-8") as f:
-    kml_data = f.read()
-
-# Parse the XML
-ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-root = ET.fromstring(kml_data)
-placemarks = root.findall(".//kml:Placemark", ns)
-
-# Construct GeoJSON
-geojson = {
-    "type": "FeatureCollection",
-    "features": []
-}
-
-for placemark in placemarks:
-    name_elem = placemark.find("kml:name", ns)
-    coord_elem = placemark.find(".//kml:coordinates", ns)
-
-    if name_elem is not None and coord_elem is not None:
-        name = name_elem.text
-        coords_text = coord_elem.text.strip()
-        lon, lat, *_ = map(float, coords_text.split(","))
-
-        feature = {
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": [lon, lat]
-            },
-            "properties": {
-                "name": name
-            }
-        }
-        geojson["features"].append(feature)
-
-# Write GeoJSON to file
-with open("newdelhi-mumbai-rajdhani.geojson", "w", encoding="utf-8") as f:
-    json.dump(geojson, f, indent=2)
-
-print("Converted and saved as output.geojson")
+# Streaming KML -> GeoJSON route converter.
+# Placemarks are parsed with iterparse and cleared as soon as they are converted and
+# written out, so memory stays bounded by the largest single placemark.
+# Supports Point, LineString and MultiGeometry; LineStrings can be simplified with
+# Douglas-Peucker.
+#
+#   python kml_parser.py input.kml newdelhi-mumbai-rajdhani.geojson --tolerance 25
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def _local(tag):
+    # tag without the '{namespace}' prefix
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_coordinates(text, precision=7):
+    coords = []
+    for token in (text or '').split():
+        lon, lat, *_ = token.split(',')
+        coords.append([round(float(lon), precision), round(float(lat), precision)])
+    return coords
+
+
+def _perpendicular_distance_m(point, start, end, lat_scale):
+    # distance (metres) from point to the segment start-end, on a local equirectangular projection
+    px, py = point[0] * lat_scale, point[1]
+    sx, sy = start[0] * lat_scale, start[1]
+    ex, ey = end[0] * lat_scale, end[1]
+    dx, dy = ex - sx, ey - sy
+    if dx == 0 and dy == 0:
+        return math.radians(math.hypot(px - sx, py - sy)) * EARTH_RADIUS_M
+    t = max(0.0, min(1.0, ((px - sx) * dx + (py - sy) * dy) / (dx * dx + dy * dy)))
+    return math.radians(math.hypot(px - (sx + t * dx), py - (sy + t * dy))) * EARTH_RADIUS_M
+
+
+def simplify(coords, tolerance_m):
+    # Douglas-Peucker on [lon, lat] coordinates, iterative so long lines don't hit the recursion limit
+    if tolerance_m <= 0 or len(coords) < 3:
+        return coords
+
+    lat_scale = math.cos(math.radians(sum(c[1] for c in coords) / len(coords)))
+    keep = [False] * len(coords)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance = 0.0
+        index = first
+        for i in range(first + 1, last):
+            distance = _perpendicular_distance_m(coords[i], coords[first], coords[last], lat_scale)
+            if distance > max_distance:
+                max_distance = distance
+                index = i
+        if max_distance > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [c for c, kept in zip(coords, keep) if kept]
+
+
+def convert_geometry(element, tolerance_m=0.0, precision=7):
+    kind = _local(element.tag)
+    if kind in ('Point', 'LineString'):
+        coords_elem = next((e for e in element if _local(e.tag) == 'coordinates'), None)
+        coords = parse_coordinates(coords_elem.text if coords_elem is not None else '', precision)
+        if not coords:
+            return None
+        if kind == 'Point':
+            return {'type': 'Point', 'coordinates': coords[0]}
+        return {'type': 'LineString', 'coordinates': simplify(coords, tolerance_m)}
+
+    if kind == 'MultiGeometry':
+        parts = [convert_geometry(child, tolerance_m, precision) for child in element]
+        parts = [part for part in parts if part]
+        kinds = {part['type'] for part in parts}
+        if not parts:
+            return None
+        if kinds == {'Point'}:
+            return {'type': 'MultiPoint', 'coordinates': [p['coordinates'] for p in parts]}
+        if kinds == {'LineString'}:
+            return {'type': 'MultiLineString', 'coordinates': [p['coordinates'] for p in parts]}
+        return {'type': 'GeometryCollection', 'geometries': parts}
+
+    return None
+
+
+def iter_features(kml_path, tolerance_m=0.0, precision=7):
+    # Yields GeoJSON features one Placemark at a time
+    parents = []
+    for event, element in ET.iterparse(kml_path, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if _local(element.tag) != 'Placemark':
+            continue
+
+        name = None
+        geometry = None
+        for child in element:
+            kind = _local(child.tag)
+            if kind == 'name':
+                name = child.text
+            elif geometry is None:
+                geometry = convert_geometry(child, tolerance_m, precision)
+
+        if geometry is not None:
+            yield {'type': 'Feature', 'geometry': geometry, 'properties': {'name': name}}
+
+        # detach the converted placemark so the tree never holds more than one
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+
+
+def convert(kml_path, geojson_path, tolerance_m=0.0, precision=7):
+    # Writes features as they are parsed; returns the number of features written
+    count = 0
+    with open(geojson_path, 'w', encoding='utf-8') as f:
+        f.write('{"type":"FeatureCollection","features":[')
+        for feature in iter_features(kml_path, tolerance_m, precision):
+            if count:
+                f.write(',')
+            f.write(json.dumps(feature, separators=(',', ':'), ensure_ascii=False))
+            count += 1
+        f.write(']}\n')
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert KML routes and stations to GeoJSON.')
+    parser.add_argument('input', help='Input KML file')
+    parser.add_argument('output', help='Output GeoJSON file')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.0, help='Douglas-Peucker tolerance in metres, 0 keeps every point')
+    parser.add_argument('-p', '--precision', type=int, default=7, help='Decimal places kept for coordinates')
+    args = parser.parse_args()
+
+    count = convert(args.input, args.output, args.tolerance, args.precision)
+    print(f'Converted {count} features and saved as {args.output}')
@@ -0,0 +1,263 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from geocode_cache import REGION_CELL_PRECISION, geohash
+
+# Push channel for position changes.
+# Clients subscribe over the API Gateway WebSocket API (websocket_handler.py) to
+#   train#<trainId>     updates of one train
+#   region#<regionCell> updates of every train inside a region cell
+# stream_handler publishes the trains it wrote; each connection receives at most one
+# message per batch and a train is pushed at most once every LIVE_UPDATE_MIN_INTERVAL seconds.
+# An update held back by that limit goes out with a later batch of the container; the
+# publisher never waits for it, so the stream is not held up. Subscribers of a topic are read
+# from the connections table at most once every SUBSCRIPTION_CACHE_SECONDS per container,
+# so a new subscription may wait that long for its first update.
+
+CONNECTIONS_TABLE_NAME = os.environ.get('CONNECTIONS_TABLE_NAME')
+WEBSOCKET_ENDPOINT = os.environ.get('WEBSOCKET_ENDPOINT')
+LIVE_UPDATE_MIN_INTERVAL = float(os.environ.get('LIVE_UPDATE_MIN_INTERVAL', '2'))
+PUSH_CONCURRENCY = int(os.environ.get('PUSH_CONCURRENCY', '16'))
+SUBSCRIPTION_CACHE_SECONDS = float(os.environ.get('SUBSCRIPTION_CACHE_SECONDS', '10'))
+# expired entries are dropped once the cache holds this many topics
+SUBSCRIPTION_CACHE_SIZE = 10000
+# topics one connection may subscribe to in total
+MAX_TOPICS_PER_CONNECTION = int(os.environ.get('MAX_TOPICS_PER_CONNECTION', '500'))
+
+# fields sent to subscribers
+PUSH_FIELDS = [
+    'trainId', 'trainName', 'latitude', 'longitude', 'address', 'lastUpdatedTime', 'lastSequenceNumber',
+    'distanceAlongRoute', 'nextStation', 'nextStationEta', 'stationName'
+]
+
+
+class TooManyTopics(ValueError):
+    def __init__(self, limit):
+        super().__init__(f'At most {limit} subscriptions per connection')
+
+
+def train_topic(trainId):
+    return f'train#{trainId}'
+
+
+def region_topic(cell):
+    return f'region#{cell}'
+
+
+class LocalBroker:
+    # In-memory stand-in for the WebSocket API and the connections table
+    def __init__(self):
+        self.subscriptions = {}
+        self.messages = {}
+        self.gone = set()
+
+    def subscribe(self, connection_id, topics):
+        for topic in topics:
+            self.subscriptions.setdefault(topic, set()).add(connection_id)
+
+    def unsubscribe(self, connection_id, topics=None):
+        for topic, connections in self.subscriptions.items():
+            if topics is None or topic in topics:
+                connections.discard(connection_id)
+
+    def subscribers(self, topics):
+        return {topic: set(self.subscriptions.get(topic, ())) for topic in topics}
+
+    def send(self, connection_id, data):
+        if connection_id in self.gone:
+            return False
+        self.messages.setdefault(connection_id, []).append(json.loads(data))
+        return True
+
+
+class WebSocketBroker:
+    # Subscriptions live in a DynamoDB table:
+    #   PK topic,            SK connectionId   one item per subscription
+    #   PK conn#<id>,        SK 'topics'       topics of a connection, used on disconnect
+    def __init__(self, table_name=CONNECTIONS_TABLE_NAME, endpoint=WEBSOCKET_ENDPOINT,
+                 cache_seconds=SUBSCRIPTION_CACHE_SECONDS, max_topics=MAX_TOPICS_PER_CONNECTION):
+        import boto3
+
+        self.table_name = table_name
+        self.max_topics = max_topics
+        self.dynamodb = boto3.client('dynamodb')
+        self.api = boto3.client('apigatewaymanagementapi', endpoint_url=endpoint) if endpoint else None
+        self.executor = ThreadPoolExecutor(max_workers=PUSH_CONCURRENCY)
+        # topic -> (expiry, connectionIds), topics without subscribers included
+        self.cache_seconds = cache_seconds
+        self.cache = {}
+
+    def subscribe(self, connection_id, topics):
+        # Raises TooManyTopics when the connection would hold more than max_topics topics
+        key = {'PK': {'S': f'conn#{connection_id}'}, 'SK': {'S': 'topics'}}
+        item = self.dynamodb.get_item(TableName=self.table_name, Key=key, ConsistentRead=True).get('Item', {})
+        topics = sorted(set(topics) - set(item.get('topics', {}).get('SS', [])))
+        if not topics:
+            return
+        room = self.max_topics - len(topics)
+        if room < 0:
+            raise TooManyTopics(self.max_topics)
+        # the stored set is counted in the condition, concurrent subscribes of the
+        # connection can't add up past the limit either
+        try:
+            self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key=key,
+                UpdateExpression='ADD topics :topics',
+                ConditionExpression='attribute_not_exists(topics) OR size(topics) <= :room',
+                ExpressionAttributeValues={':topics': {'SS': topics}, ':room': {'N': str(room)}}
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            raise TooManyTopics(self.max_topics)
+        requests = [
+            {'PutRequest': {'Item': {'PK': {'S': topic}, 'SK': {'S': connection_id}}}} for topic in topics
+        ]
+        for start in range(0, len(requests), 25):
+            self.dynamodb.batch_write_item(RequestItems={self.table_name: requests[start:start + 25]})
+
+    def unsubscribe(self, connection_id, topics=None):
+        # cached subscriber sets of this container
+        for topic, (_, connections) in self.cache.items():
+            if topics is None or topic in topics:
+                connections.discard(connection_id)
+        key = {'PK': {'S': f'conn#{connection_id}'}, 'SK': {'S': 'topics'}}
+        if topics is None:
+            item = self.dynamodb.get_item(TableName=self.table_name, Key=key).get('Item', {})
+            topics = item.get('topics', {}).get('SS', [])
+            self.dynamodb.delete_item(TableName=self.table_name, Key=key)
+        else:
+            topics = list(topics)
+            if topics:
+                self.dynamodb.update_item(
+                    TableName=self.table_name,
+                    Key=key,
+                    UpdateExpression='DELETE topics :topics',
+                    ExpressionAttributeValues={':topics': {'SS': topics}}
+                )
+
+        requests = [
+            {'DeleteRequest': {'Key': {'PK': {'S': topic}, 'SK': {'S': connection_id}}}} for topic in topics
+        ]
+        for start in range(0, len(requests), 25):
+            self.dynamodb.batch_write_item(RequestItems={self.table_name: requests[start:start + 25]})
+
+    def subscribers(self, topics):
+        now = time.monotonic()
+        result = {}
+        missing = []
+        for topic in topics:
+            cached = self.cache.get(topic)
+            if cached and cached[0] > now:
+                result[topic] = cached[1]
+            else:
+                missing.append(topic)
+
+        if len(self.cache) + len(missing) > SUBSCRIPTION_CACHE_SIZE:
+            self.cache = {topic: cached for topic, cached in self.cache.items() if cached[0] > now}
+        for topic, connections in zip(missing, self.executor.map(self._query_topic, missing)):
+            self.cache[topic] = (now + self.cache_seconds, connections)
+            result[topic] = connections
+        return result
+
+    def _query_topic(self, topic):
+        connections = set()
+        kwargs = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': 'PK = :topic',
+            'ExpressionAttributeValues': {':topic': {'S': topic}},
+            'ProjectionExpression': 'SK'
+        }
+        while True:
+            response = self.dynamodb.query(**kwargs)
+            connections.update(item['SK']['S'] for item in response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return connections
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def send(self, connection_id, data):
+        try:
+            self.api.post_to_connection(ConnectionId=connection_id, Data=data.encode('utf-8'))
+            return True
+        except self.api.exceptions.GoneException:
+            return False
+
+
+class LivePublisher:
+    def __init__(self, broker, min_interval=LIVE_UPDATE_MIN_INTERVAL):
+        self.broker = broker
+        self.min_interval = min_interval
+        # trainId -> time of the last push / newest update held back by the rate limit,
+        # kept while the container is warm
+        self.last_pushed = {}
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=PUSH_CONCURRENCY)
+
+    def publish(self, items, now=None):
+        # items: train items as written by stream_handler. Returns the number of messages sent.
+        now = time.monotonic() if now is None else now
+        updates = dict(self.pending)
+        updates.update((str(item['PK']), item) for item in items)
+        return self._push(updates, now)
+
+    def _push(self, updates, now):
+        due = {}
+        self.pending = {}
+        for trainId, item in updates.items():
+            if now - self.last_pushed.get(trainId, float('-inf')) < self.min_interval:
+                # coalesced, only the newest held back update is pushed later
+                self.pending[trainId] = item
+                continue
+            due[trainId] = item
+        if not due:
+            return 0
+
+        topics_by_train = {}
+        for trainId, item in due.items():
+            topics = [train_topic(trainId)]
+            cell = item.get('regionCell') or geohash(item['latitude'], item['longitude'], REGION_CELL_PRECISION)
+            topics.append(region_topic(cell))
+            topics_by_train[trainId] = topics
+
+        all_topics = {topic for topics in topics_by_train.values() for topic in topics}
+        subscribers = self.broker.subscribers(all_topics)
+
+        # one message per connection, carrying every train it subscribed to
+        outbox = {}
+        for trainId, topics in topics_by_train.items():
+            for topic in topics:
+                for connection_id in subscribers.get(topic, ()):
+                    outbox.setdefault(connection_id, {})[trainId] = due[trainId]
+            self.last_pushed[trainId] = now
+
+        messages = [
+            (connection_id, json.dumps({
+                'type': 'positions',
+                'trains': [{field: item.get(field) for field in PUSH_FIELDS} for item in trains.values()]
+            }))
+            for connection_id, trains in outbox.items()
+        ]
+        results = list(self.executor.map(lambda message: self._send(*message), messages))
+
+        gone = [connection_id for (connection_id, _), delivered in zip(messages, results) if not delivered]
+        for connection_id in gone:
+            try:
+                self.broker.unsubscribe(connection_id)
+            except Exception as e:
+                print('Error removing stale connection', connection_id, e)
+        return len(messages) - len(gone)
+
+    def _send(self, connection_id, data):
+        try:
+            return self.broker.send(connection_id, data)
+        except Exception as e:
+            # a failed push is not retried, the next position update supersedes it
+            print('Error pushing to connection', connection_id, e)
+            return True
+
+
+def create_publisher():
+    if not CONNECTIONS_TABLE_NAME or not WEBSOCKET_ENDPOINT:
+        return None
+    return LivePublisher(WebSocketBroker())
+
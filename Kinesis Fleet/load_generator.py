@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import bisect
+import json
+import math
+import os
+import random
+import time
+
+import aiohttp
+
+# Load generator for the ingest API (stream_ingest).
+# Simulates many trains at once moving along the route GeoJSON files, each train
+# pinging at a configurable rate, over keep-alive connections. With --batch-size the
+# trains are grouped behind "gateways" that post arrays of pings (batch ingest mode).
+# Reports ingest throughput, error rates and latency percentiles.
+# Requests are sent on a fixed schedule whatever the response times (open loop), and
+# latency is measured from the scheduled send time, so a saturated API shows up as
+# growing latency instead of a quietly lower request rate.
+#
+#   python load_generator.py -f newdelhi-mumbai-rajdhani.geojson kch-tpt-venkatadri.geojson \
+#       --endpoint https://.../test/location --trains 2000 --interval 5 --duration 120
+
+API_ENDPOINT = 'https://hm4p97it6a.execute-api.ap-south-1.amazonaws.com/test/location'
+EARTH_RADIUS_KM = 6371.0088
+# largest --jitter as a fraction of --interval, so every gap stays positive and the
+# pings of a train don't bunch up
+MAX_JITTER_FRACTION = 0.5
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class Route:
+    def __init__(self, name, coords):
+        # coords: [(lat, lon)] in travel order
+        self.name = name
+        self.coords = coords
+        self.cumulative = [0.0]
+        for (lat1, lon1), (lat2, lon2) in zip(coords, coords[1:]):
+            self.cumulative.append(self.cumulative[-1] + haversine_km(lat1, lon1, lat2, lon2))
+        self.length = self.cumulative[-1]
+
+    def position_at(self, distance):
+        # Interpolated (lat, lon) at a distance (km) along the route; trains turn
+        # around at the terminus so the simulation can run for any duration
+        if self.length == 0:
+            return self.coords[0]
+        distance %= 2 * self.length
+        if distance > self.length:
+            distance = 2 * self.length - distance
+
+        index = max(1, bisect.bisect_left(self.cumulative, distance))
+        index = min(index, len(self.coords) - 1)
+        start, end = self.cumulative[index - 1], self.cumulative[index]
+        fraction = (distance - start) / (end - start) if end > start else 0.0
+        (lat1, lon1), (lat2, lon2) = self.coords[index - 1], self.coords[index]
+        return lat1 + (lat2 - lat1) * fraction, lon1 + (lon2 - lon1) * fraction
+
+
+def load_route(geojson_path):
+    with open(geojson_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    coords = []
+    for feature in data.get('features', []):
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') == 'LineString':
+            coords.extend((lat, lon) for lon, lat, *_ in geometry['coordinates'])
+        elif geometry.get('type') == 'Point':
+            lon, lat, *_ = geometry['coordinates']
+            coords.append((lat, lon))
+    if not coords:
+        raise ValueError(f'No coordinates found in {geojson_path}')
+    return Route(os.path.splitext(os.path.basename(geojson_path))[0], coords)
+
+
+class Train:
+    def __init__(self, index, route, rng):
+        self.trainId = str(100000 + index)
+        self.route = route
+        self.offset = rng.uniform(0, route.length)
+        self.speed_kmh = rng.uniform(60, 130)
+        self.info = {
+            'trainId': self.trainId,
+            'trainName': f'Load Test {self.trainId}',
+            'trainSource': route.name,
+            'trainDestination': route.name,
+            'journeyDate': time.strftime('%Y-%m-%d'),
+            'departureTime': '00:00',
+            'arrivalTime': '23:59',
+        }
+
+    def ping(self, elapsed):
+        lat, lon = self.route.position_at(self.offset + self.speed_kmh * elapsed / 3600)
+        # device time of the ping, stream_handler orders a train's pings on it
+        return {**self.info, 'latitude': round(lat, 7), 'longitude': round(lon, 7), 'timestamp': int(time.time() * 1000)}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.requests = 0
+        self.pings = 0
+        self.ok_pings = 0
+        self.errors = {}
+
+    def record(self, latency, pings, status, failed_pings=0):
+        self.requests += 1
+        self.pings += pings
+        self.latencies.append(latency)
+        if status in (200, 207):
+            self.ok_pings += pings - failed_pings
+            if failed_pings:
+                self.errors['partial'] = self.errors.get('partial', 0) + failed_pings
+        else:
+            self.errors[str(status)] = self.errors.get(str(status), 0) + pings
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def summary(self, elapsed):
+        failed = self.pings - self.ok_pings
+        return (
+            f'{elapsed:7.1f}s  requests {self.requests:8d}  pings {self.pings:9d}  '
+            f'{self.pings / elapsed if elapsed else 0:8.1f} pings/s  '
+            f'errors {failed / self.pings * 100 if self.pings else 0:5.2f}% {self.errors}  '
+            f'latency ms p50 {self.percentile(50) * 1000:7.1f} p90 {self.percentile(90) * 1000:7.1f} '
+            f'p99 {self.percentile(99) * 1000:7.1f} max {max(self.latencies, default=0) * 1000:7.1f}'
+        )
+
+
+async def post(session, endpoint, body, pings, stats, scheduled):
+    # scheduled: time.monotonic() the request was due, latency is counted from there
+    try:
+        async with session.post(endpoint, json=body) as response:
+            text = await response.text()
+            status = response.status
+            failed = 0
+            if status == 207:
+                try:
+                    failed = int(json.loads(text).get('failed', 0))
+                except (ValueError, TypeError, AttributeError):
+                    status = 'invalid 207'
+            stats.record(time.monotonic() - scheduled, pings, status, failed)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        stats.record(time.monotonic() - scheduled, pings, type(e).__name__)
+
+
+async def run_sender(trains, session, args, stats, started, deadline, rng):
+    # One sender per train, or per gateway of trains in batch mode. Requests go out at
+    # fixed times without waiting for the previous response
+    requests = set()
+    next_send = started + rng.uniform(0, args.ramp_up or args.interval)
+    while next_send < deadline:
+        await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+        pings = [train.ping(next_send - started) for train in trains]
+        body = pings if args.batch_size else pings[0]
+        request = asyncio.create_task(post(session, args.endpoint, body, len(pings), stats, next_send))
+        requests.add(request)
+        request.add_done_callback(requests.discard)
+        next_send += args.interval + rng.uniform(-args.jitter, args.jitter)
+    if requests:
+        await asyncio.gather(*requests)
+
+
+async def report(stats, started, deadline, every):
+    while time.monotonic() < deadline:
+        await asyncio.sleep(every)
+        print(stats.summary(time.monotonic() - started))
+
+
+async def main(args):
+    routes = [load_route(path) for path in args.file]
+    rng = random.Random(args.seed)
+    trains = [Train(i, routes[i % len(routes)], rng) for i in range(args.trains)]
+
+    group = args.batch_size or 1
+    senders = [trains[i:i + group] for i in range(0, len(trains), group)]
+    print(f'{len(trains)} trains on {len(routes)} routes, {len(senders)} senders, '
+          f'{len(trains) / args.interval:.0f} pings/s target')
+
+    stats = Stats()
+    connector = aiohttp.TCPConnector(limit=args.concurrency, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        started = time.monotonic()
+        deadline = started + args.duration
+        reporter = asyncio.create_task(report(stats, started, deadline, args.report_every))
+        await asyncio.gather(*(
+            run_sender(group_trains, session, args, stats, started, deadline, random.Random(rng.random()))
+            for group_trains in senders
+        ))
+        reporter.cancel()
+
+    print('final', stats.summary(time.monotonic() - started))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multi-train load generator for the ingest API.')
+    parser.add_argument('-f', '--file', nargs='+', required=True, help='Route GeoJSON files')
+    parser.add_argument('--endpoint', default=API_ENDPOINT, help='Ingest API endpoint')
+    parser.add_argument('--trains', type=int, default=100, help='Number of simulated trains')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between pings of a train')
+    parser.add_argument('--jitter', type=float, default=1.0,
+                        help=f'Random +/- seconds added to the interval, at most {MAX_JITTER_FRACTION:g} of it')
+    parser.add_argument('--duration', type=float, default=60.0, help='Test duration in seconds')
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='Spread sender start over this many seconds (default: one interval)')
+    parser.add_argument('--batch-size', type=int, default=0, help='Trains per batched request, 0 sends one ping per request')
+    parser.add_argument('--concurrency', type=int, default=200, help='Maximum open connections')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Request timeout in seconds')
+    parser.add_argument('--report-every', type=float, default=10.0, help='Seconds between progress reports')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+
+    args = parser.parse_args()
+    if args.interval <= 0:
+        parser.error('--interval must be greater than 0')
+    if not 0 <= args.jitter <= args.interval * MAX_JITTER_FRACTION:
+        parser.error(f'--jitter must be between 0 and {MAX_JITTER_FRACTION:g} x --interval ({args.interval * MAX_JITTER_FRACTION:g}s)')
+
+    asyncio.run(main(args))
@@ -0,0 +1,134 @@
+# Typed codec for train position items.
+# Field types are declared up front so items are converted straight to and from
+# DynamoDB attribute values for the low-level client, without walking the payload
+# looking for floats or going through Decimal.
+
+# DynamoDB type of every known field of a train position item
+POSITION_FIELDS = {
+    'PK': 'S',
+    'trainId': 'S',
+    'trainName': 'S',
+    'trainSource': 'S',
+    'trainDestination': 'S',
+    'journeyDate': 'S',
+    'departureTime': 'S',
+    'arrivalTime': 'S',
+    # lat/lon are stored as strings so no precision is lost on the way
+    'latitude': 'S',
+    'longitude': 'S',
+    # reverse-geocoder address object (railway, county, state, ...)
+    'address': 'M',
+    'regionCell': 'S',
+    'lastSequenceNumber': 'S',
+    'addressSequenceNumber': 'S',
+    # device time of the ping in epoch ms (stream_ingest fills in the receive time)
+    'timestamp': 'N',
+    # ping_key of the stored ping, compared by the conditional write in stream_handler
+    'sequenceKey': 'S',
+    # ping_key of the ping the address was looked up for, compared by enrichment_handler
+    'addressSequenceKey': 'S',
+    'lastUpdatedTime': 'N',
+    'approximateArrivalTimestamp': 'N',
+    # route progress from route_engine, distances in km, ETAs in epoch seconds
+    'routeId': 'S',
+    'nextStation': 'S',
+    'distanceAlongRoute': 'N',
+    'distanceToNextStation': 'N',
+    'routeDirection': 'N',
+    'speedKmh': 'N',
+    'nextStationEta': 'N',
+    'terminusEta': 'N',
+    # station geofence the train is in, from geofence
+    'stationId': 'S',
+    'stationName': 'S',
+}
+
+
+def sequence_key(sequence_number):
+    # Kinesis sequence numbers differ in length, so their strings do not sort like the
+    # numbers. '056' + digits for a 56 digit number orders like the number for any length
+    digits = str(sequence_number)
+    return f'{len(digits):03d}{digits}'
+
+
+def ping_key(payload, sequence_number):
+    # Order of the pings of a train: the timestamp stream_ingest makes sure every ping has,
+    # then the ping's index in its request. Kinesis sequence numbers don't give that order:
+    # entries PutRecords retries, and concurrent requests, land after newer pings.
+    # Pings without a timestamp fall back to sequence_key; its leading digit sorts below
+    # the 't' of every ping key
+    timestamp = payload.get('timestamp')
+    if timestamp is None:
+        return sequence_key(sequence_number)
+    return f"t{int(timestamp):015d}{int(payload.get('ingestIndex', 0)):06d}"
+
+
+def encode_item(item):
+    encoded = {}
+    for name, value in item.items():
+        if value is None:
+            continue
+        kind = POSITION_FIELDS.get(name)
+        if kind == 'S':
+            encoded[name] = {'S': value if type(value) is str else str(value)}
+        elif kind == 'N':
+            encoded[name] = {'N': str(value)}
+        elif kind == 'M' and isinstance(value, dict):
+            encoded[name] = {'M': {k: encode_value(v) for k, v in value.items()}}
+        else:
+            encoded[name] = encode_value(value)
+    return encoded
+
+
+def decode_item(attributes):
+    item = {}
+    for name, value in attributes.items():
+        kind = POSITION_FIELDS.get(name)
+        if kind == 'S' and 'S' in value:
+            item[name] = value['S']
+        elif kind == 'N' and 'N' in value:
+            item[name] = _to_number(value['N'])
+        else:
+            item[name] = decode_value(value)
+    return item
+
+
+def encode_value(value):
+    # fallback for attributes outside POSITION_FIELDS
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, (int, float)):
+        return {'N': str(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, dict):
+        return {'M': {k: encode_value(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [encode_value(v) for v in value]}
+    return {'S': str(value)}
+
+
+def decode_value(value):
+    kind, data = next(iter(value.items()))
+    if kind == 'S':
+        return data
+    if kind == 'N':
+        return _to_number(data)
+    if kind == 'BOOL':
+        return data
+    if kind == 'NULL':
+        return None
+    if kind == 'M':
+        return {k: decode_value(v) for k, v in data.items()}
+    if kind == 'L':
+        return [decode_value(v) for v in data]
+    return data
+
+
+def _to_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
@@ -0,0 +1,264 @@
+import bisect
+import json
+import math
+import os
+
+import numpy as np
+
+# Route snapping and ETA.
+# Route GeoJSON files (stations as Points in travel order, optionally the track as
+# LineStrings) are loaded once per container into flat segment arrays with the cumulative
+# distance at the start of every segment, plus a grid index from cell to segment ids.
+# A batch of pings is snapped in one go: candidate segments come from the grid, the
+# projection and haversine distances are computed with numpy over all (ping, segment) pairs,
+# and the next station is found by bisecting the station distances of the route.
+#
+#   ROUTE_FILES=newdelhi-mumbai-rajdhani.geojson,kch-tpt-venkatadri.geojson
+
+ROUTE_FILES = os.environ.get('ROUTE_FILES')
+# grid cell size in degrees (~5.5 km of latitude)
+ROUTE_GRID_DEGREES = float(os.environ.get('ROUTE_GRID_DEGREES', '0.05'))
+# pings further than this from every loaded route are not snapped
+MAX_SNAP_DISTANCE_M = float(os.environ.get('MAX_SNAP_DISTANCE_M', '2000'))
+# below this speed the train is considered stopped and no ETA is given
+MIN_ETA_SPEED_KMH = float(os.environ.get('MIN_ETA_SPEED_KMH', '5'))
+# weight of the newest speed sample in the smoothed speed
+SPEED_SMOOTHING = 0.5
+
+EARTH_RADIUS_KM = 6371.0088
+
+# item fields written by RouteEngine.progress
+ROUTE_FIELDS = [
+    'routeId', 'distanceAlongRoute', 'routeDirection', 'speedKmh',
+    'nextStation', 'distanceToNextStation', 'nextStationEta', 'terminusEta'
+]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    # works on floats and on numpy arrays
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class Route:
+    def __init__(self, route_id, coords, stations):
+        # coords: [(lat, lon)] of the track in travel order
+        # stations: [(name, lat, lon)] in travel order
+        self.route_id = route_id
+        self.coords = np.asarray(coords, dtype=float)
+        steps = haversine_km(self.coords[:-1, 0], self.coords[:-1, 1], self.coords[1:, 0], self.coords[1:, 1])
+        self.cumulative = np.concatenate(([0.0], np.cumsum(steps)))
+        self.length = float(self.cumulative[-1])
+
+        # stations are placed on the track where they snap, kept sorted by distance
+        placed = []
+        for name, lat, lon in stations:
+            placed.append((self._locate(lat, lon), name))
+        placed.sort()
+        self.station_distances = [distance for distance, _ in placed]
+        self.station_names = [name for _, name in placed]
+
+    def _locate(self, lat, lon):
+        # distance along the route of the closest track point, used for stations only
+        distances = haversine_km(lat, lon, self.coords[:, 0], self.coords[:, 1])
+        return float(self.cumulative[int(np.argmin(distances))])
+
+    def next_station(self, distance, direction):
+        # (name, distance along route) of the next station ahead, None past the terminus
+        if direction >= 0:
+            index = bisect.bisect_right(self.station_distances, distance + 1e-6)
+            if index == len(self.station_distances):
+                return None
+        else:
+            index = bisect.bisect_left(self.station_distances, distance - 1e-6) - 1
+            if index < 0:
+                return None
+        return self.station_names[index], self.station_distances[index]
+
+    def terminus(self, direction):
+        if direction >= 0:
+            return self.station_names[-1], self.station_distances[-1]
+        return self.station_names[0], self.station_distances[0]
+
+
+def load_route(geojson_path):
+    with open(geojson_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    track = []
+    stations = []
+    for feature in data.get('features', []):
+        geometry = feature.get('geometry') or {}
+        name = (feature.get('properties') or {}).get('name')
+        if geometry.get('type') == 'LineString':
+            track.extend((lat, lon) for lon, lat, *_ in geometry['coordinates'])
+        elif geometry.get('type') == 'MultiLineString':
+            for line in geometry['coordinates']:
+                track.extend((lat, lon) for lon, lat, *_ in line)
+        elif geometry.get('type') == 'Point':
+            lon, lat, *_ = geometry['coordinates']
+            stations.append((name, lat, lon))
+
+    # files with stations only: the track runs station to station
+    if not track:
+        track = [(lat, lon) for _, lat, lon in stations]
+    if len(track) < 2:
+        raise ValueError(f'Route {geojson_path} needs at least two points')
+    route_id = os.path.splitext(os.path.basename(geojson_path))[0]
+    return Route(route_id, track, [s for s in stations if s[0]])
+
+
+class RouteEngine:
+    def __init__(self, routes, grid_degrees=ROUTE_GRID_DEGREES, max_snap_m=MAX_SNAP_DISTANCE_M):
+        self.routes = list(routes)
+        self.routes_by_id = {route.route_id: index for index, route in enumerate(self.routes)}
+        self.grid_degrees = grid_degrees
+        self.max_snap_km = max_snap_m / 1000
+
+        # every segment of every route in flat arrays
+        starts, ends, route_ids, offsets, lengths = [], [], [], [], []
+        for index, route in enumerate(self.routes):
+            starts.append(route.coords[:-1])
+            ends.append(route.coords[1:])
+            route_ids.append(np.full(len(route.coords) - 1, index))
+            offsets.append(route.cumulative[:-1])
+            lengths.append(np.diff(route.cumulative))
+        self.seg_start = np.concatenate(starts)
+        self.seg_end = np.concatenate(ends)
+        self.seg_route = np.concatenate(route_ids)
+        self.seg_offset = np.concatenate(offsets)
+        self.seg_length = np.concatenate(lengths)
+
+        # a segment is listed in every cell its bounding box (plus the snap distance) touches
+        margin = self.max_snap_km / 111.0
+        self.grid = {}
+        for seg in range(len(self.seg_route)):
+            (lat1, lon1), (lat2, lon2) = self.seg_start[seg], self.seg_end[seg]
+            lat_margin = margin
+            lon_margin = margin / max(math.cos(math.radians(max(abs(lat1), abs(lat2)))), 0.01)
+            for row in range(self._cell(min(lat1, lat2) - lat_margin), self._cell(max(lat1, lat2) + lat_margin) + 1):
+                for col in range(self._cell(min(lon1, lon2) - lon_margin), self._cell(max(lon1, lon2) + lon_margin) + 1):
+                    self.grid.setdefault((row, col), []).append(seg)
+
+        # "source|destination" -> route index, filled lazily
+        self._route_hints = {}
+        self._station_routes = {}
+        for index, route in enumerate(self.routes):
+            for name in route.station_names:
+                self._station_routes.setdefault(name.strip().lower(), set()).add(index)
+
+    @classmethod
+    def from_files(cls, paths):
+        return cls([load_route(path.strip()) for path in paths if path.strip()])
+
+    def _cell(self, degrees):
+        return int(math.floor(degrees / self.grid_degrees))
+
+    def route_for(self, payload):
+        # route index from an explicit routeId, or the route serving both source and destination
+        route_id = payload.get('routeId')
+        if route_id in self.routes_by_id:
+            return self.routes_by_id[route_id]
+
+        source = str(payload.get('trainSource') or '').strip().lower()
+        destination = str(payload.get('trainDestination') or '').strip().lower()
+        key = f'{source}|{destination}'
+        if key not in self._route_hints:
+            common = self._station_routes.get(source, set()) & self._station_routes.get(destination, set())
+            self._route_hints[key] = min(common) if len(common) == 1 else None
+        return self._route_hints[key]
+
+    def snap_many(self, points, hints=None):
+        # points: [(lat, lon)], hints: optional route index per point (None = any route).
+        # Returns per point (route index, distance along route in km, offset from track in km)
+        # or None when no route is within the snap distance.
+        hints = hints or [None] * len(points)
+        ping_index, seg_index = [], []
+        for i, (lat, lon) in enumerate(points):
+            segs = self.grid.get((self._cell(lat), self._cell(lon)), ())
+            if hints[i] is not None:
+                segs = [seg for seg in segs if self.seg_route[seg] == hints[i]]
+            ping_index.extend([i] * len(segs))
+            seg_index.extend(segs)
+
+        results = [None] * len(points)
+        if not seg_index:
+            return results
+
+        ping_index = np.asarray(ping_index)
+        seg_index = np.asarray(seg_index)
+        coords = np.asarray(points, dtype=float)[ping_index]
+        start = self.seg_start[seg_index]
+        end = self.seg_end[seg_index]
+
+        # project onto each candidate segment on a local equirectangular plane
+        scale = np.cos(np.radians(coords[:, 0]))
+        dx = (end[:, 1] - start[:, 1]) * scale
+        dy = end[:, 0] - start[:, 0]
+        px = (coords[:, 1] - start[:, 1]) * scale
+        py = coords[:, 0] - start[:, 0]
+        norm = dx * dx + dy * dy
+        t = np.clip(np.divide(px * dx + py * dy, norm, out=np.zeros_like(norm), where=norm > 0), 0.0, 1.0)
+        snapped_lat = start[:, 0] + t * (end[:, 0] - start[:, 0])
+        snapped_lon = start[:, 1] + t * (end[:, 1] - start[:, 1])
+        offset = haversine_km(coords[:, 0], coords[:, 1], snapped_lat, snapped_lon)
+
+        # closest candidate per ping: sort by (ping, offset) and keep the first of each ping
+        order = np.lexsort((offset, ping_index))
+        firsts = order[np.unique(ping_index[order], return_index=True)[1]]
+        for pair in firsts:
+            if offset[pair] > self.max_snap_km:
+                continue
+            seg = seg_index[pair]
+            distance = self.seg_offset[seg] + t[pair] * self.seg_length[seg]
+            results[ping_index[pair]] = (int(self.seg_route[seg]), float(distance), float(offset[pair]))
+        return results
+
+    def progress(self, snap, timestamp, payload, previous=None):
+        # Route fields of a train item from a snap result, the ping's arrival time (epoch
+        # seconds) and the train's previous item
+        route_index, distance, _ = snap
+        route = self.routes[route_index]
+        previous = previous or {}
+        same_route = previous.get('routeId') == route.route_id and 'distanceAlongRoute' in previous
+
+        direction = previous.get('routeDirection') if same_route else None
+        speed = previous.get('speedKmh') if same_route else None
+        if same_route:
+            moved = distance - float(previous['distanceAlongRoute'])
+            elapsed = timestamp - float(previous.get('approximateArrivalTimestamp') or timestamp)
+            if abs(moved) > 0.05:
+                direction = 1 if moved > 0 else -1
+            if elapsed > 0:
+                sample = abs(moved) / elapsed * 3600
+                speed = sample if speed is None else SPEED_SMOOTHING * sample + (1 - SPEED_SMOOTHING) * float(speed)
+        if direction is None:
+            # first ping on the route: running towards the end named as destination
+            destination = str(payload.get('trainDestination') or '').strip().lower()
+            first = route.station_names[0].strip().lower() if route.station_names else None
+            direction = -1 if destination and destination == first else 1
+
+        fields = dict.fromkeys(ROUTE_FIELDS)
+        fields.update({
+            'routeId': route.route_id,
+            'distanceAlongRoute': round(distance, 3),
+            'routeDirection': direction,
+            'speedKmh': round(speed, 1) if speed is not None else None,
+        })
+        upcoming = route.next_station(distance, direction)
+        if upcoming:
+            name, station_distance = upcoming
+            fields['nextStation'] = name
+            fields['distanceToNextStation'] = round(abs(station_distance - distance), 3)
+            if speed is not None and speed >= MIN_ETA_SPEED_KMH:
+                fields['nextStationEta'] = int(timestamp + abs(station_distance - distance) / speed * 3600)
+                _, terminus_distance = route.terminus(direction)
+                fields['terminusEta'] = int(timestamp + abs(terminus_distance - distance) / speed * 3600)
+        return fields
+
+
+def create_engine():
+    if not ROUTE_FILES:
+        return None
+    return RouteEngine.from_files(ROUTE_FILES.split(','))
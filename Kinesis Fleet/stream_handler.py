@@ -1,27 +1,65 @@
 import json
 import boto3
 import os
-import urllib.request
 import base64
-from boto3.dynamodb.conditions import Key, Attr
 import time
-from decimal import Decimal, getcontext, Inexact, Rounded
-
-# Set strict decimal context to trap rounding/inexact errors early
-context = getcontext()
-context.traps[Inexact] = True
-context.traps[Rounded] = True
+from concurrent.futures import ThreadPoolExecutor
+from geocode_cache import create_cache, fetch_address, geohash, REGION_CELL_PRECISION
+from position_codec import encode_item, decode_item, ping_key, sequence_key
+import track_store
+from live_updates import create_publisher
+from geofence import create_index
+from instrumentation import Metrics, iterator_age_ms
 
 kinesis = boto3.client('kinesis')
 kinesis_stream = os.environ['KINESIS_STREAM_NAME']
 
-dynamodb = boto3.resource('dynamodb')
+sqs = boto3.client('sqs')
+# addresses not found in the geocode cache are resolved later by enrichment_handler;
+# without a queue they are fetched inline
+enrichment_queue_url = os.environ.get('ENRICHMENT_QUEUE_URL')
+
+# low-level client, items are encoded by position_codec
+dynamodb = boto3.client('dynamodb')
 table_name = os.environ['DYNAMODB_TABLE_NAME']
 
-rev_geo_code_api_url = os.environ['REV_GEO_CODE_API_URL']
+# survive across invocations of a warm container
+geocode_cache = create_cache()
+live_publisher = create_publisher()
+
+# route snapping needs numpy and the route files in the deployment package,
+# so it is only loaded when ROUTE_FILES is set
+routes = None
+if os.environ.get('ROUTE_FILES'):
+    from route_engine import create_engine, ROUTE_FIELDS
+    routes = create_engine()
+
+# station arrival / departure events go to a Kinesis stream or an SQS queue
+geofences = create_index()
+geofence_stream = os.environ.get('GEOFENCE_EVENTS_STREAM_NAME')
+geofence_queue_url = os.environ.get('GEOFENCE_EVENTS_QUEUE_URL')
 
-dynamodb_table = dynamodb.Table(table_name)
+metrics = Metrics('stream_handler')
+# geocode cache stats reported per invocation
+GEOCODE_METRICS = {
+    'memory_hits': 'GeocodeMemoryHits',
+    'store_hits': 'GeocodeStoreHits',
+    'misses': 'GeocodeMisses',
+    'errors': 'GeocodeErrors'
+}
 
+# DynamoDB BatchGetItem accepts at most 100 keys per call
+BATCH_GET_LIMIT = 100
+# train items are written one conditional UpdateItem each (BatchWriteItem takes no
+# conditions), this many at a time
+WRITE_CONCURRENCY = int(os.environ.get('WRITE_CONCURRENCY', '16'))
+writer = ThreadPoolExecutor(max_workers=WRITE_CONCURRENCY)
+
+# a record is written only if it is newer than the stored one, compared on ping_key:
+# the ping's timestamp and index in its ingest request, not the Kinesis sequence number
+WRITE_CONDITION = 'attribute_not_exists(PK) OR attribute_not_exists(sequenceKey) OR sequenceKey < :sequenceKey'
+
+@metrics.handler
 def lambda_handler(event, context):
 
     # check preflight request
@@ -35,120 +73,341 @@ def lambda_handler(event, context):
             },
             'body': ''
         }
-    for record in event['Records']:
-        print('record', record)
-        decoded_bytes = base64.b64decode(record['kinesis']['data'])
-        decoded_str = decoded_bytes.decode('utf-8')
-        payload = json.loads(decoded_str)        
-        trainId = payload['trainId']
-        train_name = payload['trainName']
-
-        curr_sequence_number = int(record['kinesis']['sequenceNumber'])
-        last_arrival_time = record['kinesis']['approximateArrivalTimestamp']
-
-        # Check if the record exists
-        response = dynamodb_table.get_item(Key={'PK': str(trainId)})
-        item = response.get('Item', None)
-
-        if item:
-            print('time stamps', item['approximateArrivalTimestamp'],'and',last_arrival_time)
-            if item['lastSequenceNumber'] == curr_sequence_number or item['approximateArrivalTimestamp'] > last_arrival_time:
-                print('Duplicate or older record... Skipping processing the record')
-                return
-
-        # Prepare payload
-        payload['PK'] = str(trainId)
-        payload['trainName'] = train_name
-        payload['lastSequenceNumber'] = str(curr_sequence_number)
-        payload['lastUpdatedTime'] = int(time.time())
-        # Keep lat/lon as strings first, convert below
-        payload['latitude'] = str(payload['latitude'])
-        payload['longitude'] = str(payload['longitude'])
-        payload['approximateArrivalTimestamp'] = int(last_arrival_time)
-
-        # fetch address
-        geo_coded_address = fetch_reverse_geocode(payload['latitude'], payload['longitude'])
-        if not geo_coded_address:
-            print('Unable to fetch address for the given co-ords')
-            return
-
-        geo_coded_address = json.loads(geo_coded_address)
-        print('geo_coded address type', type(geo_coded_address), 'address', geo_coded_address['address'])
-        payload['address'] = geo_coded_address['address']
-
-        # Convert all floats (including nested) to Decimal
-        payload = convert_floats_to_decimal(payload)
-
-        # Validate no floats remain
-        assert_no_floats(payload)
-
-        if item:
-            expr_vals = {
-                ':val1': payload['lastSequenceNumber'],
-                ':val2': payload['approximateArrivalTimestamp'],
-                ':val3': payload['address'],
-                ':val4': payload['lastUpdatedTime'],
-                ':val5': payload['latitude'],
-                ':val6': payload['longitude']
-            }
-            expr_vals = convert_floats_to_decimal(expr_vals)
-            assert_no_floats(expr_vals)
-
-            response = dynamodb_table.update_item(
-                Key={'PK': trainId},
-                UpdateExpression="set lastSequenceNumber = :val1, approximateArrivalTimestamp = :val2, address = :val3, lastUpdatedTime = :val4, latitude = :val5, longitude = :val6",
-                ExpressionAttributeValues=expr_vals
-            )
-        else:
-            print('Putting the payload in the db', payload)
-            response = dynamodb_table.put_item(Item=payload)
 
-        print('Record inserted', item)
+    records = event.get('Records', [])
+    metrics.count('Records', len(records))
+    metrics.put('IteratorAgeMs', iterator_age_ms(records), 'Milliseconds')
+    metrics.log('Records', records)
+
+    # collapse the batch to the latest ping per train, so the work below
+    # scales with the number of trains rather than the number of pings
+    with metrics.timer('Decode'):
+        latest, train_pings = collapse_latest_per_train(records)
+        train_sequences = {
+            trainId: [str(ping['sequenceNumber']) for ping in pings] for trainId, pings in train_pings.items()
+        }
+    metrics.count('Trains', len(latest))
+
+    # ordering is enforced by the conditional write, the previous item is only read
+    # when route progress or geofences are derived from it
+    current_state = {}
+    if routes or geofences:
+        try:
+            with metrics.timer('LoadState'):
+                current_state = load_current_state(latest.keys())
+        except Exception as e:
+            print('Error loading current train state', e)
+            failed_records = {seq for seqs in train_sequences.values() for seq in seqs}
+            metrics.count('FailedRecords', len(failed_records))
+            return batch_response(failed_records)
+    # Without the previous item, stale pings are only known once their write is rejected.
+    # With it, a replayed or out of order ping is dropped here, before it is compared
+    # with the newer stored position for route progress and geofence events (a shard
+    # holds all pings of a train, so nothing else writes the train in between)
+    fresh = {trainId: ping for trainId, ping in latest.items() if not is_stale(ping, current_state.get(trainId))}
+    skipped = set(latest) - set(fresh)
+
+    # positions are written right away, the address comes from the geocode cache
+    # or is filled in later by the enrichment stage
+    points = [(ping['payload']['latitude'], ping['payload']['longitude']) for ping in fresh.values()]
+    fetch = None if enrichment_queue_url else fetch_address
+    before = dict(geocode_cache.stats)
+    with metrics.timer('Geocode'):
+        addresses = dict(zip(fresh, geocode_cache.lookup_many(points, fetch)))
+    for stat, name in GEOCODE_METRICS.items():
+        metrics.count(name, geocode_cache.stats[stat] - before[stat])
+
+    progress = {}
+    if routes:
+        try:
+            with metrics.timer('Route'):
+                progress = route_progress(fresh, current_state)
+        except Exception as e:
+            # positions are still written, without route progress
+            print('Error snapping positions to routes', e)
+
+    failures = set()
+    items = []
+    events = {}
+    for trainId, ping in fresh.items():
+        try:
+            new_item = build_item(ping, addresses[trainId], progress.get(trainId))
+            if geofences:
+                # the previous fence comes from the state loaded above, no extra read
+                fence, train_events = geofences.transition(trainId, current_state.get(trainId), ping)
+                new_item.update(fence)
+                if train_events:
+                    events[trainId] = train_events
+        except Exception as e:
+            print('Error preparing record for train', trainId, e)
+            failures.update(train_sequences[trainId])
+            continue
 
+        items.append(new_item)
 
+    # events are sent before the new fence is stored, so a failed send is detected
+    # again when the record is retried (consumers deduplicate on eventId)
+    if events:
+        with metrics.timer('Geofence'):
+            failed_trains = publish_events(events)
+        for trainId in failed_trains:
+            failures.update(train_sequences[trainId])
+        items = [item for item in items if item['PK'] not in failed_trains]
+
+    with metrics.timer('Write'):
+        written, stale, failed_trains = write_items(items)
+    metrics.count('Written', len(written))
+    stale |= skipped
+    metrics.count('Duplicates', len(stale))
+    metrics.log('Duplicate or older records skipped for trains', sorted(stale))
+    for trainId in failed_trains:
+        failures.update(train_sequences[trainId])
+    items = [item for item in items if item['PK'] in written]
+
+    if enrichment_queue_url:
+        pending = [fresh[item['PK']] for item in items if not addresses[item['PK']]]
+        try:
+            with metrics.timer('Enqueue'):
+                enqueue_enrichment(pending)
+            metrics.count('EnrichmentQueued', len(pending))
+        except Exception as e:
+            # the position is already stored, the next ping of the train queues it again
+            print('Error queueing address enrichment', e)
+
+    # push the new positions to subscribed dashboards; updates held back by the rate limit
+    # go out with a later batch, the shard is never kept waiting for them
+    if live_publisher:
+        try:
+            with metrics.timer('Publish'):
+                sent = live_publisher.publish(items)
+                metrics.count('LiveMessages', sent)
+                metrics.count('LiveHeldBack', len(live_publisher.pending))
+        except Exception as e:
+            print('Error publishing live updates', e)
+
+    # every ping (not only the latest) goes to the track history, one segment per train
+    if track_store.TRACK_TABLE_NAME:
+        with metrics.timer('Track'):
+            failed_tracks = track_store.write_track(dynamodb, train_pings)
+        for trainId in failed_tracks:
+            failures.update(train_sequences[trainId])
+
+    metrics.count('FailedRecords', len(failures))
+    return batch_response(failures)
+
+
+def decode_record(record):
+    decoded_bytes = base64.b64decode(record['kinesis']['data'])
+    payload = json.loads(decoded_bytes.decode('utf-8'))
+    sequenceNumber = int(record['kinesis']['sequenceNumber'])
     return {
-        'statusCode': 200,
-        'body': json.dumps(item, cls=DecimalEncoder)
+        'payload': payload,
+        'sequenceNumber': sequenceNumber,
+        'key': ping_key(payload, sequenceNumber),
+        'approximateArrivalTimestamp': record['kinesis']['approximateArrivalTimestamp']
     }
 
 
-def convert_floats_to_decimal(obj):
-    if isinstance(obj, dict):
-        return {k: convert_floats_to_decimal(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_floats_to_decimal(i) for i in obj]
-    elif isinstance(obj, float):
-        print(f"Converting float to Decimal: {obj}")
-        return Decimal(str(obj))
-    else:
-        return obj
-
-def assert_no_floats(obj):
-    if isinstance(obj, dict):
-        for v in obj.values():
-            assert_no_floats(v)
-    elif isinstance(obj, list):
-        for i in obj:
-            assert_no_floats(i)
-    elif isinstance(obj, float):
-        raise TypeError(f"Float value found in payload at leaf: {obj}")
-
-def fetch_reverse_geocode(lat, lon):
-    fq_url = f'{rev_geo_code_api_url}&lat={lat}&lon={lon}'
-
-    print('api url', fq_url)
-    req = urllib.request.Request(fq_url, headers={'Content-Type':'application/json'},method='GET')
+def collapse_latest_per_train(records):
+    # Returns ({trainId: latest ping}, {trainId: [all pings]})
+    latest = {}
+    train_pings = {}
+
+    for record in records:
+        try:
+            ping = decode_record(record)
+            trainId = str(ping['payload']['trainId'])
+        except Exception as e:
+            # a malformed record will never decode, retrying it would block the shard
+            print('Skipping malformed record', record['kinesis'].get('sequenceNumber'), e)
+            metrics.count('MalformedRecords')
+            continue
+
+        train_pings.setdefault(trainId, []).append(ping)
+        current = latest.get(trainId)
+        if current is None or (ping['key'], ping['sequenceNumber']) > (current['key'], current['sequenceNumber']):
+            latest[trainId] = ping
+
+    return latest, train_pings
+
+
+def load_current_state(train_ids):
+    train_ids = list(train_ids)
+    state = {}
+    for start in range(0, len(train_ids), BATCH_GET_LIMIT):
+        request = {
+            table_name: {
+                'Keys': [{'PK': {'S': trainId}} for trainId in train_ids[start:start + BATCH_GET_LIMIT]]
+            }
+        }
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for attributes in response['Responses'].get(table_name, []):
+                item = decode_item(attributes)
+                state[item['PK']] = item
+            request = response.get('UnprocessedKeys')
+    return state
+
+
+def is_stale(ping, previous):
+    # True if the stored item is from this ping or a newer one
+    if not previous:
+        return False
+    stored = previous.get('sequenceKey')
+    if stored is None and previous.get('lastSequenceNumber') is not None:
+        stored = sequence_key(previous['lastSequenceNumber'])
+    return stored is not None and ping['key'] <= stored
+
+
+def route_progress(pings, current_state):
+    # {trainId: route fields}, every ping of the batch snapped in one go
+    train_ids = list(pings)
+    payloads = [pings[trainId]['payload'] for trainId in train_ids]
+    points = [(float(payload['latitude']), float(payload['longitude'])) for payload in payloads]
+    snaps = routes.snap_many(points, [routes.route_for(payload) for payload in payloads])
+
+    progress = {}
+    for trainId, payload, snap in zip(train_ids, payloads, snaps):
+        if snap:
+            timestamp = float(pings[trainId]['approximateArrivalTimestamp'])
+            progress[trainId] = routes.progress(snap, timestamp, payload, current_state.get(trainId))
+        else:
+            # off every known route, clear the progress of an earlier ping
+            progress[trainId] = dict.fromkeys(ROUTE_FIELDS)
+    return progress
+
+
+def build_item(ping, address, progress=None):
+    payload = dict(ping['payload'])
+    trainId = str(payload['trainId'])
+
+    # Prepare payload
+    payload['PK'] = trainId
+    # the index only orders pings with the same timestamp, it is kept in sequenceKey
+    payload.pop('ingestIndex', None)
+    payload['lastSequenceNumber'] = str(ping['sequenceNumber'])
+    payload['sequenceKey'] = ping['key']
+    payload['lastUpdatedTime'] = int(time.time())
+    payload['approximateArrivalTimestamp'] = int(ping['approximateArrivalTimestamp'])
+    # partition key of the region index used by fetch_handler's bulk endpoint
+    payload['regionCell'] = geohash(payload['latitude'], payload['longitude'], REGION_CELL_PRECISION)
+
+    if address:
+        payload['address'] = address
+        payload['addressSequenceNumber'] = payload['lastSequenceNumber']
+        payload['addressSequenceKey'] = payload['sequenceKey']
+    if progress:
+        payload.update(progress)
+
+    # attributes of the stored item that this ping does not carry are kept by the update
+    return payload
+
+
+def write_items(items):
+    # Returns (written, stale, failed) trainIds
+    results = list(writer.map(write_item, items))
+    written = {item['PK'] for item, result in zip(items, results) if result == 'written'}
+    stale = {item['PK'] for item, result in zip(items, results) if result == 'stale'}
+    failed = {item['PK'] for item, result in zip(items, results) if result == 'failed'}
+    return written, stale, failed
+
+
+def write_item(item):
+    # SET the fields of the ping, REMOVE the ones cleared (None), in one conditional update
+    encoded = encode_item(item)
+    names = {}
+    values = {':sequenceKey': encoded['sequenceKey']}
+    assignments = []
+    removals = []
+    for index, (name, value) in enumerate(item.items()):
+        if name == 'PK':
+            continue
+        names[f'#f{index}'] = name
+        if value is None:
+            removals.append(f'#f{index}')
+        else:
+            values[f':f{index}'] = encoded[name]
+            assignments.append(f'#f{index} = :f{index}')
+
+    expression = 'SET ' + ', '.join(assignments)
+    if removals:
+        expression += ' REMOVE ' + ', '.join(removals)
     try:
-        with urllib.request.urlopen(req) as response:
-            result = response.read().decode()
-            print('result from geocode', result)
-            return result
+        dynamodb.update_item(
+            TableName=table_name,
+            Key={'PK': encoded['PK']},
+            UpdateExpression=expression,
+            ConditionExpression=WRITE_CONDITION,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+        return 'written'
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return 'stale'
     except Exception as e:
-        print('api exception',e)
-        return None
-
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return int(obj) if obj % 1 == 0 else float(obj)
-        return super(DecimalEncoder, self).default(obj)
+        print('Error writing train', item['PK'], e)
+        return 'failed'
+
+
+def enqueue_enrichment(pings):
+    # SendMessageBatch accepts at most 10 messages per call
+    for start in range(0, len(pings), 10):
+        entries = []
+        for index, ping in enumerate(pings[start:start + 10]):
+            entries.append({
+                'Id': str(index),
+                'MessageBody': json.dumps({
+                    'trainId': str(ping['payload']['trainId']),
+                    'sequenceNumber': str(ping['sequenceNumber']),
+                    'sequenceKey': ping['key'],
+                    'latitude': str(ping['payload']['latitude']),
+                    'longitude': str(ping['payload']['longitude'])
+                })
+            })
+        response = sqs.send_message_batch(QueueUrl=enrichment_queue_url, Entries=entries)
+        if response.get('Failed'):
+            print('Failed to queue enrichment for', response['Failed'])
+
+
+def publish_events(events_by_train):
+    # Returns the trainIds whose events could not be sent
+    if not geofence_stream and not geofence_queue_url:
+        for train_events in events_by_train.values():
+            for event in train_events:
+                print('Geofence event', json.dumps(event))
+        return set()
+
+    failed = set()
+    events = [event for train_events in events_by_train.values() for event in train_events]
+    # PutRecords accepts at most 500 records and SendMessageBatch 10 messages per call
+    chunk_size = 500 if geofence_stream else 10
+    for start in range(0, len(events), chunk_size):
+        chunk = events[start:start + chunk_size]
+        try:
+            if geofence_stream:
+                response = kinesis.put_records(StreamName=geofence_stream, Records=[
+                    {'Data': json.dumps(event).encode('utf-8'), 'PartitionKey': event['trainId']} for event in chunk
+                ])
+                failed.update(
+                    event['trainId'] for event, result in zip(chunk, response['Records']) if result.get('ErrorCode')
+                )
+            else:
+                response = sqs.send_message_batch(QueueUrl=geofence_queue_url, Entries=[
+                    {'Id': str(index), 'MessageBody': json.dumps(event)} for index, event in enumerate(chunk)
+                ])
+                failed.update(chunk[int(entry['Id'])]['trainId'] for entry in response.get('Failed', []))
+        except Exception as e:
+            print('Error sending geofence events', e)
+            failed.update(event['trainId'] for event in chunk)
+    metrics.count('GeofenceEvents', len(events))
+    metrics.count('GeofenceFailedTrains', len(failed))
+    return failed
+
+
+def batch_response(failed_sequence_numbers):
+    # Partial batch response, requires ReportBatchItemFailures on the event source mapping
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': seq} for seq in sorted(failed_sequence_numbers, key=int)
+        ]
+    }
@@ -1,41 +1,208 @@
 import json
+import time
+import base64
 import boto3
 import os
+from instrumentation import Metrics
 
 kinesis = boto3.client('kinesis')
 KINESIS_STREAM = os.environ['KINESIS_STREAM_NAME']
 
+# Kinesis PutRecords limits
+MAX_RECORDS_PER_CALL = 500
+MAX_BYTES_PER_CALL = 5 * 1024 * 1024
+MAX_BYTES_PER_RECORD = 1024 * 1024
+MAX_PUT_ATTEMPTS = int(os.environ.get('MAX_PUT_ATTEMPTS', '4'))
+# device timestamps below this are taken as epoch seconds rather than milliseconds
+MIN_TIMESTAMP_MS = 10 ** 11
+
 cors_headers = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Headers': 'Content-Type',
     'Access-Control-Allow-Methods': 'OPTIONS,POST'
 }
 
+metrics = Metrics('stream_ingest')
+
+@metrics.handler
 def lambda_handler(event, context):
-    # TODO implement
-    print('stream_ingest: event',event)
-    body = event.get('body',{})
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
 
+    metrics.log('stream_ingest: body', body)
     try:
-        body = json.loads(body)
-        trainId = body.get('trainId', '')
-        if not body:
-            return response(400, 'body is required')
-        responses = kinesis.put_records(
-            StreamName=KINESIS_STREAM,
-            Records=[
-                {
-                    'Data': json.dumps(body),
-                    'PartitionKey':  trainId
-                }
-            ]
-        )
-        print('kinesis response',responses)
+        with metrics.timer('Parse'):
+            pings, is_batch = parse_pings(body, event.get('headers') or {})
+    except ValueError as e:
+        print('stream_ingest: invalid body', e)
+        metrics.count('InvalidRequests')
+        return response(400, 'invalid body')
+
+    if not pings:
+        return response(400, 'body is required')
+    if not is_batch and (not isinstance(pings[0], dict) or not pings[0].get('trainId')):
+        metrics.count('InvalidRequests')
+        return response(400, 'trainId is required')
+
+    metrics.count('Pings', len(pings))
+    try:
+        with metrics.timer('Put'):
+            results = put_pings(pings)
     except Exception as e:
         print('stream_ingest: error', e)
+        metrics.count('FailedPings', len(pings))
         return response(500, 'error')
 
-    return response(200, 'success') 
+    failed = sum(1 for result in results if result['status'] != 'ok')
+    metrics.count('AcceptedPings', len(pings) - failed)
+    metrics.count('FailedPings', failed)
+
+    if not is_batch:
+        if results[0]['status'] == 'rejected':
+            return response(400, results[0]['error'])
+        return response(200, 'success') if not failed else response(500, 'error')
+
+    return response(200 if not failed else 207, {
+        'accepted': len(pings) - failed,
+        'failed': failed,
+        'results': results
+    })
+
+def parse_pings(body, headers):
+    # Accepts a single ping object, a JSON array of pings or NDJSON (one ping per line).
+    # Returns (pings, is_batch).
+    content_type = next((v for k, v in headers.items() if k.lower() == 'content-type'), '')
+    text = body.strip() if isinstance(body, str) else body
+
+    if not text:
+        return [], False
+
+    if 'ndjson' in content_type:
+        return parse_ndjson(text), True
+
+    if isinstance(text, str):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            # several lines that are not one JSON document: NDJSON without the header
+            if '\n' not in text:
+                raise
+            return parse_ndjson(text), True
+    else:
+        data = text
+    if isinstance(data, list):
+        return data, True
+    if isinstance(data, dict):
+        return ([data] if data else []), False
+    raise ValueError('body must be a ping object, an array of pings or NDJSON')
+
+def parse_ndjson(text):
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def stamp_ping(ping, index, received_ms):
+    # Every ping carries its order: the device 'timestamp' (epoch ms; the receive time when
+    # the device sends none) and its index in the request. stream_handler orders a train's
+    # pings on it, so retried entries, which get newer sequence numbers, don't overwrite
+    # newer positions. Raises ValueError for a timestamp that is not a number
+    timestamp = ping.get('timestamp')
+    if timestamp is None:
+        timestamp = received_ms
+    else:
+        try:
+            if isinstance(timestamp, bool):
+                raise TypeError
+            timestamp = float(timestamp)
+        except (TypeError, ValueError):
+            timestamp = None
+        if timestamp is None or not 0 < timestamp < float('inf'):
+            raise ValueError('timestamp must be epoch milliseconds')
+        if timestamp < MIN_TIMESTAMP_MS:
+            timestamp *= 1000
+    ping['timestamp'] = int(timestamp)
+    ping['ingestIndex'] = index
+
+def put_pings(pings):
+    # Sends pings to Kinesis in PutRecords calls that respect the count and size
+    # limits, retrying only the entries that failed. Returns one result per ping.
+    results = [None] * len(pings)
+    pending = []
+    received_ms = int(time.time() * 1000)
+
+    for index, ping in enumerate(pings):
+        if not isinstance(ping, dict) or not ping.get('trainId'):
+            results[index] = {'index': index, 'status': 'rejected', 'error': 'trainId is required'}
+            continue
+        try:
+            stamp_ping(ping, index, received_ms)
+        except ValueError as e:
+            results[index] = {'index': index, 'status': 'rejected', 'error': str(e)}
+            continue
+
+        data = json.dumps(ping).encode('utf-8')
+        partition_key = str(ping['trainId'])
+        if len(data) + len(partition_key) > MAX_BYTES_PER_RECORD:
+            results[index] = {'index': index, 'status': 'rejected', 'error': 'ping exceeds 1 MB'}
+            continue
+        pending.append((index, {'Data': data, 'PartitionKey': partition_key}))
+
+    attempt = 0
+    while pending:
+        attempt += 1
+        retry = []
+        for chunk in chunk_records(pending):
+            put_response = kinesis.put_records(
+                StreamName=KINESIS_STREAM,
+                Records=[record for _, record in chunk]
+            )
+            if not put_response.get('FailedRecordCount'):
+                for (index, _), entry in zip(chunk, put_response['Records']):
+                    results[index] = ok_result(index, entry)
+                continue
+
+            for (index, record), entry in zip(chunk, put_response['Records']):
+                if 'ErrorCode' in entry:
+                    retry.append((index, record))
+                    results[index] = {
+                        'index': index,
+                        'status': 'failed',
+                        'error': entry['ErrorCode'],
+                        'message': entry.get('ErrorMessage', '')
+                    }
+                else:
+                    results[index] = ok_result(index, entry)
+
+        if not retry or attempt >= MAX_PUT_ATTEMPTS:
+            break
+
+        metrics.count('PutRetries', len(retry))
+        time.sleep(min(0.1 * 2 ** (attempt - 1), 1.0))
+        pending = retry
+
+    return results
+
+def chunk_records(pending):
+    chunk = []
+    chunk_bytes = 0
+    for item in pending:
+        _, record = item
+        size = len(record['Data']) + len(record['PartitionKey'])
+        if chunk and (len(chunk) == MAX_RECORDS_PER_CALL or chunk_bytes + size > MAX_BYTES_PER_CALL):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(item)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+def ok_result(index, entry):
+    return {
+        'index': index,
+        'status': 'ok',
+        'shardId': entry.get('ShardId'),
+        'sequenceNumber': entry.get('SequenceNumber')
+    }
 
 def response(status_code, body):
     return {
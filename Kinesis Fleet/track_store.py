@@ -0,0 +1,232 @@
+import os
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal
+
+# Time-series store of train positions.
+# One item per train per stream batch ("segment"):
+#   PK            '<trainId>#<journeyDate>'
+#   SK            timestamp (ms) of the first point in the segment, its ingestIndex as the
+#                 fraction (pings of one request can share a timestamp and still land in
+#                 two batches)
+#   endTime, count
+#   points        zlib-compressed, delta + zigzag varint encoded (timestamp, lat, lon) triples
+#   pointIndexes  zlib-compressed varints, the ingestIndex of every point; with the
+#                 timestamp it orders pings of one request that share a timestamp
+#                 (segments written before it existed read as index 0)
+# Point timestamps are the ping's own 'timestamp' (stream_ingest sets one on every ping);
+# pings of one PutRecords upload share their arrival time, which says nothing about order.
+# A journey is one partition, so a time window is read back with a single Query.
+# Segments follow the batches, so pings redelivered after a partial batch failure land
+# in a second segment that overlaps the first; query_track drops the repeated points.
+
+TRACK_TABLE_NAME = os.environ.get('TRACK_TABLE_NAME')
+
+# a segment never spans more than this, so a window query only has to look back this far
+SEGMENT_MAX_MS = int(os.environ.get('TRACK_SEGMENT_MAX_SECONDS', '900')) * 1000
+# 1e-7 degrees, the precision of the route files
+COORD_SCALE = 10 ** 7
+# DynamoDB BatchWriteItem accepts at most 25 items per call
+BATCH_WRITE_LIMIT = 25
+
+
+def partition_key(trainId, journeyDate):
+    return f'{trainId}#{journeyDate}'
+
+
+def journey_date_for(payload, timestamp_ms):
+    journeyDate = payload.get('journeyDate')
+    if journeyDate:
+        return str(journeyDate)
+    return datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_points(points):
+    # points: (timestamp_ms, lat, lon) sorted by timestamp
+    out = bytearray()
+    _write_varint(out, len(points))
+    prev = (0, 0, 0)
+    for timestamp, lat, lon in points:
+        current = (int(timestamp), round(float(lat) * COORD_SCALE), round(float(lon) * COORD_SCALE))
+        for value, previous in zip(current, prev):
+            _write_varint(out, _zigzag(value - previous))
+        prev = current
+    return zlib.compress(bytes(out))
+
+
+def decode_points(blob):
+    data = zlib.decompress(bytes(blob))
+    position = 0
+
+    def read_varint():
+        nonlocal position
+        result = 0
+        shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            result |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    count = read_varint()
+    points = []
+    timestamp = lat = lon = 0
+    for _ in range(count):
+        timestamp += _unzigzag(read_varint())
+        lat += _unzigzag(read_varint())
+        lon += _unzigzag(read_varint())
+        points.append((timestamp, lat / COORD_SCALE, lon / COORD_SCALE))
+    return points
+
+
+def encode_indexes(indexes):
+    out = bytearray()
+    for index in indexes:
+        _write_varint(out, index)
+    return zlib.compress(bytes(out))
+
+
+def decode_indexes(blob):
+    indexes = []
+    value = shift = 0
+    for byte in zlib.decompress(bytes(blob)):
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            indexes.append(value)
+            value = shift = 0
+    return indexes
+
+
+def segment_items(trainId, journeyDate, points):
+    # Splits a train's (timestamp, lat, lon, ingestIndex) points into segments of at most
+    # SEGMENT_MAX_MS and returns them as low-level client items.
+    points = sorted(points, key=lambda point: (point[0], point[3]))
+    items = []
+    start = 0
+    for index in range(1, len(points) + 1):
+        if index < len(points) and points[index][0] - points[start][0] < SEGMENT_MAX_MS:
+            continue
+        segment = points[start:index]
+        items.append({
+            'PK': {'S': partition_key(trainId, journeyDate)},
+            'SK': {'N': f'{segment[0][0]}.{segment[0][3]:06d}'},
+            'endTime': {'N': str(segment[-1][0])},
+            'count': {'N': str(len(segment))},
+            'points': {'B': encode_points([point[:3] for point in segment])},
+            'pointIndexes': {'B': encode_indexes([point[3] for point in segment])},
+        })
+        start = index
+    return items
+
+
+def point_time(ping):
+    # epoch ms of a ping; pings queued before stream_ingest stamped them use the arrival time
+    timestamp = ping['payload'].get('timestamp')
+    if timestamp is not None:
+        return int(timestamp)
+    return int(float(ping['approximateArrivalTimestamp']) * 1000)
+
+
+def write_track(client, pings_by_train):
+    # pings_by_train: {trainId: [ping]}, pings as decoded by stream_handler
+    # Returns the trainIds whose segments could not be written.
+    items = []
+    owners = []
+    for trainId, pings in pings_by_train.items():
+        by_journey = {}
+        for ping in pings:
+            payload = ping['payload']
+            timestamp = point_time(ping)
+            journeyDate = journey_date_for(payload, timestamp)
+            by_journey.setdefault(journeyDate, []).append(
+                (timestamp, payload['latitude'], payload['longitude'], int(payload.get('ingestIndex', 0)))
+            )
+        for journeyDate, points in by_journey.items():
+            for item in segment_items(trainId, journeyDate, points):
+                items.append(item)
+                owners.append(trainId)
+
+    failed = set()
+    for start in range(0, len(items), BATCH_WRITE_LIMIT):
+        chunk = items[start:start + BATCH_WRITE_LIMIT]
+        try:
+            pending = {TRACK_TABLE_NAME: [{'PutRequest': {'Item': item}} for item in chunk]}
+            # unprocessed items are retried a few times
+            for _ in range(5):
+                pending = client.batch_write_item(RequestItems=pending).get('UnprocessedItems')
+                if not pending:
+                    break
+            if pending:
+                raise RuntimeError('unprocessed track segments')
+        except Exception as e:
+            print('Error writing track segments', e)
+            failed.update(owners[start:start + BATCH_WRITE_LIMIT])
+    return failed
+
+
+def query_track(table, trainId, journeyDate, start_ms, end_ms):
+    # table is a boto3 resource Table; returns (timestamp_ms, lat, lon) within the window
+    from boto3.dynamodb.conditions import Key
+
+    # segments starting within end_ms have an SK below end_ms + 1
+    condition = Key('PK').eq(partition_key(trainId, journeyDate)) & Key('SK').between(
+        max(0, start_ms - SEGMENT_MAX_MS), Decimal(end_ms) + Decimal('0.999999')
+    )
+    kwargs = {'KeyConditionExpression': condition, 'ProjectionExpression': 'points, pointIndexes'}
+
+    # a set, a redelivered ping decodes to the same point in every segment holding it
+    points = set()
+    while True:
+        response = table.query(**kwargs)
+        for item in response['Items']:
+            segment = decode_points(_binary(item['points']))
+            indexes = decode_indexes(_binary(item['pointIndexes'])) if 'pointIndexes' in item else [0] * len(segment)
+            for (timestamp, lat, lon), index in zip(segment, indexes):
+                if start_ms <= timestamp <= end_ms:
+                    points.add((timestamp, index, lat, lon))
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return [(timestamp, lat, lon) for timestamp, _, lat, lon in sorted(points)]
+
+
+def _binary(value):
+    # the resource's Binary wrapper or bytes
+    return getattr(value, 'value', value)
+
+
+def encode_polyline(points, precision=5):
+    # Google encoded polyline of (timestamp, lat, lon) points
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for _, lat, lon in points:
+        lat_i = round(lat * factor)
+        lon_i = round(lon * factor)
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return ''.join(out)
@@ -0,0 +1,81 @@
+import json
+from geocode_cache import cells_covering, REGION_CELL_PRECISION
+from live_updates import MAX_TOPICS_PER_CONNECTION, TooManyTopics, WebSocketBroker, train_topic, region_topic
+
+# API Gateway WebSocket routes for live position updates ($connect, $disconnect, subscribe,
+# unsubscribe). Messages:
+#   {"action": "subscribe", "trainIds": ["773983"], "regions": ["ttn"], "bbox": [minLon, minLat, maxLon, maxLat]}
+#   {"action": "unsubscribe", "trainIds": ["773983"]}
+# Updates are pushed by stream_handler through live_updates.LivePublisher. A connection
+# holds at most MAX_TOPICS_PER_CONNECTION topics over all its subscribe messages.
+
+broker = WebSocketBroker()
+
+
+def lambda_handler(event, context):
+    request_context = event['requestContext']
+    route = request_context.get('routeKey')
+    connection_id = request_context['connectionId']
+
+    if route == '$connect':
+        return response(200, 'connected')
+
+    if route == '$disconnect':
+        try:
+            broker.unsubscribe(connection_id)
+        except Exception as e:
+            print('Error removing subscriptions for', connection_id, e)
+        return response(200, 'disconnected')
+
+    try:
+        message = json.loads(event.get('body') or '{}')
+        topics = topics_for(message)
+    except (ValueError, TypeError) as e:
+        return response(400, f'Invalid message: {e}')
+
+    action = message.get('action', route)
+    if not topics:
+        return response(400, 'trainIds, regions or bbox is required')
+    if action == 'subscribe' and len(topics) > MAX_TOPICS_PER_CONNECTION:
+        return response(400, str(TooManyTopics(MAX_TOPICS_PER_CONNECTION)))
+
+    try:
+        if action == 'subscribe':
+            broker.subscribe(connection_id, topics)
+        elif action == 'unsubscribe':
+            broker.unsubscribe(connection_id, topics)
+        else:
+            return response(400, f'Unknown action: {action}')
+    except TooManyTopics as e:
+        return response(400, str(e))
+    except Exception as e:
+        print('Error updating subscriptions for', connection_id, e)
+        return response(500, 'error')
+
+    return response(200, {'action': action, 'topics': sorted(topics)})
+
+
+def topics_for(message):
+    if not isinstance(message, dict):
+        raise ValueError('message must be a JSON object')
+    for field in ('trainIds', 'regions', 'bbox'):
+        if field in message and not isinstance(message[field], list):
+            raise ValueError(f'{field} must be a list')
+    topics = {train_topic(str(trainId)) for trainId in message.get('trainIds', [])}
+    topics.update(region_topic(str(cell)) for cell in message.get('regions', []))
+    if message.get('bbox'):
+        if len(message['bbox']) != 4:
+            raise ValueError('bbox must be [minLon, minLat, maxLon, maxLat]')
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in message['bbox'])
+        if min_lon > max_lon or min_lat > max_lat:
+            raise ValueError('bbox must be [minLon, minLat, maxLon, maxLat]')
+        cells = cells_covering(min_lon, min_lat, max_lon, max_lat, REGION_CELL_PRECISION)
+        topics.update(region_topic(cell) for cell in cells)
+    return topics
+
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body)
+    }
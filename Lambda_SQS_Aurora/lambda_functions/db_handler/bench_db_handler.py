@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import time
+import uuid
+
+# Rows/sec of db_handler at several SQS batch sizes against the previous path
+# (a new connection and a single-row INSERT per record), and of the batched path with
+# a connection per invocation against the warm connection kept by db_connection.py.
+# Needs a PostgreSQL server, e.g. local/docker-compose.yml; --proxy-port goes through
+# its PgBouncer. The rows go to a separate bench_orders table.
+#
+#   python bench_db_handler.py --host localhost --user order_admin --password order_local \
+#       --records 5000 --batch-sizes 1 10 100
+#   python bench_db_handler.py ... --proxy-port 6432
+
+TABLE = 'bench_orders'
+SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        order_id VARCHAR(64) PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        order_date DATE,
+        status VARCHAR(20)
+    );
+"""
+
+
+def sample_records(count):
+    return [{
+        'messageId': str(uuid.uuid4()),
+        'receiptHandle': 'bench',
+        'body': json.dumps({'user_id': i % 1000, 'product_id': i % 50, 'quantity': i % 5 + 1, 'order_date': '2025-08-02'}),
+    } for i in range(count)]
+
+
+def legacy_path(index_handler, records):
+    for msg in records:
+        body = json.loads(msg['body'])
+        conn = index_handler.get_db_connection()
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    INSERT INTO {TABLE} (order_id,user_id, product_id, quantity, order_date, status)
+                    VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (order_id) DO NOTHING;
+                    """,
+                    (msg['messageId'], body['user_id'], body['product_id'], body.get('quantity', 1), body.get('order_date'), 'pending')
+                )
+        conn.close()
+
+
+def batched_path(index_handler, records, batch_size, warm=True):
+    for start in range(0, len(records), batch_size):
+        if not warm:
+            # a cold container for every invocation
+            index_handler.db.close()
+        response = index_handler.handler({'Records': records[start:start + batch_size]}, None)
+        assert not response['batchItemFailures'], response
+
+
+def run(name, index_handler, func, *args):
+    conn = index_handler.get_db_connection()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(f'TRUNCATE {TABLE}')
+    conn.close()
+    index_handler.db.close()
+    index_handler.db.total = {'Connects': 0, 'Reuses': 0}
+
+    records = args[0]
+    # the handler's metric logs are left out
+    index_handler.db.flush_metrics = lambda: None
+    start = time.perf_counter()
+    func(index_handler, *args)
+    elapsed = time.perf_counter() - start
+    connects = index_handler.db.total['Connects']
+    print(f'{name:<18} {len(records) / elapsed:>10,.0f} rows/sec  ({elapsed:.2f}s, {connects} handler connections, '
+          f'reuse {index_handler.db.reuse_rate():.0f}%)')
+    return len(records) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the db_handler write path.')
+    parser.add_argument('--host', default=os.environ.get('DB_ENDPOINT', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('DB_PORT', '5432')))
+    parser.add_argument('--proxy-port', type=int, help='Connect through the pooler on this port of --host')
+    parser.add_argument('--dbname', default=os.environ.get('DB_NAME', 'order_db'))
+    parser.add_argument('--user', default=os.environ.get('DB_USER', 'postgres'))
+    parser.add_argument('--password', default=os.environ.get('DB_PASSWORD', ''))
+    parser.add_argument('--records', type=int, default=2000, help='Orders per run')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100], help='SQS batch sizes to measure')
+    args = parser.parse_args()
+
+    os.environ.update(
+        DB_ENDPOINT=args.host, DB_PORT=str(args.port), DB_NAME=args.dbname,
+        DB_USER=args.user, DB_PASSWORD=args.password, ORDERS_TABLE=TABLE
+    )
+    if args.proxy_port:
+        os.environ.update(DB_PROXY_ENDPOINT=args.host, DB_PROXY_PORT=str(args.proxy_port))
+    import index_handler
+
+    conn = index_handler.get_db_connection()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(SCHEMA)
+    conn.close()
+
+    records = sample_records(args.records)
+    legacy = run('per-record', index_handler, legacy_path, records)
+    for batch_size in args.batch_sizes:
+        cold = run(f'batch {batch_size} cold', index_handler, batched_path, records, batch_size, False)
+        warm = run(f'batch {batch_size} warm', index_handler, batched_path, records, batch_size)
+        print(f'speedup            {cold / legacy:.1f}x cold, {warm / legacy:.1f}x warm')
@@ -0,0 +1,122 @@
+import json
+import os
+import time
+import psycopg2
+
+# One database connection per warm Lambda container.
+# Opening a connection costs a TCP + TLS handshake and the Postgres authentication;
+# the connection is kept at module level and reused by the next invocations:
+#   - a connection idle for more than DB_PING_AFTER_SECONDS is checked with SELECT 1
+#     before use (Aurora or a proxy may have dropped it while the container was frozen)
+#     and replaced when it is dead
+#   - work that fails because the connection broke is run once more on a new one
+#     (the order inserts are idempotent)
+# Connections, reuses, reconnects and the handshake time are logged per invocation in
+# CloudWatch Embedded Metric Format (namespace DB_METRICS_NAMESPACE).
+
+DB_PING_AFTER_SECONDS = float(os.environ.get('DB_PING_AFTER_SECONDS', '10'))
+DB_METRICS_NAMESPACE = os.environ.get('DB_METRICS_NAMESPACE', 'LambdaSqsAurora')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'db_handler')
+
+# errors that mean the connection itself is broken
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class ConnectionManager:
+    def __init__(self, connect, ping_after=DB_PING_AFTER_SECONDS):
+        self.connect = connect
+        self.ping_after = ping_after
+        self.conn = None
+        self.last_used = 0.0
+        # since the container started
+        self.total = {'Connects': 0, 'Reuses': 0}
+        self._reset_metrics()
+
+    def _reset_metrics(self):
+        self.metrics = {'Connects': 0, 'Reuses': 0, 'Reconnects': 0, 'HandshakeMs': 0.0}
+
+    def _open(self):
+        start = time.perf_counter()
+        self.conn = self.connect()
+        self.metrics['HandshakeMs'] += (time.perf_counter() - start) * 1000
+        self.metrics['Connects'] += 1
+        self.total['Connects'] += 1
+
+    def _alive(self):
+        if self.conn is None or self.conn.closed:
+            return False
+        if time.monotonic() - self.last_used < self.ping_after:
+            return True
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            self.conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            print(f"DB connection is dead: {e}")
+            return False
+
+    def get(self):
+        # (connection, True if it was opened just now)
+        if self._alive():
+            self.metrics['Reuses'] += 1
+            self.total['Reuses'] += 1
+            return self.conn, False
+        if self.conn is not None:
+            self.metrics['Reconnects'] += 1
+            self.close()
+        self._open()
+        return self.conn, True
+
+    def run(self, work):
+        # work(connection) -> result, run once more on a new connection if the reused
+        # one turns out to be broken
+        conn, fresh = self.get()
+        try:
+            result = work(conn)
+        except CONNECTION_ERRORS as e:
+            self.close()
+            if fresh:
+                raise
+            print(f"DB connection lost ({e}), reconnecting")
+            self.metrics['Reconnects'] += 1
+            conn, _ = self.get()
+            try:
+                result = work(conn)
+            except CONNECTION_ERRORS:
+                self.close()
+                raise
+        self.last_used = time.monotonic()
+        return result
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+        self.conn = None
+
+    def reuse_rate(self):
+        uses = self.total['Connects'] + self.total['Reuses']
+        return 100.0 * self.total['Reuses'] / uses if uses else 0.0
+
+    def flush_metrics(self):
+        # prints this invocation's connection metrics as an EMF document and resets them
+        names = dict(self.metrics, ConnectionReuseRate=round(self.reuse_rate(), 2))
+        units = {'HandshakeMs': 'Milliseconds', 'ConnectionReuseRate': 'Percent'}
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': DB_METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': units.get(name, 'Count')} for name in names],
+                }],
+            },
+            'FunctionName': FUNCTION_NAME,
+            **{name: round(value, 2) if isinstance(value, float) else value for name, value in names.items()},
+        }
+        print(json.dumps(document))
+        self._reset_metrics()
+        return document
@@ -1,88 +1,121 @@
 import os
 import json
-import boto3
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import execute_values
-
-sqs = boto3.client('sqs')
+from db_connection import CONNECTION_ERRORS, ConnectionManager
 
 DB_ENDPOINT = os.environ['DB_ENDPOINT']
+DB_PORT = int(os.environ.get('DB_PORT', '5432'))
 DB_NAME = os.environ.get('DB_NAME', 'order_db')
 DB_USER = os.environ['DB_USER']
 DB_PASSWORD = os.environ['DB_PASSWORD']
-SQS_URL = os.environ['SQS_URL']
+# Optional connection pooler in front of Aurora (RDS Proxy, or PgBouncer locally, see
+# local/docker-compose.yml). Bursts of concurrent invocations then share the pooler's
+# database connections instead of opening one each.
+DB_PROXY_ENDPOINT = os.environ.get('DB_PROXY_ENDPOINT')
+DB_PROXY_PORT = int(os.environ.get('DB_PROXY_PORT', str(DB_PORT)))
+# RDS Proxy requires TLS: DB_SSLMODE=require
+DB_SSLMODE = os.environ.get('DB_SSLMODE', 'prefer')
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '5'))
+ORDERS_TABLE = os.environ.get('ORDERS_TABLE', 'orders')
+
+# The SQS event source mapping delivers batches of orders (BatchSize and
+# MaximumBatchingWindowInSeconds in lambda-sql-aurora.yaml). A batch is written with
+# one multi-row INSERT over the container's connection (see db_connection.py); if that
+# fails, the rows are written one by one so only the failing orders are reported back
+# as batchItemFailures (FunctionResponseTypes: ReportBatchItemFailures) and retried.
+# Successful messages are deleted by Lambda.
+
+# ORDERS_TABLE may be schema qualified ('schema.orders'), it is quoted as an identifier
+INSERT_QUERY = sql.SQL("""
+    INSERT INTO {table} (order_id, user_id, product_id, quantity, order_date, status)
+    VALUES %s ON CONFLICT (order_id) DO NOTHING
+""").format(table=sql.Identifier(*ORDERS_TABLE.split('.')))
 
-# Connect to Aurora Postgres
+# Connect to Aurora Postgres, through the pooler when one is configured
 def get_db_connection():
     conn = psycopg2.connect(
-        host=DB_ENDPOINT,
+        host=DB_PROXY_ENDPOINT or DB_ENDPOINT,
         database=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD,
-        port=5432
+        port=DB_PROXY_PORT if DB_PROXY_ENDPOINT else DB_PORT,
+        sslmode=DB_SSLMODE,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        # notice a connection that died while the container was frozen
+        keepalives=1,
+        keepalives_idle=30
     )
     return conn
 
-def handler(event, context):
-    # # Receive messages (batch size 1, but can be adjusted)
-    # print('Receiving messages')
-    # response = sqs.receive_message(
-    #     QueueUrl=SQS_URL,
-    #     MaxNumberOfMessages=1,
-    #     WaitTimeSeconds=10
-    # )
-    # print('Received messages')
+# kept across warm invocations
+db = ConnectionManager(get_db_connection)
 
+def handler(event, context):
     records = event.get('Records', [])
-
-    # messages = response.get('Messages', [])
-    # if not messages:
-    #     print("No messages in queue.")
-    #     return
-
     if not records:
         print("No records in event.")
-        return
-
-    print('records:', records)
+        db.flush_metrics()
+        return {'batchItemFailures': []}
 
     print(f"Processing {len(records)} records")
+    rows, failed = [], []
     for msg in records:
-        receipt_handle = msg['receiptHandle']
-        body = json.loads(msg['body'])
-        
-    
-        body['status'] = 'pending'
-    
-        order_id = msg['messageId']
-        user_id = body['user_id']
-        product_id = body['product_id']
-        quantity = body.get('quantity', 1)
-        order_date = body.get('order_date')
-        status = body['status']
+        try:
+            rows.append((msg['messageId'], order_row(msg)))
+        except Exception as e:
+            print(f"Invalid order in message {msg['messageId']}: {e}")
+            failed.append(msg['messageId'])
 
-        # Insert into DB
+    if rows:
         try:
-            print('Inserting into DB')
-            conn = get_db_connection()
-            with conn:
-                with conn.cursor() as cur:
-                    insert_query = """
-                        INSERT INTO orders (order_id,user_id, product_id, quantity, order_date, status)
-                        VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (order_id) DO NOTHING;
-                    """
-                    cur.execute(insert_query, (order_id,user_id, product_id, quantity, order_date, status))
-                    print('Inserted record successfully')
-            conn.close()
+            failed.extend(db.run(lambda conn: insert_orders(conn, rows)))
         except Exception as e:
-            print(f"DB Insert error: {e}")
-            return
-        finally:
-            print('Record processed')
+            print(f"DB connection error: {e}")
+            failed.extend(message_id for message_id, _ in rows)
+
+    print(f"Inserted {len(records) - len(failed)} records, {len(failed)} failed")
+    db.flush_metrics()
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
+
+def order_row(msg):
+    # (order_id, user_id, product_id, quantity, order_date, status) of an SQS message
+    body = json.loads(msg['body'])
+    return (
+        msg['messageId'],
+        body['user_id'],
+        body['product_id'],
+        body.get('quantity', 1),
+        body.get('order_date'),
+        'pending'
+    )
 
-        # Delete message from queue after successful insert
-        sqs.delete_message(
-            QueueUrl=SQS_URL,
-            ReceiptHandle=receipt_handle
-        )
-        print(f"Processed and deleted message {receipt_handle}")
+def insert_orders(conn, rows):
+    # rows: [(message id, row)]. Returns the message ids that could not be inserted
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                execute_values(cur, INSERT_QUERY.as_string(cur), [row for _, row in rows], page_size=len(rows))
+        return []
+    except CONNECTION_ERRORS:
+        # retried on a new connection by the caller
+        raise
+    except psycopg2.Error as e:
+        if len(rows) == 1:
+            print(f"DB Insert error for message {rows[0][0]}: {e}")
+            return [rows[0][0]]
+        print(f"Batch insert failed ({e}), inserting {len(rows)} rows one by one")
+
+    failed = []
+    for message_id, row in rows:
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, INSERT_QUERY.as_string(cur), [row])
+        except CONNECTION_ERRORS:
+            raise
+        except psycopg2.Error as e:
+            print(f"DB Insert error for message {message_id}: {e}")
+            failed.append(message_id)
+    return failed
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS orders (
+    order_id VARCHAR(64) PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    order_date DATE,
+    status VARCHAR(20)
+);
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# Seeds N synthetic orders into a local storage backend, runs report.process()
+# end to end and reports per-stage timings plus peak RSS.
+# Every order count runs in its own child process so peak RSS is not shared.
+#
+#   python benchmark.py                          # 1k .. 10M orders on sqlite
+#   python benchmark.py -n 1000 50000 -b memory
+
+DEFAULT_ORDER_COUNTS = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+PRODUCTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_products.json')
+SEED_CHUNK = 50_000
+
+
+def generate_orders(count, products, seed=42):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    transaction_types = ['cc', 'db', 'gc']
+
+    for order_id in range(count):
+        items = []
+        order_value = 0.0
+        for product in rng.sample(products, rng.randint(1, 4)):
+            quantity = rng.randint(1, 5)
+            items.append({'productId': product['productId'], 'count': quantity})
+            order_value += product['price'] * quantity
+
+        date = now - timedelta(seconds=rng.randint(0, 20 * 3600))
+        yield {
+            'orderID': order_id,
+            'date': date.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'order_value': round(order_value, 2),
+            'transaction_type': rng.choice(transaction_types),
+            'order_items': items,
+        }
+
+
+def seed(storage, count):
+    with open(PRODUCTS_FILE) as f:
+        products = json.load(f)
+    storage.put_products(products)
+
+    orders = generate_orders(count, products)
+    while True:
+        chunk = [order for _, order in zip(range(SEED_CHUNK), orders)]
+        if not chunk:
+            break
+        storage.put_orders(chunk)
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_single(count, backend):
+    # imported late so the environment picked by the parent is honoured
+    import report
+    import storage
+
+    start = time.perf_counter()
+    seed(storage.get_storage(), count)
+    seed_time = time.perf_counter() - start
+    rss_after_seed = peak_rss_mb()
+
+    timings = {}
+    start = time.perf_counter()
+    report.process(timings)
+    total = time.perf_counter() - start
+
+    result = {
+        'orders': count,
+        'backend': backend,
+        'seed': seed_time,
+        **timings,
+        'total': total,
+        'rss_after_seed_mb': rss_after_seed,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    print('BENCHMARK_RESULT ' + json.dumps(result))
+
+
+def run_all(counts, backend):
+    results = []
+    for count in counts:
+        env = dict(os.environ, STORAGE_BACKEND=backend)
+        with tempfile.TemporaryDirectory() as tmp:
+            env['SQLITE_PATH'] = os.path.join(tmp, 'bench.db')
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--single', str(count), '-b', backend],
+                env=env, capture_output=True, text=True
+            )
+
+        lines = [line for line in proc.stdout.splitlines() if line.startswith('BENCHMARK_RESULT ')]
+        if proc.returncode != 0 or not lines:
+            print(f'{count} orders: failed\n{proc.stderr}')
+            continue
+        result = json.loads(lines[-1].split(' ', 1)[1])
+        results.append(result)
+        print_row(result)
+    return results
+
+
+def print_row(result):
+    print(
+        f"{result['orders']:>10}  seed {result['seed']:8.2f}s  "
+        f"fetch {result['fetch']:8.3f}s  aggregate {result['aggregate']:8.3f}s  "
+        f"render {result['render']:6.3f}s  upload {result['upload']:6.3f}s  "
+        f"total {result['total']:8.3f}s  peak rss {result['peak_rss_mb']:8.1f} MB"
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark OrderReporting against a local storage backend.')
+    parser.add_argument('-n', '--orders', type=int, nargs='+', default=DEFAULT_ORDER_COUNTS, help='Order counts to benchmark')
+    parser.add_argument('-b', '--backend', choices=['sqlite', 'memory'], default='sqlite', help='Local storage backend')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        run_single(args.single, args.backend)
+    else:
+        run_all(args.orders, args.backend)
@@ -13,21 +13,15 @@ from reportlab.platypus import (
 from reportlab.lib.units import inch
 
 import io
-import os
-import boto3
-from boto3.session import Session
-
-
-bucket_name = os.environ.get('REPORTS_BUCKET_NAME')
-AWS_REGION = os.environ.get('AWS_REGION')
-
-
-s3_client = boto3.client('s3', region_name=AWS_REGION)
+from storage import get_storage
 
 
 def make_pdf(report):
-    print('===> report data', report)
+    document, pdf_file = render_pdf(report)
+    save_pdf_s3(document, pdf_file)
 
+
+def render_pdf(report):
     date = report['date'].strftime('%Y-%m-%d')
     total_orders = report['total_orders']
     total_sales = report['total_sales']
@@ -62,15 +56,16 @@ def make_pdf(report):
     ax.set_xticks([])  # remove default ticks
     plt.tight_layout()
 
-    # Save plot to buffer
-    buf = io.BytesIO()
-    plt.savefig(buf, format='PNG')
+    # Save plot to its own buffer, the PDF is written to a separate one
+    chart_buf = io.BytesIO()
+    plt.savefig(chart_buf, format='PNG')
     plt.close(fig)
-    buf.seek(0)
+    chart_buf.seek(0)
 
     # Step 2: Create PDF with reportlab
 
     pdf_file = f'{date}_sales_summary.pdf'
+    buf = io.BytesIO()
     doc = SimpleDocTemplate(buf, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=18)
     styles = getSampleStyleSheet()
 
@@ -100,7 +95,7 @@ def make_pdf(report):
     elements.append(Spacer(1, 12))
 
     # Insert bar chart image
-    img = Image(buf, width=6.5*inch, height=3*inch)
+    img = Image(chart_buf, width=6.5*inch, height=3*inch)
     elements.append(img)
     elements.append(Spacer(1, 24))
 
@@ -152,13 +147,12 @@ def make_pdf(report):
 
     print(f"PDF saved as {pdf_file}")
     buf.seek(0)
-    save_pdf_s3(buf, pdf_file)
+    return buf, pdf_file
 
 
 def save_pdf_s3(document, file_name):
     try:
-        print('bucketname', bucket_name, 'type', type(document))
-        s3_client.upload_fileobj(document, bucket_name, str(file_name) )
+        get_storage().upload_report(document, file_name)
         print('Saved report summary successfully to s3 bucket')
 
     except Exception as e:
@@ -1,33 +1,54 @@
-import json
+import time
 from collections import defaultdict
-from generate_pdf import make_pdf
+from generate_pdf import render_pdf, save_pdf_s3
 from datetime import datetime, timedelta, timezone
-import os
-import boto3
-from boto3.session import Session
-from boto3.dynamodb.conditions import Key, Attr
+from storage import get_storage
 
-orders_table_name = os.environ.get('ORDERS_TABLE_NAME')
-products_table_name = os.environ.get('PRODUCTS_TABLE_NAME')
-AWS_REGION = os.environ.get('AWS_REGION')
 
-dynamodb_client = boto3.resource('dynamodb', region_name=AWS_REGION)
-
-orders_table = dynamodb_client.Table(orders_table_name)
-products_table = dynamodb_client.Table(products_table_name)
-
-
-def process():
+def process(timings=None):
+    # timings (optional dict) is filled with seconds spent in each stage:
+    # fetch, aggregate, render and upload
+    if timings is None:
+        timings = {}
+    timings.update(fetch=0.0, aggregate=0.0, render=0.0, upload=0.0)
 
     now = datetime.now(timezone.utc)
     past_day = now - timedelta(hours=24)
     past_day = past_day.replace(hour=0, minute=0, second=0,microsecond=0)
     print('past day',past_day)
 
-    orders = get_past_day_orders( past_day)
+    # orders are streamed from storage and aggregated in a single pass
+    start = time.perf_counter()
+    orders = _timed_iter(get_past_day_orders(past_day), timings, 'fetch')
+    report_data = aggregate_orders(orders, past_day)
+    timings['aggregate'] = time.perf_counter() - start - timings['fetch']
+
+    if not report_data['total_orders']:
+        print('orders fetched are None')
+    else:
+        start = time.perf_counter()
+        products = get_products(report_data['product_counts'].keys())
+        timings['fetch'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        apply_product_prices(report_data, products)
+        timings['aggregate'] += time.perf_counter() - start
+
+    print('report data', report_data['total_orders'], 'orders', report_data['total_sales'], 'total sales')
+
+    start = time.perf_counter()
+    document, file_name = render_pdf(report_data)
+    timings['render'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    save_pdf_s3(document, file_name)
+    timings['upload'] = time.perf_counter() - start
 
+    return report_data
 
 
+def aggregate_orders(orders, past_day):
+    total_orders = 0
     total_sales = 0
     products_count = defaultdict(int)
     transaction_type = defaultdict(list)
@@ -35,101 +56,75 @@ def process():
     transaction_type["db"] = [0,0]
     transaction_type["gc"] = [0,0]
 
-    report_data = defaultdict(object)
-    product_wise_sales = defaultdict(float)
+    for order in orders:
+        total_orders += 1
+        order_value = order['order_value']
+        total_sales += order_value
+        for product in order['order_items']:
+            products_count[product['productId']] += product['count']
 
-    #report data
+        mode = transaction_type[order['transaction_type']]
+        mode[0] += 1
+        mode[1] += order_value
+
+    report_data = defaultdict(object)
     report_data['date'] = past_day
-    report_data['total_orders'] = len(orders) if orders else 0
+    report_data['total_orders'] = total_orders
     report_data['total_sales'] = total_sales
     report_data['product_counts'] = products_count
     report_data['transaction_types'] = transaction_type
-    report_data['product_wise_sales'] = product_wise_sales
+    report_data['product_wise_sales'] = defaultdict(float)
+    return report_data
 
-    if not orders:
-        print('orders fetched are None')
-        make_pdf(report_data)
-        return
-        
-    products = get_products(orders)
 
-    for order in orders:
-        total_sales += order['order_value']
-        for product in order['order_items']:
-            product_id = product['productId']
-            products_count[product_id] += product['count']
-        
-        mode = order['transaction_type']
-        transaction_type[mode][0] += 1
-        transaction_type[mode][1] += order['order_value']
-    
-    
+def apply_product_prices(report_data, products):
     price_map = {int(product['productId']):product['price'] for product in products}
 
-
+    product_wise_sales = report_data['product_wise_sales']
+    products_count = report_data['product_counts']
     for product_id in products_count:
         product_count = products_count[product_id]
 
         product_wise_sales[product_id] = product_count * price_map[int(product_id)]
 
-    report_data['date'] = past_day
-    report_data['total_orders'] = len(orders)
-    report_data['total_sales'] = total_sales
-    report_data['product_counts'] = products_count
-    report_data['transaction_types'] = transaction_type
-    report_data['product_wise_sales'] = product_wise_sales
-
-
-    print('report data', report_data)
-
-
-    make_pdf(report_data)
-
-    
 
 def get_past_day_orders(past_date):
 
     isodate = past_date.isoformat()
 
     try:
-        orders = orders_table.scan(
-            FilterExpression=Attr('date').gte(isodate)
-            )
-        
-        return orders['Items']
-        
+        yield from get_storage().scan_orders_since(isodate)
+
     except Exception as e:
+        # a scan that fails part way must not produce a report that looks complete
         print('Exception occured while getting orders', e)
-        return []
+        raise
 
 
-    
-def get_products(orders):
-    print('Querying products db', products_table_name)
+def get_products(product_ids):
+    print('Querying products db')
     try:
+        return get_storage().get_products(set(product_ids))
 
-        product_ids = [item['productId'] for order in orders for item in order['order_items']]
-        product_id_set = set(product_ids)
-
-        keys = [{'productId': pid} for pid in product_id_set]
-
-        response = dynamodb_client.batch_get_item(
-            RequestItems={
-                products_table_name:{
-                    'Keys': keys
-                }
-            }
-
-        )    
-        products = response['Responses']
-        return products.get(products_table_name,{})
-    
     except Exception as e:
+        # without prices the report can't be completed
         print('Error while getting products info', e)
-        return {}
+        raise
 
-if __name__ == '__main__':
-    process()
 
+def _timed_iter(iterable, timings, stage):
+    # accumulates the time spent producing items into timings[stage]
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[stage] += time.perf_counter() - start
+            return
+        timings[stage] += time.perf_counter() - start
+        yield item
 
 
+if __name__ == '__main__':
+    process()
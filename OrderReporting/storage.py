@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+from decimal import Decimal
+
+# Storage backend used by report.py and generate_pdf.py.
+#   dynamodb (default) - DynamoDB orders/products tables and the S3 reports bucket
+#   sqlite             - local SQLite file (SQLITE_PATH), reports stored as blobs
+#   memory             - plain Python lists/dicts, useful for quick profiling
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'dynamodb')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'order_reporting.db')
+
+# DynamoDB BatchGetItem accepts at most 100 keys per call
+BATCH_GET_LIMIT = 100
+
+_storage = None
+
+
+class DynamoDBStorage:
+    def __init__(self, orders_table_name, products_table_name, bucket_name, region=None):
+        import boto3
+
+        self.orders_table_name = orders_table_name
+        self.products_table_name = products_table_name
+        self.bucket_name = bucket_name
+
+        self.dynamodb = boto3.resource('dynamodb', region_name=region)
+        self.orders_table = self.dynamodb.Table(orders_table_name)
+        self.products_table = self.dynamodb.Table(products_table_name)
+        self.s3_client = boto3.client('s3', region_name=region)
+
+    def scan_orders_since(self, isodate):
+        from boto3.dynamodb.conditions import Attr
+
+        kwargs = {'FilterExpression': Attr('date').gte(isodate)}
+        while True:
+            page = self.orders_table.scan(**kwargs)
+            yield from page['Items']
+
+            last_key = page.get('LastEvaluatedKey')
+            if not last_key:
+                return
+            kwargs['ExclusiveStartKey'] = last_key
+
+    def get_products(self, product_ids):
+        product_ids = list(product_ids)
+        products = []
+        for start in range(0, len(product_ids), BATCH_GET_LIMIT):
+            request = {
+                self.products_table_name: {
+                    'Keys': [{'productId': pid} for pid in product_ids[start:start + BATCH_GET_LIMIT]]
+                }
+            }
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                products.extend(response['Responses'].get(self.products_table_name, []))
+                request = response.get('UnprocessedKeys')
+        return products
+
+    def put_orders(self, orders):
+        with self.orders_table.batch_writer() as batch:
+            for order in orders:
+                batch.put_item(Item=_to_decimal(order))
+
+    def put_products(self, products):
+        with self.products_table.batch_writer() as batch:
+            for product in products:
+                batch.put_item(Item=_to_decimal(product))
+
+    def upload_report(self, document, file_name):
+        self.s3_client.upload_fileobj(document, self.bucket_name, str(file_name))
+
+
+class SQLiteStorage:
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS orders (
+                order_id INTEGER PRIMARY KEY,
+                date TEXT NOT NULL,
+                order_value REAL NOT NULL,
+                transaction_type TEXT NOT NULL,
+                order_items TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS orders_date_idx ON orders (date);
+            CREATE TABLE IF NOT EXISTS products (
+                product_id INTEGER PRIMARY KEY,
+                price REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS reports (
+                name TEXT PRIMARY KEY,
+                body BLOB NOT NULL
+            );
+            """
+        )
+
+    def scan_orders_since(self, isodate):
+        cursor = self.conn.execute(
+            'SELECT order_id, date, order_value, transaction_type, order_items '
+            'FROM orders WHERE date >= ?',
+            (isodate,)
+        )
+        for order_id, date, order_value, transaction_type, order_items in cursor:
+            yield {
+                'orderID': order_id,
+                'date': date,
+                'order_value': order_value,
+                'transaction_type': transaction_type,
+                'order_items': json.loads(order_items),
+            }
+
+    def get_products(self, product_ids):
+        product_ids = [int(pid) for pid in product_ids]
+        products = []
+        # stay under SQLite's bound-parameter limit
+        for start in range(0, len(product_ids), 500):
+            chunk = product_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT product_id, price FROM products WHERE product_id IN ({placeholders})',
+                chunk
+            )
+            products.extend({'productId': pid, 'price': price} for pid, price in rows)
+        return products
+
+    def put_orders(self, orders):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)',
+                (
+                    (
+                        order['orderID'],
+                        order['date'],
+                        order['order_value'],
+                        order['transaction_type'],
+                        json.dumps(order['order_items']),
+                    )
+                    for order in orders
+                )
+            )
+
+    def put_products(self, products):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO products VALUES (?, ?)',
+                ((product['productId'], product['price']) for product in products)
+            )
+
+    def upload_report(self, document, file_name):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO reports VALUES (?, ?)',
+                (str(file_name), document.getbuffer())
+            )
+
+
+class InMemoryStorage:
+    def __init__(self):
+        self.orders = []
+        self.products = {}
+        self.reports = {}
+
+    def scan_orders_since(self, isodate):
+        return (order for order in self.orders if order['date'] >= isodate)
+
+    def get_products(self, product_ids):
+        return [self.products[int(pid)] for pid in product_ids if int(pid) in self.products]
+
+    def put_orders(self, orders):
+        self.orders.extend(orders)
+
+    def put_products(self, products):
+        for product in products:
+            self.products[int(product['productId'])] = product
+
+    def upload_report(self, document, file_name):
+        self.reports[str(file_name)] = document.getvalue()
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = create_storage(STORAGE_BACKEND)
+    return _storage
+
+
+def set_storage(storage):
+    global _storage
+    _storage = storage
+
+
+def create_storage(backend):
+    if backend == 'dynamodb':
+        return DynamoDBStorage(
+            os.environ.get('ORDERS_TABLE_NAME'),
+            os.environ.get('PRODUCTS_TABLE_NAME'),
+            os.environ.get('REPORTS_BUCKET_NAME'),
+            os.environ.get('AWS_REGION'),
+        )
+    if backend == 'sqlite':
+        return SQLiteStorage(SQLITE_PATH)
+    if backend == 'memory':
+        return InMemoryStorage()
+    raise ValueError(f'Unknown storage backend: {backend}')
+
+
+def _to_decimal(obj):
+    if isinstance(obj, list):
+        return [_to_decimal(i) for i in obj]
+    if isinstance(obj, dict):
+        return {k: _to_decimal(v) for k, v in obj.items()}
+    if isinstance(obj, float):
+        return Decimal(str(obj))
+    return obj
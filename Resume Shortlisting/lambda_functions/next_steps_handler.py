@@ -1,10 +1,8 @@
 import json
 import boto3
 import os
-import smtplib
 from boto3.dynamodb.conditions import Key, Attr
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from mailer import Mailer, Template
 
 dynamodb = boto3.resource('dynamodb')
 table_name = os.getenv('DYNAMODB_TABLE_NAME')
@@ -14,6 +12,24 @@ table = dynamodb.Table(table_name)
 from_email_address = os.environ['FROM_EMAIL_ADDRESS']
 app_password = os.environ['EMAIL_PASSWORD']
 
+# authenticated SMTP connections, reused while the container is warm
+mailer = Mailer(from_email_address, app_password)
+
+# static email, rendered once
+NEXT_STEPS_EMAIL = Template(
+    """
+    <html>
+    <body>
+    <p>"""
+    " <p> Congratulations! <br/> We are excited to inform you that you have been shortlisted for the Software Engineer position</p>"
+    "<p> at ABC Company. <br/> To move forward in the hiring process, you need to complete the following assessment with in 5 days</p>"
+    "<br/> Please find the link: <a href=''> Technical Assessment</a> <br/>"
+    """</p>
+    <p>All the best<br>ABC Company</p>
+    </body>
+    </html>"""
+)
+
 def lambda_handler(event, context):
     jobId = event['jobId']
     emailId = event['emailId']
@@ -34,39 +50,13 @@ def lambda_handler(event, context):
         print('Candidate shortlisting completed!')
         
 def send_email(jobId, receiver_email):
-    sender_email = from_email_address
     print('sending email to', receiver_email)
 
     subject = f"Update on you recent application! Job ID: {jobId}"
-    body = (
-        f" <p> Congratulations! <br/> We are excited to inform you that you have been shortlisted for the Software Engineer position</p>"
-        f"<p> at ABC Company. <br/> To move forward in the hiring process, you need to complete the following assessment with in 5 days</p>"
-        f"<br/> Please find the link: <a href=''> Technical Assessment</a> <br/>"
-        )
-
-    # Compose the email
-    message = MIMEMultipart()
-    message["From"] = sender_email
-    message["To"] = receiver_email
-    message["Subject"] = subject
-
-    html_content = f"""
-    <html>
-    <body>
-    <p>{body}</p>
-    <p>All the best<br>ABC Company</p>
-    </body>
-    </html>"""
-    
-    message.attach(MIMEText(html_content, "html"))
-    
 
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, app_password)
-            server.sendmail(sender_email, receiver_email, message.as_string())
-
-        print("Email sent successfully!")
+        status = mailer.send_html(receiver_email, subject, NEXT_STEPS_EMAIL.render())
+        print(f"Email {status} successfully!")
         
     except Exception as e:
         raise Exception('Error occurred while sending email: ', e)
@@ -1,14 +1,30 @@
 import json
 import boto3
 import os
-import smtplib
 from boto3.dynamodb.conditions import Key, Attr
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from mailer import Mailer, Template
 
 from_email_address = os.environ['FROM_EMAIL_ADDRESS']
 app_password = os.environ['EMAIL_PASSWORD']
 
+# authenticated SMTP connections, reused while the container is warm
+mailer = Mailer(from_email_address, app_password)
+
+# static email, rendered once
+REJECTION_EMAIL = Template(
+    """
+    <html>
+    <body>
+    <p>"""
+    " <p>Thank you for applying for Software Engineer role at ABC Company.</p>"
+    " <p> We are regretting to inform you that after careful consideration of your application, we are moving forward with candidates who"
+    " matches closely with the role workload. </p> <br/>"
+    """</p>
+    <p>Thank you once again for applying to ABC Compabny,<br>ABC Company</p>
+    </body>
+    </html>"""
+)
+
 bucket_name = os.environ['BUCKET_NAME']
 dynamodb_table_name = os.environ['DYNAMODB_TABLE_NAME']
 
@@ -39,37 +55,12 @@ def lambda_handler(event, context):
     print(f'Completed rejection process successfully for candidate {emailId} for job {jobId}')
 
 def send_email(jobId, receiver_email):
-    sender_email = from_email_address
     print('sending reject email to', receiver_email)
 
     subject = f"Update on you recent application! {jobId}"
-    body = (
-        f" <p>Thank you for applying for Software Engineer role at ABC Company.</p>"
-        f" <p> We are regretting to inform you that after careful consideration of your application, we are moving forward with candidates who"
-        f" matches closely with the role workload. </p> <br/>"
-        )
-
-    # Compose the email
-    message = MIMEMultipart()
-    message["From"] = sender_email
-    message["To"] = receiver_email
-    message["Subject"] = subject
-
-    html_content = f"""
-    <html>
-    <body>
-    <p>{body}</p>
-    <p>Thank you once again for applying to ABC Compabny,<br>ABC Company</p>
-    </body>
-    </html>"""
-    
-    message.attach(MIMEText(html_content, "html"))
-    
 
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, app_password)
-            server.sendmail(sender_email, receiver_email, message.as_string())
+        mailer.send_html(receiver_email, subject, REJECTION_EMAIL.render())
         
     except Exception as e:
         raise Exception('Error occurred while sending email: ', e)